@@ -0,0 +1,397 @@
+from src.input_validation import split_arguments, valid_number
+from src.watch_changes import FolderMonitor
+from src.manifest import ReplicaManifest
+from src.coalesce import EventCoalescer, coalesce_changes
+from src.run_summary import peak_memory_mb
+from src.synchronization import *
+from typing import Callable, Dict, List, Optional
+import threading
+import platform
+import tempfile
+import logging
+import shutil
+import json
+import time
+import sys
+import os
+
+
+BENCHMARK_OPTIONS = {
+    '--output=<file>': 'Write the JSON report to this file instead of the standard output.',
+    '--scale=<factor>': 'Multiply the size of every synthetic tree (default 1).',
+    '--directory=<path>': 'Folder where the synthetic trees are built (default: system temporary folder).',
+    '--scenarios=<name,...>': 'Comma separated scenarios to run (default: all).',
+    '--monitor=<process|thread>': 'Monitor mode used by the live scenarios (default process).',
+}
+
+
+def percentile(values:List[float], fraction:float) -> Optional[float]:
+    """
+    Returns the nearest-rank percentile of the given values, or None when there are none.
+    """
+    if not values:
+        return None
+
+    ordered:List[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def write_file(path:str, size:int) -> None:
+    with open(path, 'wb') as file:
+        remaining:int = size
+        while remaining > 0:
+            chunk:int = min(remaining, 1024 * 1024)
+            file.write(os.urandom(chunk))
+            remaining -= chunk
+
+
+def tree_size(directory_path:str) -> tuple:
+    """
+    Returns the number of files and their total size in bytes below a folder, skipping the manifest files.
+    """
+    files = size = 0
+    for current, _, names in os.walk(directory_path):
+        for name in names:
+            if not name.startswith(MANIFEST_FILENAME):
+                files += 1
+                size += os.path.getsize(os.path.join(current, name))
+    return files, size
+
+
+def build_small_files(root:str, scale:float) -> None:
+    """
+    10 000 files of 1 KiB spread over 100 folders.
+    """
+    for index in range(max(1, int(10000 * scale))):
+        folder:str = os.path.join(root, f"folder{index % 100}")
+        os.makedirs(folder, exist_ok=True)
+        write_file(os.path.join(folder, f"file{index}.txt"), 1024)
+
+
+def build_large_files(root:str, scale:float) -> None:
+    """
+    4 files of 64 MiB.
+    """
+    for index in range(4):
+        write_file(os.path.join(root, f"large{index}.bin"), max(1, int(64 * scale)) * 1024 * 1024)
+
+
+def build_deep_tree(root:str, scale:float) -> None:
+    """
+    A chain of 64 nested folders holding 20 files of 4 KiB each.
+    """
+    folder:str = root
+    for depth in range(max(1, int(64 * scale))):
+        folder = os.path.join(folder, f"level{depth}")
+        os.makedirs(folder)
+        for index in range(20):
+            write_file(os.path.join(folder, f"file{index}.txt"), 4096)
+
+
+TREES:Dict[str, Callable[[str, float], None]] = {
+    'small_files': build_small_files,
+    'large_files': build_large_files,
+    'deep_nesting': build_deep_tree,
+}
+
+
+def measure(scenario:str, phase:str, function:Callable[[], None], files:int, size:int) -> dict:
+    """
+    Runs one phase and returns its measurements.
+    """
+    started:float = time.perf_counter()
+    function()
+    seconds:float = time.perf_counter() - started
+
+    return {
+        'scenario': scenario,
+        'phase': phase,
+        'files': files,
+        'bytes': size,
+        'seconds': round(seconds, 4),
+        'files_per_sec': round(files / seconds, 1) if seconds else None,
+        'mb_per_sec': round(size / (1024 * 1024) / seconds, 2) if seconds else None,
+        'peak_rss_mb': peak_memory_mb(),
+    }
+
+
+def touch_fraction(source_directory_path:str, fraction:float) -> tuple:
+    """
+    Rewrites a fraction of the source files with new content of the same size.
+    Returns the number of rewritten files and their total size.
+    """
+    files = size = 0
+    for current, _, names in os.walk(source_directory_path):
+        for name in sorted(names)[::max(1, round(1 / fraction))]:
+            path:str = os.path.join(current, name)
+            file_size:int = os.path.getsize(path)
+            write_file(path, file_size)
+            os.utime(path, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+            files += 1
+            size += file_size
+    return files, size
+
+
+def tree_benchmark(scenario:str, workspace:str, scale:float) -> List[dict]:
+    """
+    Seeds an empty replica, reconciles it without changes and reconciles it again after 10% of the files changed.
+    """
+    source_directory_path:str = os.path.join(workspace, scenario, 'source')
+    replica_directory_path:str = os.path.join(workspace, scenario, 'replica')
+    os.makedirs(source_directory_path)
+    os.makedirs(replica_directory_path)
+
+    TREES[scenario](source_directory_path, scale)
+    files, size = tree_size(source_directory_path)
+    manifest = ReplicaManifest(replica_directory_path)
+
+    results:List[dict] = [
+        measure(scenario, 'seed', lambda: duplicate_source(source_directory_path, replica_directory_path, manifest), files, size),
+        measure(scenario, 'reconcile_unchanged', lambda: update_replica_directory(source_directory_path, replica_directory_path, manifest), files, 0),
+    ]
+
+    changed_files, changed_size = touch_fraction(source_directory_path, 0.1)
+    results.append(measure(scenario, 'reconcile_changed', lambda: update_replica_directory(source_directory_path, replica_directory_path, manifest), changed_files, changed_size))
+
+    manifest.close()
+    return results
+
+
+def rename_storm(workspace:str, scale:float) -> List[dict]:
+    """
+    Renames every file and moves every folder of a seeded tree into another one, then coalesces and synchronizes
+    the resulting events in batches of 100, reporting the apply latency of each batch.
+    """
+    source_directory_path:str = os.path.join(workspace, 'rename_storm', 'source')
+    replica_directory_path:str = os.path.join(workspace, 'rename_storm', 'replica')
+    os.makedirs(source_directory_path)
+    os.makedirs(replica_directory_path)
+
+    build_small_files(source_directory_path, scale / 5)
+    archive:str = os.path.join(source_directory_path, 'archive')
+    os.makedirs(archive)
+
+    manifest = ReplicaManifest(replica_directory_path)
+    duplicate_source(source_directory_path, replica_directory_path, manifest)
+
+    events:List[dict] = []
+    for current, _, names in list(os.walk(source_directory_path)):
+        for name in names:
+            old_path, new_path = os.path.join(current, name), os.path.join(current, 'renamed_' + name)
+            os.rename(old_path, new_path)
+            events.append({'type': 'renamed', 'path': old_path, 'new_path': new_path, 'is_file': True})
+
+    for name in sorted(os.listdir(source_directory_path)):
+        if name.startswith('folder'):
+            os.rename(os.path.join(source_directory_path, name), os.path.join(archive, name))
+            events.append({'type': 'moved', 'path': os.path.join(source_directory_path, name), 'new_path': archive, 'is_file': False})
+
+    latencies:List[float] = []
+    started:float = time.perf_counter()
+
+    for start in range(0, len(events), 100):
+        batch_started:float = time.perf_counter()
+        synchronize(source_directory_path, replica_directory_path, coalesce_changes(events[start:start + 100]), manifest)
+        latencies.append(time.perf_counter() - batch_started)
+
+    seconds:float = time.perf_counter() - started
+    manifest.close()
+
+    return [{
+        'scenario': 'rename_storm',
+        'phase': 'synchronize',
+        'events': len(events),
+        'seconds': round(seconds, 4),
+        'events_per_sec': round(len(events) / seconds, 1) if seconds else None,
+        'batch_latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'batch_latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_mb': peak_memory_mb(),
+    }]
+
+
+def monitor_throughput(workspace:str, scale:float, mode:str) -> List[dict]:
+    """
+    Creates files as fast as possible and measures how fast FolderMonitor delivers their events.
+    """
+    source_directory_path:str = os.path.join(workspace, 'monitor', 'source')
+    os.makedirs(source_directory_path)
+    count:int = max(1, int(5000 * scale))
+
+    monitor = FolderMonitor(source_directory_path, mode=mode)
+    monitor.start()
+    time.sleep(0.5)
+
+    started:float = time.perf_counter()
+    for index in range(count):
+        write_file(os.path.join(source_directory_path, f"file{index}"), 128)
+
+    created:set = set()
+    events:int = 0
+    last_event:float = started
+    deadline:float = time.monotonic() + 30
+
+    while len(created) < count and time.monotonic() < deadline:
+        if monitor.wait_for_changes(0.5):
+            changes:List[dict] = monitor.get_changes()
+            events += len(changes)
+            created.update(change['path'] for change in changes if change['type'] == 'created')
+            last_event = time.perf_counter()
+
+    monitor.stop()
+    seconds:float = last_event - started
+
+    return [{
+        'scenario': 'monitor',
+        'phase': mode,
+        'files': count,
+        'events': events,
+        'missed_files': count - len(created),
+        'seconds': round(seconds, 4),
+        'events_per_sec': round(events / seconds, 1) if seconds else None,
+        'peak_rss_mb': peak_memory_mb(),
+    }]
+
+
+def live_sync(workspace:str, scale:float, mode:str, rate:float = 200.0) -> List[dict]:
+    """
+    Writes, modifies and renames files at a steady rate while a monitor, coalescer and synchronize loop runs,
+    measuring for every change the time between the write and its synchronization.
+    """
+    source_directory_path:str = os.path.join(workspace, 'live', 'source')
+    replica_directory_path:str = os.path.join(workspace, 'live', 'replica')
+    os.makedirs(source_directory_path)
+    os.makedirs(replica_directory_path)
+
+    manifest = ReplicaManifest(replica_directory_path)
+    coalescer = EventCoalescer(quiet_period=0)
+    monitor = FolderMonitor(source_directory_path, mode=mode)
+    monitor.start()
+    time.sleep(0.5)
+
+    written:Dict[str, float] = {}
+    lock = threading.Lock()
+    operations:int = max(1, int(2000 * scale))
+
+    def writer() -> None:
+        for index in range(operations):
+            path:str = os.path.join(source_directory_path, f"file{index}.txt")
+
+            if index % 5 == 4:
+                previous:str = os.path.join(source_directory_path, f"file{index - 1}.txt")
+                os.rename(previous, path)
+                # A rename before its creation was synchronized reaches the replica as a creation of the new name
+                with lock:
+                    written.pop(previous, None)
+            else:
+                write_file(path, 4096)
+
+            with lock:
+                written[path] = time.perf_counter()
+            time.sleep(1 / rate)
+
+    thread = threading.Thread(target=writer)
+    started:float = time.perf_counter()
+    thread.start()
+
+    latencies:List[float] = []
+    events:int = 0
+    deadline:float = time.monotonic() + operations / rate + 30
+
+    while (thread.is_alive() or written) and time.monotonic() < deadline:
+        monitor.wait_for_changes(0.05)
+        raw_changes:List[dict] = monitor.get_changes()
+        events += len(raw_changes)
+        coalescer.add(raw_changes)
+        changes:List[dict] = coalescer.flush()
+
+        if changes:
+            synchronize(source_directory_path, replica_directory_path, changes, manifest)
+            now:float = time.perf_counter()
+
+            with lock:
+                for change in changes:
+                    moment = written.pop(change['new_path'] if change['type'] == 'renamed' else change['path'], None)
+                    if moment is not None:
+                        latencies.append(now - moment)
+
+    seconds:float = time.perf_counter() - started
+    thread.join()
+    monitor.stop()
+    manifest.close()
+
+    return [{
+        'scenario': 'live',
+        'phase': mode,
+        'operations': operations,
+        'events': events,
+        'synchronized': len(latencies),
+        'seconds': round(seconds, 4),
+        'events_per_sec': round(events / seconds, 1) if seconds else None,
+        'apply_latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'apply_latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'peak_rss_mb': peak_memory_mb(),
+    }]
+
+
+SCENARIOS:Dict[str, Callable[[str, float, str], List[dict]]] = {
+    'small_files': lambda workspace, scale, mode: tree_benchmark('small_files', workspace, scale),
+    'large_files': lambda workspace, scale, mode: tree_benchmark('large_files', workspace, scale),
+    'deep_nesting': lambda workspace, scale, mode: tree_benchmark('deep_nesting', workspace, scale),
+    'rename_storm': lambda workspace, scale, mode: rename_storm(workspace, scale),
+    'monitor': monitor_throughput,
+    'live': live_sync,
+}
+
+
+def show_usage() -> None:
+    print("Usage: python benchmark.py [Options]")
+    print("\nOptions:")
+    for option, description in BENCHMARK_OPTIONS.items():
+        print(f"  {option} - {description}")
+    print(f"\nScenarios: {', '.join(SCENARIOS)}\n")
+
+
+def main() -> None:
+    _, options = split_arguments(sys.argv[1:])
+    scenarios:List[str] = options['--scenarios'].split(',') if isinstance(options.get('--scenarios'), str) else list(SCENARIOS)
+
+    known:List[str] = [name.split('=')[0] for name in BENCHMARK_OPTIONS]
+    if (any(option not in known for option in options) or any(name not in SCENARIOS for name in scenarios)
+            or not valid_number(options.get('--scale', 1)) or options.get('--monitor', 'process') not in ('process', 'thread')):
+        show_usage()
+        sys.exit(1)
+
+    # The benchmark measures the synchronization itself, not the cost of logging every copied file
+    logging.basicConfig(level=logging.WARNING)
+
+    scale:float = float(options.get('--scale', 1))
+    mode:str = options.get('--monitor', 'process')
+    workspace:str = tempfile.mkdtemp(prefix='sync-benchmark-', dir=options.get('--directory') or None)
+
+    report:dict = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': scale,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': [],
+    }
+
+    try:
+        for scenario in scenarios:
+            report['results'].extend(SCENARIOS[scenario](workspace, scale, mode))
+
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    output:str = json.dumps(report, indent=2)
+
+    if isinstance(options.get('--output'), str):
+        with open(options['--output'], 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
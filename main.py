@@ -1,83 +1,182 @@
-from typing import Dict, Union
-from src.input_validation import validation
+from src.input_validation import validation, filter_rules, replica_paths
 from src.watch_changes import FolderMonitor
+from src.replicas import ReplicaSet
+from src.scrubber import SCRUB_INTERVAL
+from src.coalesce import EventCoalescer
+from src.scheduler import SyncScheduler
+from src.copy_backend import configure_copy_backend, configure_small_files
+from src.filters import configure_path_filter
+from src.async_runtime import AsyncRuntime
+from src import io_pool
+from src import throttle
+from src import metrics
+from src.async_logging import AsyncLogWriter, QueueLogHandler
+from src.run_summary import SUMMARY
 from src.synchronization import *
 import logging
+import asyncio
+import atexit
 import time
 import sys 
-import os
 
 
-def configure_logging(log_file_path) -> None:
-    logging.basicConfig(
-        filename=log_file_path,
-        format='%(levelname)s - %(asctime)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        level=logging.INFO
-    )
-    
+def configure_logging(log_file_path, asynchronous:bool = False, verbosity:str = 'files') -> None:
+    """
+    Sends the log records to the log file and to the console.
+
+    Args:
+    - log_file_path: Path to the log file.
+    - asynchronous: Hand the records to a background thread that formats and writes them in batches.
+    - verbosity: 'files' logs every file operation, 'summary' only the aggregate lines of each cycle and the errors.
+    """
+    formatter = logging.Formatter('%(levelname)s - %(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    file_handler = logging.FileHandler(log_file_path)
+    file_handler.setFormatter(formatter)
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_formatter = logging.Formatter('%(levelname)s - %(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    console_handler.setFormatter(console_formatter)
+    console_handler.setFormatter(formatter)
 
     logger = logging.getLogger()
-    logger.addHandler(console_handler)
+    logger.setLevel(SUMMARY if verbosity == 'summary' else logging.INFO)
+
+    if asynchronous:
+        writer = AsyncLogWriter([file_handler, console_handler])
+        writer.start()
+        atexit.register(writer.stop)
+        logger.addHandler(QueueLogHandler(writer.queue))
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
+
+
+
+def shut_down(replicas:ReplicaSet, directory_monitor:FolderMonitor, coalescer:EventCoalescer, in_sync:bool, options:dict, stats_writer = None) -> None:
+    """
+    Stops the monitor, applies the changes still held and checkpoints the replicas if they were in sync.
+    """
+    synced_ns:int = time.time_ns()
+    directory_monitor.stop()
+
+    # The changes still held or undelivered are applied before the checkpoint is saved
+    if in_sync:
+        coalescer.add(directory_monitor.get_changes())
+        changes = coalescer.flush(force=True)
+        if changes:
+            replicas.synchronize(changes)
+        replicas.save_checkpoint(synced_ns)
+
+    replicas.log_repairs()
+    if options.get('--exit-check'):
+        print("Running file integrity checks")
+        replicas.reconcile()
+        print("All integrity checks completed")
+    replicas.close()
+    io_pool.shutdown_io_pool()
+    if stats_writer:
+        stats_writer.set()
+        metrics.write_stats_file(options['--stats-file'])
 
 
+def main() -> None:
+    source_directory_path, replica_directory_path, interval, log_file_path, options = validation() 
+    configure_logging(log_file_path, bool(options.get('--async-logging')), options.get('--log-verbosity', 'files'))
 
+    if '--delta-threshold' in options:
+        configure_delta_copy(int(float(options['--delta-threshold']) * 1024 * 1024))
 
-def filter_changes(changes: List[Dict]) -> List[Dict]:
-    tmp:list = []
+    configure_copy_backend(options.get('--copy-backend', 'auto'))
 
-    for change in changes:
-        if change['type'] in ['created', 'modified'] and os.path.basename(change['path']).startswith('.'):
-            continue
-        elif change['type'] == 'renamed' and os.path.basename(change['path']).startswith('.'):
-            edited_change = {
-                'type':'modified',
-                'path': change['new_path'],
-                'new_path': change['new_path'],
-                'is_file': change['is_file'],
-            }
-            tmp.append(edited_change) 
-    
-        else:
-            tmp.append(change)
+    if '--small-files' in options:
+        configure_small_files(int(float(options['--small-files']) * 1024))
 
-    return tmp
+    for name in throttle.budgets:
+        if f'--{name}-limits' in options:
+            throttle.budgets[name].configure(**throttle.parse_limits(options[f'--{name}-limits']))
 
+    limits_file = throttle.LimitsFile(options['--limits-file']) if '--limits-file' in options else None
+    if limits_file:
+        limits_file.reload()
 
-def main() -> None:
-    source_directory_path, replica_directory_path, interval, log_file_path = validation() 
-    configure_logging(log_file_path)
+    if options.get('--runtime') == 'asyncio' or '--io-workers' in options:
+        io_pool.configure_io_pool(int(options['--io-workers']) if '--io-workers' in options else None)
 
-    if source_directory_not_empty(source_directory_path):
-        if replica_directory_is_empty(replica_directory_path):
-            duplicate_source(source_directory_path, replica_directory_path) 
-        else:
-            update_replica_directory(source_directory_path, replica_directory_path)
+    path_filter = filter_rules(options)
+    configure_path_filter(path_filter)
 
+    if '--metrics-port' in options:
+        metrics.start_http_endpoint(int(options['--metrics-port']))
 
-    directory_monitor = FolderMonitor(source_directory_path)
+    stats_writer = metrics.start_stats_file(options['--stats-file']) if '--stats-file' in options else None
+
+    scrub_interval:float = float(options.get('--scrub-interval', SCRUB_INTERVAL))
+    replicas = ReplicaSet(source_directory_path, [replica_directory_path] + replica_paths(options), checksum=bool(options.get('--checksum')),
+                          scrub_interval=scrub_interval or None)
+
+    # Operations interrupted by a crash are repaired first, so the manifests can be trusted by the reconciliation
+    replicas.replay_journals()
+
+    coalescer = EventCoalescer(quiet_period=float(options.get('--quiet-period', 1)))
+    scheduler = SyncScheduler(min_latency=float(options.get('--min-latency', 0.2)), max_latency=interval)
+    directory_monitor = FolderMonitor(source_directory_path, mode=options.get('--monitor', 'process'), path_filter=path_filter)
+
+    # The monitor is started first, the events received during the catch-up are applied right after it
     directory_monitor.start()
 
+    if options.get('--runtime') == 'asyncio':
+        runtime = AsyncRuntime(source_directory_path, replicas, directory_monitor, coalescer, scheduler, limits_file,
+                               float(options['--operation-timeout']) if '--operation-timeout' in options else None)
+        asyncio.run(runtime.run())
+        shut_down(replicas, directory_monitor, coalescer, runtime.in_sync, options, stats_writer)
+        sys.exit(0)
+
+    # The replicas are only checkpointed on exit if no catch-up or batch of changes was interrupted
+    in_sync:bool = False
+
     try:
+        if source_directory_not_empty(source_directory_path):
+            replicas.catch_up()
+        in_sync = True
+
         while True:
-            time.sleep(interval)
-            
-            changes:list = directory_monitor.get_changes()
+            if limits_file:
+                try:
+                    if limits_file.reload():
+                        logging.log(SUMMARY, "[LIMITS] Reloaded %s", limits_file.limits_path)
+                except (OSError, ValueError) as e:
+                    logging.error(f"[ERROR] Reloading limits: {e}")
+
+            # While a verification pass runs the loop does not sleep, the scrub budget sets its pace
+            with metrics.phase_seconds.time(phase='wait'):
+                scheduler.wait(directory_monitor, timeout=0.0 if replicas.scrubbing() else coalescer.next_release())
+
+            with metrics.phase_seconds.time(phase='collect'):
+                raw_changes:list = directory_monitor.get_changes()
+                scheduler.record(len(raw_changes))
+
+            with metrics.phase_seconds.time(phase='coalesce'):
+                held:int = len(coalescer)
+                coalescer.add(raw_changes)
+                changes:list = coalescer.flush()
+
+            metrics.events_received.inc(len(raw_changes))
+            metrics.events_coalesced.inc(max(0, held + len(raw_changes) - len(changes) - len(coalescer)))
 
             if changes:
-                changes:list = filter_changes(changes)
-                synchronize(source_directory_path, replica_directory_path, changes)
+                with metrics.phase_seconds.time(phase='synchronize'):
+                    in_sync = False
+                    replicas.synchronize(changes)
+                    in_sync = True
 
-    except KeyboardInterrupt:
-        directory_monitor.stop()
-        print("Running file integrity checks")
-        update_replica_directory(source_directory_path, replica_directory_path)
-        print("All integrity checks completed")
+            # The background verification only runs in cycles without changes
+            elif replicas.scrubbing():
+                with metrics.phase_seconds.time(phase='scrub'):
+                    replicas.scrub()
 
+            with metrics.phase_seconds.time(phase='repair'):
+                replicas.run_repairs()
+
+    except KeyboardInterrupt:
+        shut_down(replicas, directory_monitor, coalescer, in_sync, options, stats_writer)
         sys.exit(0)
 
 
@@ -0,0 +1,91 @@
+import queue
+import logging
+import threading
+import logging.handlers
+from typing import List
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Puts log records on a queue without formatting them, the writer thread formats them instead.
+    """
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class AsyncLogWriter:
+    def __init__(self, handlers:List[logging.Handler], batch_size:int = 1000):
+        """
+        Background thread writing the records of a queue to the given handlers in batches.
+
+        Args:
+        - handlers: Handlers receiving the records, e.g. the log file and the console.
+        - batch_size: Maximum number of records written at once.
+
+        Records are formatted in the writer thread. Stream handlers get one write and one flush per batch,
+        so threads logging many lines never wait on disk I/O or on the handler locks.
+        """
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.queue:queue.SimpleQueue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def start(self) -> None:
+        self.thread.start()
+
+
+    def stop(self) -> None:
+        """
+        Writes every queued record and stops the writer thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+    def _run(self) -> None:
+        while True:
+            batch:list = [self.queue.get()]
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records:List[logging.LogRecord] = [record for record in batch if record is not None]
+            if records:
+                self._write(records)
+
+            if len(records) < len(batch):
+                return
+
+
+    def _write(self, records:List[logging.LogRecord]) -> None:
+        for handler in self.handlers:
+            accepted:List[logging.LogRecord] = [record for record in records if record.levelno >= handler.level]
+
+            if not isinstance(handler, logging.StreamHandler):
+                for record in accepted:
+                    handler.handle(record)
+                continue
+
+            lines:List[str] = []
+            for record in accepted:
+                try:
+                    lines.append(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+
+            if not lines:
+                continue
+
+            handler.acquire()
+            try:
+                handler.stream.write(''.join(lines))
+                handler.flush()
+            except Exception:
+                handler.handleError(accepted[-1])
+            finally:
+                handler.release()
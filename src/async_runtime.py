@@ -0,0 +1,186 @@
+import signal
+import asyncio
+import logging
+import concurrent.futures
+from typing import Callable, Optional
+from src.coalesce import EventCoalescer
+from src.scheduler import SyncScheduler
+from src.replicas import ReplicaSet
+from src.watch_changes import FolderMonitor
+from src.run_summary import SUMMARY
+from src.synchronization import source_directory_not_empty
+from src import io_pool
+from src import metrics
+
+
+class AsyncRuntime:
+    def __init__(self, source_directory_path:str, replicas:ReplicaSet, monitor:FolderMonitor, coalescer:EventCoalescer, scheduler:SyncScheduler,
+                 limits_file = None, operation_timeout:Optional[float] = None):
+        """
+        Runs the synchronization from an asyncio event loop instead of the blocking loop of main.
+
+        Args:
+        - source_directory_path: Path to the source directory.
+        - replicas: ReplicaSet to keep up to date.
+        - monitor: Started FolderMonitor of the source directory.
+        - coalescer: EventCoalescer the received events are added to.
+        - scheduler: SyncScheduler deciding when each batch is synchronized.
+        - limits_file: Optional throttle.LimitsFile, reloaded at every cycle.
+        - operation_timeout: Seconds after which a catch-up, batch of changes, verification slice or repair is
+          cancelled, None waits for them.
+
+        The event loop receives the monitor events as they arrive, also while a batch is being synchronized, and
+        coalesces them for the next batch. Each phase runs on a single long-lived thread, so phases never overlap,
+        and their file operations run on the shared io_pool. A cancelled phase lets its running operations finish,
+        the ones not started yet are queued in the repair queues.
+        """
+        self.source_directory_path = source_directory_path
+        self.replicas = replicas
+        self.monitor = monitor
+        self.coalescer = coalescer
+        self.scheduler = scheduler
+        self.limits_file = limits_file
+        self.operation_timeout = operation_timeout
+
+        # False while a catch-up or batch of changes is interrupted, the replicas are only checkpointed when True
+        self.in_sync:bool = False
+
+        self.phases = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sync-phase')
+        self.available:Optional[asyncio.Event] = None
+        self.received:int = 0
+        self.held:int = 0
+
+
+    async def run(self) -> None:
+        """
+        Catches up with the source and synchronizes the detected changes until SIGINT or SIGTERM is received.
+        """
+        loop = asyncio.get_running_loop()
+        main_task = asyncio.current_task()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, main_task.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        self.available = asyncio.Event()
+        receiver = asyncio.create_task(self._receive())
+
+        try:
+            await self._synchronize()
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+            self.phases.shutdown(wait=True)
+
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(signal_number)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+
+    async def _receive(self) -> None:
+        """
+        Adds the monitor events to the coalescer as soon as they arrive.
+        """
+        while True:
+            if not await self.monitor.wait_for_changes_async(self.scheduler.max_latency):
+                continue
+
+            raw_changes:list = self.monitor.get_changes()
+            if not raw_changes:
+                # The pipe of a stopped monitoring process stays readable
+                await asyncio.sleep(self.scheduler.min_latency)
+                continue
+
+            self.coalescer.add(raw_changes)
+            self.received += len(raw_changes)
+            metrics.events_received.inc(len(raw_changes))
+            self.available.set()
+
+
+    async def _synchronize(self) -> None:
+        if source_directory_not_empty(self.source_directory_path):
+            if not await self._phase('catch_up', self.replicas.catch_up):
+                self.replicas.requeue()
+        self.in_sync = True
+
+        while True:
+            self._reload_limits()
+
+            # While a verification pass runs the loop does not wait, the scrub budget sets its pace
+            with metrics.phase_seconds.time(phase='wait'):
+                await self.scheduler.wait_async(self.available, 0.0 if self.replicas.scrubbing() else self.coalescer.next_release())
+            self.available.clear()
+
+            with metrics.phase_seconds.time(phase='coalesce'):
+                self.scheduler.record(self.received)
+                changes:list = self.coalescer.flush()
+
+            metrics.events_coalesced.inc(max(0, self.held + self.received - len(changes) - len(self.coalescer)))
+            self.received = 0
+            self.held = len(self.coalescer)
+
+            if changes:
+                self.in_sync = False
+                if not await self._phase('synchronize', self.replicas.synchronize, changes):
+                    self.replicas.requeue(changes)
+                self.in_sync = True
+
+            # The background verification only runs in cycles without changes
+            elif self.replicas.scrubbing():
+                await self._phase('scrub', self.replicas.scrub)
+
+            await self._phase('repair', self.replicas.run_repairs)
+
+
+    async def _phase(self, name:str, function:Callable, *args) -> bool:
+        """
+        Runs a blocking phase on the phase thread. Returns False if it was cancelled after operation_timeout.
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.phases, function, *args)
+
+        with metrics.phase_seconds.time(phase=name):
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.operation_timeout)
+                return True
+
+            except asyncio.TimeoutError:
+                logging.error(f"[TIMEOUT] Phase {name} still running after {self.operation_timeout:g}s, cancelling it")
+                await self._cancel(future)
+                return False
+
+            except asyncio.CancelledError:
+                await self._cancel(future)
+                raise
+
+
+    async def _cancel(self, future:asyncio.Future) -> None:
+        """
+        Stops a running phase at the end of the file operations already started and waits for it.
+        """
+        io_pool.cancelled.set()
+        try:
+            await asyncio.wait({future})
+        finally:
+            io_pool.cancelled.clear()
+
+        error:Optional[BaseException] = future.exception()
+        if error and not isinstance(error, io_pool.OperationCancelled):
+            logging.error(f"[ERROR] Cancelled phase: {error}")
+
+
+    def _reload_limits(self) -> None:
+        if not self.limits_file:
+            return
+
+        try:
+            if self.limits_file.reload():
+                logging.log(SUMMARY, "[LIMITS] Reloaded %s", self.limits_file.limits_path)
+        except (OSError, ValueError) as e:
+            logging.error(f"[ERROR] Reloading limits: {e}")
@@ -0,0 +1,92 @@
+import logging
+import functools
+import threading
+import contextvars
+import concurrent.futures
+from typing import Callable, List, Optional
+from src import io_pool
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers:Optional[int] = None, max_pending:Optional[int] = None):
+        """
+        Thread pool whose submit blocks while too many tasks are queued or running.
+
+        Args:
+        - max_workers: Number of worker threads.
+        - max_pending: Maximum number of submitted tasks not finished yet, four per worker by default.
+
+        Completed tasks are released as soon as they finish, so memory depends on the concurrency and not on
+        the number of submitted tasks. Failures are logged and their labels kept in failed.
+        When the shared io_pool is configured, tasks run on it instead of a new pool, and at most max_workers of
+        them are submitted at a time. Submitting raises OperationCancelled once the running phase was cancelled.
+        Tasks run in a copy of the submitting context, so they charge the throttle budget of their phase.
+        """
+        self.shared:bool = io_pool.pool is not None
+
+        if self.shared:
+            self.max_workers = min(max_workers or io_pool.size, io_pool.size)
+            self.max_pending = max_pending or self.max_workers
+            self.executor = io_pool.pool
+        else:
+            self.max_workers = max_workers or io_pool.default_size()
+            self.max_pending = max_pending or self.max_workers * 4
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+
+        self.lock = threading.Lock()
+        self.failed:List[str] = []
+
+
+    def submit(self, label:str, function:Callable, *args) -> None:
+        """
+        Runs function(*args) on the pool, waiting for a free slot first.
+
+        Args:
+        - label: Name of the task in the error log and in failed, usually a relative path.
+        """
+        io_pool.check_cancelled()
+        self.slots.acquire()
+
+        try:
+            future = self.executor.submit(contextvars.copy_context().run, function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(functools.partial(self._done, label))
+
+
+    def _done(self, label:str, future:concurrent.futures.Future) -> None:
+        self.slots.release()
+
+        if future.exception():
+            logging.error(f"[ERROR] Updating: {label}. Error: {future.exception()}")
+            with self.lock:
+                self.failed.append(label)
+
+
+    def wait(self) -> None:
+        """
+        Blocks until every submitted task finished.
+        """
+        for _ in range(self.max_pending):
+            self.slots.acquire()
+        for _ in range(self.max_pending):
+            self.slots.release()
+
+
+    def shutdown(self) -> None:
+        if self.shared:
+            self.wait()
+        else:
+            self.executor.shutdown(wait=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
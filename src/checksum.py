@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path:str, chunk_size:int = CHUNK_SIZE) -> str:
+    """
+    Computes the BLAKE2b digest of a file, reading it in fixed size chunks.
+
+    Args:
+    - path: Path to the file to hash.
+    - chunk_size: Number of bytes read at a time.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ChecksumCache:
+    def __init__(self, cache_path:str):
+        """
+        Opens (or creates) the persisted checksum cache.
+
+        Args:
+        - cache_path: Location of the SQLite database holding the cached checksums.
+
+        A cached checksum is only reused while the file keeps the same size, mtime_ns and inode.
+        """
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checksums ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, hash TEXT)'
+        )
+        self.connection.commit()
+
+
+    def get(self, path:str, stat_result:os.stat_result) -> Optional[str]:
+        """
+        Returns the cached checksum of a file if it is still valid for the given stat, otherwise None.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT hash FROM checksums WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+            ).fetchone()
+        return row[0] if row else None
+
+
+    def checksum(self, path:str) -> str:
+        """
+        Returns the checksum of a file, hashing it only when the cached value is missing or outdated.
+        """
+        stat_result = os.stat(path)
+        file_hash = self.get(path, stat_result)
+
+        if file_hash is None:
+            file_hash = hash_file(path)
+            with self.lock:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)',
+                    (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, file_hash)
+                )
+
+        return file_hash
+
+
+    def commit(self) -> None:
+        with self.lock:
+            self.connection.commit()
+
+
+    def close(self) -> None:
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,337 @@
+import os
+import time
+from typing import Dict, Iterator, List, Optional
+
+
+def is_hidden(path:str) -> bool:
+    return os.path.basename(path).startswith('.')
+
+
+def is_within(path:str, directory:str) -> bool:
+    """
+    Returns True if path is directory itself or any path below it.
+    """
+    return path == directory or path.startswith(directory + os.sep)
+
+
+def ancestors(path:str) -> Iterator[str]:
+    """
+    Yields every parent folder of path, from the closest to the root.
+    """
+    parent:str = os.path.dirname(path)
+    while parent and parent != path:
+        yield parent
+        path, parent = parent, os.path.dirname(parent)
+
+
+def make_change(event_type:str, path:str, is_file:bool, new_path:Optional[str] = None) -> dict:
+    return {
+        "type": event_type,
+        "path": path,
+        "new_path": new_path,
+        "is_file": is_file,
+    }
+
+
+class EventCoalescer:
+    def __init__(self, quiet_period:float = 0.0, max_delay:float = 60.0):
+        """
+        Reduces the raw event stream of FolderMonitor to the minimal set of net changes per path.
+
+        Args:
+        - quiet_period: Seconds without events on a path (or below it) before its created/modified change is released.
+        - max_delay: Seconds after which a pending change is released even if its path is still busy.
+
+        Repeated modifications collapse into one, created+deleted pairs cancel out, rename chains are folded into a
+        single rename and changes below deleted or renamed folders are dropped or rebased.
+        Created/modified events of hidden files are ignored and renaming a hidden file is treated as a modification
+        of the destination, which is how most editors save files.
+        """
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+
+        self.pending:List[Optional[dict]] = []      # Net changes in application order, None once dropped
+        self.first_seen:List[float] = []
+        self.latest:Dict[str, int] = {}              # Current path -> position of its latest change
+        self.origins:Dict[str, int] = {}             # Rename destination -> position of the rename
+        self.last_activity:Dict[str, float] = {}
+        self.moved_directories:Dict[str, str] = {}   # Folders renamed since the last flush -> destination
+
+
+    def __len__(self) -> int:
+        """
+        Number of net changes currently held.
+        """
+        return sum(change is not None for change in self.pending)
+
+
+    def add(self, changes:List[dict], now:Optional[float] = None) -> None:
+        """
+        Adds a batch of raw changes, as returned by FolderMonitor.get_changes.
+        """
+        now = time.monotonic() if now is None else now
+
+        for change in changes:
+            path:str = os.path.normpath(change['path'])
+
+            if change['type'] in ('renamed', 'moved'):
+                destination:str = os.path.normpath(change['new_path'])
+                if change['type'] == 'moved':
+                    destination = os.path.join(destination, os.path.basename(path))
+
+                if is_hidden(path):
+                    self._modified(destination, change['is_file'], now)
+                else:
+                    self._renamed(path, destination, change['is_file'], now)
+
+            elif change['type'] == 'deleted':
+                self._deleted(path, change['is_file'], now)
+
+            elif not is_hidden(path):
+                if change['type'] == 'created':
+                    self._created(path, change['is_file'], now)
+                else:
+                    self._modified(path, change['is_file'], now)
+
+
+    def flush(self, now:Optional[float] = None, force:bool = False) -> List[dict]:
+        """
+        Returns the net changes ready to be synchronized and forgets them.
+
+        Args:
+        - now: Current time.monotonic() value.
+        - force: Release every pending change, ignoring the quiet period.
+        """
+        now = time.monotonic() if now is None else now
+        ready:List[dict] = []
+        kept:Dict[int, int] = {}
+        pending:List[Optional[dict]] = []
+        first_seen:List[float] = []
+
+        for position, change in enumerate(self.pending):
+            if change is None:
+                continue
+
+            if force or self._is_settled(change, self.first_seen[position], now):
+                ready.append(change)
+            else:
+                kept[position] = len(pending)
+                pending.append(change)
+                first_seen.append(self.first_seen[position])
+
+        self.pending, self.first_seen = pending, first_seen
+        self.latest = {path: kept[position] for path, position in self.latest.items() if position in kept}
+        self.origins = {path: kept[position] for path, position in self.origins.items() if position in kept}
+        self.last_activity = {path: moment for path, moment in self.last_activity.items() if now - moment < self.quiet_period}
+        self.moved_directories.clear()
+
+        return ready
+
+
+    def next_release(self, now:Optional[float] = None) -> Optional[float]:
+        """
+        Returns the number of seconds until the next held change is released, or None if nothing is held.
+        """
+        now = time.monotonic() if now is None else now
+        releases:List[float] = [
+            min(first_seen + self.max_delay, self.last_activity.get(change['path'], 0.0) + self.quiet_period)
+            for change, first_seen in zip(self.pending, self.first_seen) if change is not None
+        ]
+        return max(min(releases) - now, 0.0) if releases else None
+
+
+    def _is_settled(self, change:dict, first_seen:float, now:float) -> bool:
+        if change['type'] not in ('created', 'modified'):
+            return True
+
+        if now - first_seen >= self.max_delay:
+            return True
+
+        return now - self.last_activity.get(change['path'], 0.0) >= self.quiet_period
+
+
+    def _touch(self, path:str, now:float) -> None:
+        """
+        Records activity on a path and all its parents, so pending folder creations wait for their content.
+        """
+        if not self.quiet_period:
+            return
+
+        self.last_activity[path] = now
+        for parent in ancestors(path):
+            self.last_activity[parent] = now
+
+
+    def _current(self, path:str) -> Optional[dict]:
+        position = self.latest.get(path)
+        return self.pending[position] if position is not None else None
+
+
+    def _append(self, change:dict, now:float) -> None:
+        position:int = len(self.pending)
+        self.pending.append(change)
+        self.first_seen.append(now)
+
+        if change['type'] == 'renamed':
+            self.origins[change['new_path']] = position
+            self.latest[change['new_path']] = position
+        else:
+            self.latest[change['path']] = position
+
+
+    def _drop(self, position:int) -> dict:
+        change:dict = self.pending[position]
+        self.pending[position] = None
+        return change
+
+
+    def _created_ancestor(self, path:str) -> bool:
+        """
+        Returns True if a parent folder of path is created in this batch, its copy will include path.
+        """
+        for parent in ancestors(path):
+            change = self._current(parent)
+            if change and change['type'] == 'created':
+                return True
+        return False
+
+
+    def _drop_subtree(self, directory:str, keep_renames:bool = False) -> List[dict]:
+        """
+        Drops every pending change located at directory or below it and returns them in their original order.
+        With keep_renames, renames ending below directory stay pending but can no longer be folded.
+        """
+        positions:set = set()
+
+        for index in (self.latest, self.origins):
+            for path in [path for path in index if is_within(path, directory)]:
+                position:int = index.pop(path)
+                change = self.pending[position]
+                if change is not None and not (keep_renames and change['type'] == 'renamed'):
+                    positions.add(position)
+
+        return [self._drop(position) for position in sorted(positions)]
+
+
+    def _forget_subtree(self, directory:str, now:float) -> List[dict]:
+        """
+        Drops the pending changes at or below directory. Renames bringing a path from outside into it are
+        replaced by the deletion of their origin, which is what is left in the replica.
+        """
+        dropped:List[dict] = self._drop_subtree(directory)
+
+        for change in dropped:
+            if change['type'] == 'renamed' and not is_within(change['path'], directory):
+                self._append(make_change('deleted', change['path'], change['is_file']), now)
+
+        return dropped
+
+
+    def _created(self, path:str, is_file:bool, now:float) -> None:
+        self._touch(path, now)
+        if self._created_ancestor(path):
+            return
+
+        previous = self._current(path)
+
+        if previous is None:
+            self._append(make_change('created', path, is_file), now)
+
+        elif previous['type'] == 'deleted':
+            # A file replaced by a file is a modification, anything else is deleted then created again
+            if previous['is_file'] and is_file:
+                self._drop(self.latest[path])
+                self._append(make_change('modified', path, is_file), now)
+            else:
+                self._append(make_change('created', path, is_file), now)
+
+        elif previous['type'] == 'renamed':
+            self._append(make_change('modified', path, is_file), now)
+
+
+    def _modified(self, path:str, is_file:bool, now:float) -> None:
+        self._touch(path, now)
+        if self._created_ancestor(path):
+            return
+
+        previous = self._current(path)
+
+        if previous and previous['type'] in ('created', 'modified'):
+            return
+
+        if previous and previous['type'] == 'deleted':
+            self._drop(self.latest[path])
+
+        self._append(make_change('modified', path, is_file), now)
+
+
+    def _deleted(self, path:str, is_file:bool, now:float) -> None:
+        self._touch(path, now)
+        previous = self._current(path)
+        renamed_here:bool = path in self.origins
+
+        if self._created_ancestor(path):
+            self._drop_subtree(path)
+            return
+
+        self._forget_subtree(path, now)
+
+        # Paths renamed here are deleted at their origin by _forget_subtree
+        if not renamed_here and (previous is None or previous['type'] == 'modified'):
+            self._append(make_change('deleted', path, is_file), now)
+
+
+    def _renamed(self, source:str, destination:str, is_file:bool, now:float) -> None:
+        self._touch(source, now)
+        self._touch(destination, now)
+
+        # Children of a folder renamed in this batch are already moved with it
+        for parent in ancestors(source):
+            if parent in self.moved_directories:
+                if self.moved_directories[parent] + source[len(parent):] == destination:
+                    return
+                break
+
+        if not is_file:
+            self.moved_directories[source] = destination
+
+        previous = self._current(source)
+
+        # The source never reached the replica, create the destination instead
+        if self._created_ancestor(source) or (previous and previous['type'] == 'created'):
+            self._drop_subtree(source)
+            self._created(destination, is_file, now)
+            return
+
+        # The destination folder is copied as a whole, only the source has to go
+        if self._created_ancestor(destination):
+            self._deleted(source, is_file, now)
+            return
+
+        self._forget_subtree(destination, now)
+
+        origin:str = source
+        if source in self.origins:
+            position:int = self.origins.pop(source)
+            origin = self._drop(position)['path']
+            if self.latest.get(source) == position:
+                del self.latest[source]
+
+        # Changes pending below the source must now be applied below the destination
+        rebased:List[dict] = self._drop_subtree(source, keep_renames=True)
+
+        if origin != destination:
+            self._append(make_change('renamed', origin, is_file, destination), now)
+
+        for change in rebased:
+            change['path'] = destination + change['path'][len(source):]
+            self._append(change, now)
+
+
+def coalesce_changes(changes:List[dict]) -> List[dict]:
+    """
+    Reduces a batch of raw changes to its net changes, without any debounce.
+    """
+    coalescer = EventCoalescer()
+    coalescer.add(changes)
+    return coalescer.flush(force=True)
@@ -0,0 +1,316 @@
+import os
+import sys
+import stat
+import errno
+import shutil
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, List, Optional
+from src import metrics
+from src import throttle
+
+try:
+    import fcntl
+except ImportError:     # Not available on Windows
+    fcntl = None
+
+
+# ioctl request cloning a whole file on btrfs/XFS (Linux)
+FICLONE = 0x40049409
+COPY_CHUNK = 8 * 1024 * 1024
+
+# Files up to this size (bytes) are copied in batches by copy_small_file, without picking a backend
+SMALL_FILE_SIZE = 64 * 1024
+
+# Prefix of the temporary files copies are written to before being renamed over their destination
+TEMPORARY_PREFIX = '.sync-'
+
+# Backends in order of preference, a selected backend falls back to the ones after it
+BACKENDS = ('reflink', 'copy_file_range', 'sendfile', 'buffered')
+
+# Errors meaning the backend cannot be used for this pair of files, anything else is a real failure
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF, errno.ENOTSOCK}
+
+copy_backend:str = 'auto'
+small_file_size:Optional[int] = SMALL_FILE_SIZE if os.utime in os.supports_fd and hasattr(os, 'fchmod') else None
+unsupported:set = set()    # (backend, source device, destination device) combinations that already failed
+lock = threading.Lock()
+
+
+def configure_copy_backend(backend:str) -> None:
+    """
+    Selects the first backend tried for every copy, 'auto' tries all of them in order of preference.
+    """
+    global copy_backend
+    copy_backend = backend
+
+
+def configure_small_files(max_size:Optional[int]) -> None:
+    """
+    Sets the maximum size (in bytes) of the files copied in batches, None or 0 copies every file on its own.
+    The fast path stays disabled on platforms without timestamps and permissions set through file descriptors.
+    """
+    global small_file_size
+    small_file_size = max_size if max_size and os.utime in os.supports_fd and hasattr(os, 'fchmod') else None
+
+
+def _reflink(source:BinaryIO, destination:BinaryIO) -> None:
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOTSUP, 'Reflinks are not supported on this platform')
+
+    fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+
+
+def _check_copied(source:BinaryIO, destination:BinaryIO, offset:int, backend:str) -> None:
+    """
+    Raises OSError(ENOSYS) when a kernel copy stopped before the end of the source, as copy_file_range and sendfile
+    do on procfs, some FUSE filesystems and older NFS/CIFS kernels, so the next backend copies the file again.
+    """
+    if offset < os.fstat(source.fileno()).st_size:
+        destination.seek(0)
+        destination.truncate()
+        raise OSError(errno.ENOSYS, f'{backend} stopped after {offset} bytes')
+
+
+def _copy_file_range(source:BinaryIO, destination:BinaryIO) -> None:
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+
+    offset:int = 0
+    while copied := os.copy_file_range(source.fileno(), destination.fileno(), COPY_CHUNK, offset, offset):
+        offset += copied
+        throttle.consume_bytes(copied)
+
+    _check_copied(source, destination, offset, 'copy_file_range')
+
+
+def _sendfile(source:BinaryIO, destination:BinaryIO) -> None:
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, 'sendfile is not available')
+
+    offset:int = 0
+    while sent := os.sendfile(destination.fileno(), source.fileno(), offset, COPY_CHUNK):
+        offset += sent
+        throttle.consume_bytes(sent)
+
+    _check_copied(source, destination, offset, 'sendfile')
+
+
+def _buffered(source:BinaryIO, destination:BinaryIO) -> None:
+    while block := source.read(COPY_CHUNK):
+        destination.write(block)
+        throttle.consume_bytes(len(block))
+
+
+COPY_FUNCTIONS:Dict[str, Callable[[BinaryIO, BinaryIO], None]] = {
+    'reflink': _reflink,
+    'copy_file_range': _copy_file_range,
+    'sendfile': _sendfile,
+    'buffered': _buffered,
+}
+
+
+def copy_data(source_path:str, destination_path:str) -> str:
+    """
+    Copies the content of a file with the fastest backend supported by both filesystems.
+
+    Args:
+    - source_path: Path to the file to copy.
+    - destination_path: Path to the copy, created or truncated.
+
+    Reflinks share the data blocks on filesystems supporting clones (btrfs, XFS), copy_file_range and sendfile
+    copy inside the kernel, and buffered copies through user space are the last resort. Backends failing for
+    a pair of devices are skipped for the following copies.
+    Returns the name of the backend used.
+    """
+    first:int = BACKENDS.index(copy_backend) if copy_backend in BACKENDS else 0
+
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        devices:tuple = (os.fstat(source.fileno()).st_dev, os.fstat(destination.fileno()).st_dev)
+
+        for backend in BACKENDS[first:]:
+            if (backend, *devices) in unsupported:
+                continue
+
+            try:
+                COPY_FUNCTIONS[backend](source, destination)
+                metrics.bytes_copied.inc(os.fstat(destination.fileno()).st_size, backend=backend)
+                return backend
+
+            except OSError as e:
+                if backend == 'buffered' or e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+
+                with lock:
+                    unsupported.add((backend, *devices))
+
+                source.seek(0)
+                destination.seek(0)
+                destination.truncate()
+
+    return 'buffered'
+
+
+def copy_with_metadata(source_path:str, destination_path:str) -> str:
+    """
+    Copies a file and its metadata like shutil.copy2, using copy_data for the content.
+
+    The copy is written to a temporary file next to the destination and renamed over it once complete,
+    so an interrupted copy never leaves a truncated destination behind.
+    Returns the path of the copy, so it can be used as the copy_function of shutil.copytree.
+    """
+    if os.path.isdir(destination_path):
+        destination_path = os.path.join(destination_path, os.path.basename(source_path))
+
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(destination_path) or '.', prefix=TEMPORARY_PREFIX)
+    os.close(descriptor)
+
+    try:
+        with metrics.copy_seconds.time():
+            copy_data(source_path, temporary_path)
+            shutil.copystat(source_path, temporary_path)
+            os.replace(temporary_path, destination_path)
+
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    return destination_path
+
+
+def copy_small_file(source_path:str, destination_path:str) -> tuple:
+    """
+    Copies a small file and its permissions and timestamps with as few system calls as possible.
+
+    The content is read with a single read of the expected size and written to a temporary file renamed over
+    the destination, like copy_with_metadata. Permissions and timestamps are set through the open temporary
+    file instead of by path, and extended attributes and file flags are not copied.
+    Returns (source stat, destination stat) so the caller does not have to stat either file again.
+    """
+    source_descriptor:int = os.open(source_path, os.O_RDONLY)
+    try:
+        source_stat = os.fstat(source_descriptor)
+        data:bytes = os.read(source_descriptor, source_stat.st_size + 1)
+
+        # The file grew since it was stat'ed, the rest is read as well
+        if len(data) > source_stat.st_size:
+            blocks:List[bytes] = [data]
+            while block := os.read(source_descriptor, COPY_CHUNK):
+                blocks.append(block)
+            data = b''.join(blocks)
+    finally:
+        os.close(source_descriptor)
+
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(destination_path) or '.', prefix=TEMPORARY_PREFIX)
+
+    try:
+        with memoryview(data) as view:
+            written:int = 0
+            while written < len(data):
+                written += os.write(descriptor, view[written:])
+
+        os.fchmod(descriptor, stat.S_IMODE(source_stat.st_mode))
+        os.utime(descriptor, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        destination_stat = os.fstat(descriptor)
+        os.close(descriptor)
+        descriptor = -1
+        os.replace(temporary_path, destination_path)
+
+    except BaseException:
+        if descriptor >= 0:
+            os.close(descriptor)
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    throttle.consume_bytes(len(data))
+    return source_stat, destination_stat
+
+
+def copy_to_many(source_path:str, destination_paths:List[str]) -> Dict[str, Optional[OSError]]:
+    """
+    Copies a file and its metadata to several destinations, reading the source only once.
+
+    Args:
+    - source_path: Path to the file to copy.
+    - destination_paths: Paths to the copies, typically the same file in several replicas.
+
+    Each block read from the source is written to a temporary file next to every destination, renamed over it
+    once complete like copy_with_metadata. A destination failing is dropped without interrupting the others,
+    while a failure reading the source is raised.
+    Returns the error of each destination, None when its copy succeeded.
+    """
+    if len(destination_paths) == 1:
+        try:
+            copy_with_metadata(source_path, destination_paths[0])
+            return {destination_paths[0]: None}
+        except OSError as e:
+            return {destination_paths[0]: e}
+
+    errors:Dict[str, Optional[OSError]] = {}
+    temporaries:Dict[str, tuple] = {}     # Destination path -> (temporary path, open file)
+
+    def discard(destination_path:str, error:OSError) -> None:
+        temporary_path, file = temporaries.pop(destination_path)
+        errors[destination_path] = error
+        file.close()
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+    try:
+        for destination_path in destination_paths:
+            try:
+                descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(destination_path) or '.', prefix=TEMPORARY_PREFIX)
+                temporaries[destination_path] = (temporary_path, os.fdopen(descriptor, 'wb'))
+            except OSError as e:
+                errors[destination_path] = e
+
+        with metrics.copy_seconds.time(), open(source_path, 'rb') as source:
+            while temporaries and (block := source.read(COPY_CHUNK)):
+                for destination_path, (_, file) in list(temporaries.items()):
+                    try:
+                        file.write(block)
+                    except OSError as e:
+                        discard(destination_path, e)
+                throttle.consume_bytes(len(block) * len(temporaries))
+
+        for destination_path, (temporary_path, file) in list(temporaries.items()):
+            try:
+                file.close()
+                shutil.copystat(source_path, temporary_path)
+                os.replace(temporary_path, destination_path)
+            except OSError as e:
+                discard(destination_path, e)
+                continue
+
+            del temporaries[destination_path]
+            errors[destination_path] = None
+            metrics.bytes_copied.inc(os.stat(destination_path).st_size, backend='fanout')
+
+    finally:
+        for temporary_path, file in temporaries.values():
+            file.close()
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    return errors
+
+
+def remove_temporary_files(directory_path:str, source_directory_path:str) -> None:
+    """
+    Deletes the temporary copies left in a replica folder by an interrupted run.
+
+    Args:
+    - directory_path: Replica folder to clean.
+    - source_directory_path: Matching source folder, files that also exist there are kept.
+    """
+    try:
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                if (entry.name.startswith(TEMPORARY_PREFIX) and entry.is_file(follow_symlinks=False)
+                        and not os.path.lexists(os.path.join(source_directory_path, entry.name))):
+                    os.remove(entry.path)
+
+    except FileNotFoundError:
+        pass
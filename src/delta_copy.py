@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from typing import NamedTuple
+from src.copy_backend import copy_data, TEMPORARY_PREFIX
+
+
+BLOCK_SIZE = 128 * 1024
+
+
+class DeltaStats(NamedTuple):
+    bytes_read: int
+    bytes_written: int
+    blocks_changed: int
+
+
+def _patch_in_place(source_path:str, replica_path:str, block_size:int) -> DeltaStats:
+    """
+    Compares the source and replica block by block and rewrites only the replica blocks that differ.
+    """
+    bytes_read = bytes_written = blocks_changed = offset = 0
+
+    with open(source_path, 'rb') as source, open(replica_path, 'r+b') as replica:
+        while block := source.read(block_size):
+            current:bytes = replica.read(len(block))
+            bytes_read += len(block) + len(current)
+
+            if block != current:
+                replica.seek(offset)
+                replica.write(block)
+                bytes_written += len(block)
+                blocks_changed += 1
+
+            offset += len(block)
+            replica.seek(offset)
+
+        replica.truncate(offset)
+
+    return DeltaStats(bytes_read, bytes_written, blocks_changed)
+
+
+def _replace_with_copy(source_path:str, replica_path:str) -> DeltaStats:
+    """
+    Copies the source next to the replica and atomically renames it over the replica.
+    """
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(replica_path), prefix=TEMPORARY_PREFIX)
+    os.close(descriptor)
+
+    try:
+        copy_data(source_path, temporary_path)
+        os.replace(temporary_path, replica_path)
+
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    size:int = os.path.getsize(replica_path)
+    return DeltaStats(size, size, -1)
+
+
+def delta_copy(source_path:str, replica_path:str, block_size:int = BLOCK_SIZE) -> DeltaStats:
+    """
+    Updates an existing replica file by writing only the blocks that differ from the source.
+
+    Args:
+    - source_path: Path to the modified source file.
+    - replica_path: Path to the outdated replica file.
+    - block_size: Size of the compared blocks in bytes.
+
+    When the replica cannot be patched in place it is replaced through a temporary file and an atomic rename.
+    Metadata is copied like shutil.copy2 does.
+
+    Returns:
+    - DeltaStats with the bytes read from both files, the bytes written and the number of rewritten blocks
+      (-1 when the whole file was replaced).
+    """
+    try:
+        stats:DeltaStats = _patch_in_place(source_path, replica_path, block_size)
+    except OSError:
+        stats = _replace_with_copy(source_path, replica_path)
+
+    shutil.copystat(source_path, replica_path)
+    return stats
@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import hashlib
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+AGE_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# Filter used by the tree walks and folder copies, None synchronizes everything
+path_filter = None
+
+
+def configure_path_filter(new_filter:Optional['PathFilter']) -> None:
+    """
+    Sets the filter applied by the tree walks and folder copies. None disables filtering.
+    """
+    global path_filter
+    path_filter = new_filter if new_filter and not new_filter.is_empty() else None
+
+
+def _parse_amount(text:str, units:dict) -> int:
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([A-Za-z]?)[Bb]?\s*', text)
+    unit:str = match.group(2) if match else ''
+    if not match or (unit not in units and unit.upper() not in units):
+        raise ValueError(f"Invalid amount '{text}'")
+    return int(float(match.group(1)) * units.get(unit, units.get(unit.upper())))
+
+
+def glob_to_regex(pattern:str) -> str:
+    """
+    Translates a gitignore-style glob into a regular expression body.
+    '*' and '?' never match '/', '**' matches across folders.
+    """
+    regex:List[str] = []
+    index:int = 0
+
+    while index < len(pattern):
+        character:str = pattern[index]
+
+        if pattern.startswith('**/', index):
+            regex.append('(?:.*/)?')
+            index += 3
+            continue
+
+        if pattern.startswith('**', index):
+            regex.append('.*')
+            index += 2
+            continue
+
+        if character == '*':
+            regex.append('[^/]*')
+        elif character == '?':
+            regex.append('[^/]')
+        elif character == '[' and ']' in pattern[index + 1:]:
+            end:int = pattern.index(']', index + 1)
+            content:str = pattern[index + 1:end]
+            if content.startswith('!'):
+                content = '^' + content[1:]
+            regex.append('[' + content.replace('\\', '\\\\') + ']')
+            index = end
+        elif character == '\\' and index + 1 < len(pattern):
+            index += 1
+            regex.append(re.escape(pattern[index]))
+        else:
+            regex.append(re.escape(character))
+
+        index += 1
+
+    return ''.join(regex)
+
+
+def compile_rule(line:str) -> Tuple[str, bool]:
+    """
+    Compiles one glob rule into (regex, negated).
+
+    The regex is matched against paths relative to the source root, with '/' separators and a trailing '/'
+    for folders, and also matches everything below a matching folder.
+    """
+    negated:bool = line.startswith('!')
+    if negated or line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+
+    directory_only:bool = line.endswith('/')
+    line = line.rstrip('/')
+
+    # Like gitignore, a pattern containing a '/' is relative to the root, otherwise it matches at any depth
+    anchored:bool = '/' in line
+    body:str = glob_to_regex(line.lstrip('/'))
+    prefix:str = '^' if anchored else '^(?:.*/)?'
+    suffix:str = '/.*$' if directory_only else '(?:/.*)?$'
+
+    return prefix + body + suffix, negated
+
+
+class PathFilter:
+    def __init__(self, rules:Iterable[str] = ()):
+        """
+        Include/exclude rules compiled once into regular expressions.
+
+        Args:
+        - rules: Lines in gitignore style. Globs exclude the matching files and folders ('build/' matches folders
+                 only, '/x' or 'a/b' are relative to the source root, '**' matches across folders), '!pattern'
+                 includes a path again, 'size>100M' excludes larger files and 'age>30d' excludes files not
+                 modified for longer. Empty lines and lines starting with '#' are ignored.
+
+        The last matching glob decides, and like in gitignore a path inside an excluded folder cannot be included
+        again. Without '!' rules every glob is merged into a single regular expression.
+        """
+        self.max_size:Optional[int] = None
+        self.max_age:Optional[float] = None
+        compiled:List[Tuple[str, bool]] = []
+
+        for line in rules:
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+            elif line.startswith('size>'):
+                self.max_size = _parse_amount(line[5:], SIZE_UNITS)
+            elif line.startswith('age>'):
+                self.max_age = _parse_amount(line[4:], AGE_UNITS)
+            else:
+                compiled.append(compile_rule(line))
+
+        self.rules:List[Tuple[re.Pattern, bool]] = [(re.compile(regex), negated) for regex, negated in reversed(compiled)]
+        self.combined:Optional[re.Pattern] = None
+
+        if compiled and not any(negated for _, negated in compiled):
+            self.combined = re.compile('|'.join(f'(?:{regex})' for regex, _ in compiled))
+
+
+    @classmethod
+    def load(cls, rules_path:str) -> 'PathFilter':
+        """
+        Reads the rules from a file, one per line.
+        """
+        with open(rules_path, encoding='utf-8') as file:
+            return cls(file.read().splitlines())
+
+
+    def is_empty(self) -> bool:
+        return not self.rules and self.max_size is None and self.max_age is None
+
+
+    def fingerprint(self) -> str:
+        """
+        Returns a short digest of the rules, to tell whether state saved by a previous run used the same ones.
+        """
+        description:str = repr(([(regex.pattern, negated) for regex, negated in self.rules], self.max_size, self.max_age))
+        return hashlib.blake2b(description.encode(), digest_size=8).hexdigest()
+
+
+    def excludes(self, rel_path:str, is_dir:bool, stat_result:Optional[os.stat_result] = None) -> bool:
+        """
+        Returns True if a path must not be synchronized.
+
+        Args:
+        - rel_path: Path relative to the source root.
+        - is_dir: Whether the path is a folder.
+        - stat_result: Optional stat of the path, needed for the size and age rules.
+        """
+        if self.rules:
+            key:str = rel_path.replace(os.sep, '/') if os.sep != '/' else rel_path
+            if is_dir:
+                key += '/'
+
+            if self.combined is not None:
+                if self.combined.match(key):
+                    return True
+            else:
+                # Like gitignore, a path cannot be included again when one of its parent folders is excluded
+                position:int = key.find('/')
+                while 0 <= position < len(key) - 1:
+                    if self._rules_exclude(key[:position + 1]):
+                        return True
+                    position = key.find('/', position + 1)
+
+                if self._rules_exclude(key):
+                    return True
+
+        if is_dir or stat_result is None:
+            return False
+
+        if self.max_size is not None and stat_result.st_size > self.max_size:
+            return True
+
+        return self.max_age is not None and time.time() - stat_result.st_mtime > self.max_age
+
+
+    def _rules_exclude(self, key:str) -> bool:
+        """
+        Returns True if the last glob matching key excludes it, key using '/' separators and a trailing '/' for folders.
+        """
+        for regex, negated in self.rules:
+            if regex.match(key):
+                return not negated
+        return False
+
+
+    def copytree_ignore(self, source_directory_path:str) -> Callable[[str, List[str]], set]:
+        """
+        Returns an ignore function for shutil.copytree skipping the excluded entries of each copied folder.
+        """
+        def ignore(directory_path:str, names:List[str]) -> set:
+            rel_directory:str = os.path.relpath(directory_path, source_directory_path)
+            ignored:set = set()
+
+            for name in names:
+                path:str = os.path.join(directory_path, name)
+                rel_path:str = name if rel_directory == '.' else os.path.join(rel_directory, name)
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                if self.excludes(rel_path, os.path.isdir(path), stat_result):
+                    ignored.add(name)
+
+            return ignored
+
+        return ignore
@@ -1,15 +1,68 @@
+from src.filters import PathFilter
+from src.throttle import parse_limits, read_limits_file
 import sys
 import os
 
 
+# Optional flags accepted after the positional arguments, mapped to their description
+OPTIONS = {
+    '--checksum': 'Compare files by content (BLAKE2 checksums) during reconciliation and integrity checks.',
+    '--delta-threshold=<MB>': 'Update modified files of at least this size by rewriting only their changed blocks.',
+    '--quiet-period=<seconds>': 'Wait until a file has no new events for this long before copying it (default 1).',
+    '--min-latency=<seconds>': 'Time changes are collected after the first event when the source is quiet (default 0.2).',
+    '--monitor=<process|thread>': 'Watch the source folder from a separate process (default) or from a thread without IPC.',
+    '--runtime=<threads|asyncio>': 'Run the synchronization loop on threads (default) or on an asyncio event loop with a shared I/O pool.',
+    '--io-workers=<n>': 'Run every file operation on one pool of this many threads created at startup, instead of a pool per reconciliation (always with the asyncio runtime, default CPUs + 4).',
+    '--operation-timeout=<seconds>': 'Cancel a catch-up, batch of changes or repair still running after this long, the rest is repaired later (asyncio runtime).',
+    '--copy-backend=<auto|reflink|copy_file_range|sendfile|buffered>': 'First file copy method tried, slower ones are used as fallbacks (default auto).',
+    '--small-files=<KB>': 'Copy files up to this size in batches with fewer system calls per file, 0 disables it (default 64).',
+    '--async-logging': 'Format and write log lines in batches from a background thread.',
+    '--log-verbosity=<files|summary>': 'Log every file operation (default) or only the aggregate counts of each sync cycle.',
+    '--metrics-port=<port>': 'Serve Prometheus metrics at http://127.0.0.1:<port>/metrics.',
+    '--stats-file=<path>': 'Write the metrics to this file every 10 seconds and on exit.',
+    '--seed-limits=<mbps=N,iops=N,workers=N>': 'Bandwidth (MB/s), file operations per second and threads of initial copies, reconciliations and full repairs.',
+    '--live-limits=<mbps=N,iops=N,workers=N>': 'Same limits for the changes detected while monitoring.',
+    '--scrub-limits=<mbps=N,iops=N,workers=N>': 'Same limits for the background verification (default mbps=16,iops=500).',
+    '--limits-file=<path>': 'File of \'seed: <limits>\', \'live: <limits>\' and \'scrub: <limits>\' lines, applied again whenever it is modified.',
+    '--scrub-interval=<seconds>': 'Time between two background verification passes of the replicas, 0 disables them (default 3600).',
+    '--exit-check': 'Reconcile every replica with the source before exiting.',
+    '--replicas=<path,...>': 'Additional replica folders fed by the same monitor, source walk and file reads.',
+    '--filter-file=<path>': 'Gitignore-style rules of the paths left out of the synchronization (globs, !includes, size>, age>).',
+    '--exclude=<pattern,...>': 'Comma-separated rules added after those of the filter file, e.g. node_modules/,*.tmp,size>1G.',
+}
+
+
 def show_error_text():
     print("Error: Incorrect number of arguments \n")
     print("Usage: python main.py <Source Folder Path> <Replica Folder Path> <Synchronization interval in Seconds> <Log File Location>")
     print("\nArguments:")
     print("  1. Source Folder Path - Path to the source folder.")
     print("  2. Replica Folder Path - Path to the destination folder.")
-    print("  3. Synchronization interval - Time interval (in seconds) for synchronization.")
+    print("  3. Synchronization interval - Maximum time (in seconds) between a change and its synchronization.")
     print("  4. Log File Location - Path to the log file. \n")
+    print("Options:")
+    for option, description in OPTIONS.items():
+        print(f"  {option} - {description}")
+    print()
+
+
+def split_arguments(arguments:list) -> tuple:
+    """
+    Separates the positional arguments from the optional flags.
+    Flags are written as --name or --name=value.
+    Returns a tuple (positional arguments, dictionary of flag name to value).
+    """
+    positional:list = []
+    options:dict = {}
+
+    for argument in arguments:
+        if argument.startswith('--'):
+            name, _, value = argument.partition('=')
+            options[name] = value if value else True
+        else:
+            positional.append(argument)
+
+    return positional, options
 
 
 def valid_path(path:str) -> bool:
@@ -28,6 +81,42 @@ def valid_path(path:str) -> bool:
         return False 
 
 
+def valid_number(value, allow_zero:bool = False) -> bool:
+    """
+    Returns True if the given option value is a positive number (or zero when allow_zero is set).
+    """
+    try:
+        return float(value) >= 0 if allow_zero else float(value) > 0
+
+    except (TypeError, ValueError):
+        return False
+
+
+def replica_paths(options:dict) -> list:
+    """
+    Returns the additional replica folders given with --replicas.
+    """
+    if not isinstance(options.get('--replicas'), str):
+        return []
+    return [path for path in options['--replicas'].split(',') if path]
+
+
+def filter_rules(options:dict) -> PathFilter:
+    """
+    Compiles the rules of the filter file followed by those of the --exclude option.
+    """
+    rules:list = []
+
+    if isinstance(options.get('--filter-file'), str):
+        with open(options['--filter-file'], encoding='utf-8') as file:
+            rules.extend(file.read().splitlines())
+
+    if isinstance(options.get('--exclude'), str):
+        rules.extend(options['--exclude'].split(','))
+
+    return PathFilter(rules)
+
+
 def input_validation() -> bool:
     """
     Validates the user input by checking the number of arguments and ensuring 
@@ -36,27 +125,97 @@ def input_validation() -> bool:
     Returns True if all inputs are valid, otherwise returns False.
     """
     errors = []
+    arguments, options = split_arguments(sys.argv)
 
-    if len(sys.argv) < 5:
+    if len(arguments) < 5:
         show_error_text()
         return False
 
     else:
-        if not os.path.exists(sys.argv[1]):
-            errors.append(f"Error: The Original Folder Path '{sys.argv[1]}' is invalid.")
+        if not os.path.exists(arguments[1]):
+            errors.append(f"Error: The Original Folder Path '{arguments[1]}' is invalid.")
         
-        if not valid_path(sys.argv[2]):
-            errors.append(f"Error: The Replica Folder Path '{sys.argv[2]}' is invalid or could not be created.")
+        if not valid_path(arguments[2]):
+            errors.append(f"Error: The Replica Folder Path '{arguments[2]}' is invalid or could not be created.")
         
         try:
-            interval = int(sys.argv[3])
+            interval = int(arguments[3])
             if interval <= 0:
-                errors.append(f"Error: The Sync Interval '{sys.argv[3]}' is invalid. It should be a positive integer.")
+                errors.append(f"Error: The Sync Interval '{arguments[3]}' is invalid. It should be a positive integer.")
         except ValueError:
-            errors.append(f"Error: The Sync Interval '{sys.argv[3]}' is invalid. It should be an integer.")
+            errors.append(f"Error: The Sync Interval '{arguments[3]}' is invalid. It should be an integer.")
+
+        if not os.path.isfile(arguments[4]) or not arguments[4].endswith('.log'):
+            errors.append(f"Error: The Log File Path '{arguments[4]}' is invalid or not a .log file.")
+
+        for option in options:
+            if option not in [name.split('=')[0] for name in OPTIONS]:
+                errors.append(f"Error: Unknown option '{option}'.")
+
+        if '--delta-threshold' in options and not valid_number(options['--delta-threshold']):
+            errors.append(f"Error: The Delta Threshold '{options['--delta-threshold']}' is invalid. It should be a positive number of MB.")
+
+        if '--quiet-period' in options and not valid_number(options['--quiet-period'], allow_zero=True):
+            errors.append(f"Error: The Quiet Period '{options['--quiet-period']}' is invalid. It should be a number of seconds.")
+
+        if '--min-latency' in options and not valid_number(options['--min-latency'], allow_zero=True):
+            errors.append(f"Error: The Minimum Latency '{options['--min-latency']}' is invalid. It should be a number of seconds.")
+
+        if options.get('--monitor', 'process') not in ('process', 'thread'):
+            errors.append(f"Error: The Monitor Mode '{options['--monitor']}' is invalid. It should be 'process' or 'thread'.")
+
+        if options.get('--runtime', 'threads') not in ('threads', 'asyncio'):
+            errors.append(f"Error: The Runtime '{options['--runtime']}' is invalid. It should be 'threads' or 'asyncio'.")
+
+        if '--io-workers' in options and not (str(options['--io-workers']).isdigit() and int(options['--io-workers']) > 0):
+            errors.append(f"Error: The I/O Workers '{options['--io-workers']}' is invalid. It should be a positive integer.")
+
+        if '--operation-timeout' in options and not valid_number(options['--operation-timeout']):
+            errors.append(f"Error: The Operation Timeout '{options['--operation-timeout']}' is invalid. It should be a positive number of seconds.")
+
+        if options.get('--log-verbosity', 'files') not in ('files', 'summary'):
+            errors.append(f"Error: The Log Verbosity '{options['--log-verbosity']}' is invalid. It should be 'files' or 'summary'.")
+
+        if '--metrics-port' in options and not (str(options['--metrics-port']).isdigit() and 0 < int(options['--metrics-port']) < 65536):
+            errors.append(f"Error: The Metrics Port '{options['--metrics-port']}' is invalid. It should be a port number.")
+
+        if '--stats-file' in options and not (isinstance(options['--stats-file'], str) and os.path.isdir(os.path.dirname(os.path.abspath(options['--stats-file'])))):
+            errors.append(f"Error: The Stats File Path '{options['--stats-file']}' is invalid.")
+
+        if options.get('--copy-backend', 'auto') not in ('auto', 'reflink', 'copy_file_range', 'sendfile', 'buffered'):
+            errors.append(f"Error: The Copy Backend '{options['--copy-backend']}' is invalid. It should be auto, reflink, copy_file_range, sendfile or buffered.")
+
+        if '--small-files' in options and not valid_number(options['--small-files'], allow_zero=True):
+            errors.append(f"Error: The Small File Size '{options['--small-files']}' is invalid. It should be a number of KB.")
+
+        if '--scrub-interval' in options and not valid_number(options['--scrub-interval'], allow_zero=True):
+            errors.append(f"Error: The Scrub Interval '{options['--scrub-interval']}' is invalid. It should be a number of seconds.")
+
+        for option in ('--seed-limits', '--live-limits', '--scrub-limits'):
+            if option in options:
+                try:
+                    parse_limits(str(options[option]))
+                except ValueError as e:
+                    errors.append(f"Error: The {option} value '{options[option]}' is invalid. {e}")
+
+        if '--limits-file' in options:
+            try:
+                read_limits_file(str(options['--limits-file']))
+            except (OSError, ValueError) as e:
+                errors.append(f"Error: The Limits File '{options['--limits-file']}' is invalid. {e}")
+
+        for replica_path in replica_paths(options):
+            if not valid_path(replica_path):
+                errors.append(f"Error: The Replica Folder Path '{replica_path}' is invalid or could not be created.")
+
+        if '--filter-file' in options and not (isinstance(options['--filter-file'], str) and os.path.isfile(options['--filter-file'])):
+            errors.append(f"Error: The Filter File '{options['--filter-file']}' does not exist.")
 
-        if not os.path.isfile(sys.argv[4]) or not sys.argv[4].endswith('.log'):
-            errors.append(f"Error: The Log File Path '{sys.argv[4]}' is invalid or not a .log file.")
+        else:
+            try:
+                filter_rules(options)
+            except (OSError, ValueError) as e:
+                errors.append(f"Error: The filter rules are invalid. {e}")
 
     if errors:
         for error in errors:
@@ -69,10 +228,12 @@ def input_validation() -> bool:
 def validation() -> tuple:
     """
     Performs input validation and returns the valid arguments as a tuple.
+    The last element is the dictionary of optional flags.
     If validation fails, the program exits with a status code of 1.
     """
     if input_validation():
-        return sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4]
+        arguments, options = split_arguments(sys.argv)
+        return arguments[1], arguments[2], int(arguments[3]), arguments[4], options
     else:
         sys.exit(1)
 
@@ -0,0 +1,53 @@
+import os
+import threading
+import concurrent.futures
+from typing import Optional
+
+
+class OperationCancelled(Exception):
+    """
+    Raised when a synchronization phase is cancelled before all of its file operations were started.
+    """
+
+
+# Long-lived pool shared by every reconciliation and batch of changes, None creates a pool per call
+pool:Optional[concurrent.futures.ThreadPoolExecutor] = None
+size:int = 0
+
+# Set to stop the running phase: operations already started finish, the next ones are not started
+cancelled = threading.Event()
+
+
+def default_size() -> int:
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def configure_io_pool(max_workers:Optional[int] = None) -> None:
+    """
+    Creates the shared pool of threads running the blocking file operations.
+
+    Args:
+    - max_workers: Number of threads, by default the number of CPUs plus four (at most 32).
+
+    The worker limits of the throttle budgets still apply, they cap the threads of the pool used by each phase.
+    """
+    global pool, size
+    shutdown_io_pool()
+    size = max_workers or default_size()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=size, thread_name_prefix='sync-io')
+
+
+def shutdown_io_pool() -> None:
+    global pool, size
+    if pool:
+        pool.shutdown(wait=True)
+    pool = None
+    size = 0
+
+
+def check_cancelled() -> None:
+    """
+    Raises OperationCancelled if the running phase was cancelled.
+    """
+    if cancelled.is_set():
+        raise OperationCancelled()
@@ -0,0 +1,156 @@
+import os
+import json
+import threading
+from typing import Dict, List, Tuple
+
+
+# Size (bytes) above which the journal is rewritten with its unfinished operations only
+COMPACT_SIZE = 1024 * 1024
+
+
+class OperationJournal:
+    def __init__(self, journal_path:str):
+        """
+        Opens (or creates) the append-only journal of replica operations.
+
+        Args:
+        - journal_path: Location of the journal file.
+
+        Every operation is written and flushed to disk before it touches the replica, and marked as done once
+        its manifest entry is committed. After a crash, only the paths of unfinished operations need to be repaired.
+        Each line is a JSON array: ["begin", id, action, [relative paths]] or ["done", id].
+        """
+        self.journal_path = journal_path
+        self.lock = threading.Lock()
+
+        self.open_operations:Dict[int, tuple] = self._load()
+        self.next_id:int = max(self.open_operations, default=0) + 1
+        self.finished:List[int] = []
+
+        self.file = open(journal_path, 'a', encoding='utf-8')
+
+
+    def _load(self) -> Dict[int, tuple]:
+        """
+        Reads the journal and returns the operations that were started but never marked as done.
+        A line torn by a crash is ignored.
+        """
+        operations:Dict[int, tuple] = {}
+
+        if not os.path.exists(self.journal_path):
+            return operations
+
+        with open(self.journal_path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record:list = json.loads(line)
+                except ValueError:
+                    continue
+
+                if record[0] == 'begin':
+                    operations[record[1]] = (record[2], tuple(record[3]))
+                elif record[0] == 'done':
+                    operations.pop(record[1], None)
+
+        return operations
+
+
+    def _write(self, records:List[list]) -> None:
+        self.file.writelines(json.dumps(record) + '\n' for record in records)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+    def begin(self, operations:List[Tuple[str, List[str]]]) -> List[int]:
+        """
+        Durably records operations that are about to be applied.
+
+        Args:
+        - operations: (action, relative paths touched by the action) for every operation.
+
+        Returns the id of each operation, to be passed to finish once it is applied.
+        """
+        with self.lock:
+            ids:List[int] = list(range(self.next_id, self.next_id + len(operations)))
+            self.next_id += len(operations)
+
+            for operation_id, (action, rel_paths) in zip(ids, operations):
+                self.open_operations[operation_id] = (action, tuple(rel_paths))
+
+            self._write([['begin', operation_id, action, list(rel_paths)] for operation_id, (action, rel_paths) in zip(ids, operations)])
+
+        return ids
+
+
+    def finish(self, operation_id:int) -> None:
+        """
+        Marks an operation as applied. It is only written as done once its manifest changes are committed.
+        """
+        with self.lock:
+            self.finished.append(operation_id)
+
+
+    def take_finished(self) -> List[int]:
+        """
+        Returns the operations finished since the last call, to be marked as done after the manifest commit.
+        """
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
+
+
+    def mark_done(self, operation_ids:List[int]) -> None:
+        """
+        Writes the done marks of committed operations, compacting the journal when it grew too large.
+        """
+        if not operation_ids:
+            return
+
+        with self.lock:
+            for operation_id in operation_ids:
+                self.open_operations.pop(operation_id, None)
+
+            self._write([['done', operation_id] for operation_id in operation_ids])
+
+            if self.file.tell() > COMPACT_SIZE:
+                self._compact()
+
+
+    def _compact(self) -> None:
+        """
+        Atomically rewrites the journal with the unfinished operations only.
+        """
+        temporary_path:str = self.journal_path + '.tmp'
+
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            for operation_id, (action, rel_paths) in self.open_operations.items():
+                file.write(json.dumps(['begin', operation_id, action, list(rel_paths)]) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.file.close()
+        os.replace(temporary_path, self.journal_path)
+        self.file = open(self.journal_path, 'a', encoding='utf-8')
+
+
+    def unfinished_paths(self) -> List[str]:
+        """
+        Returns the relative paths touched by operations that were started but never marked as done.
+        """
+        with self.lock:
+            return sorted({rel_path for _, rel_paths in self.open_operations.values() for rel_path in rel_paths})
+
+
+    def reset(self) -> None:
+        """
+        Forgets every operation, once the replica is known to be consistent with the manifest.
+        """
+        with self.lock:
+            self.open_operations.clear()
+            self.finished = []
+            self._compact()
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
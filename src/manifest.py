@@ -0,0 +1,411 @@
+import os
+import stat
+import sqlite3
+import hashlib
+import threading
+import urllib.parse
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from src.journal import OperationJournal
+
+
+MANIFEST_FILENAME = '.sync_manifest.db'
+JOURNAL_SUFFIX = '.oplog'
+
+# The checksum cache has its own database, its writes never hold a lock on the manifest
+CHECKSUM_SUFFIX = '.checksums'
+
+# Name of the state holding the checkpoint saved on a clean shutdown
+CHECKPOINT_STATE = 'checkpoint'
+
+# Name of the state holding the digest of the replica root
+ROOT_DIGEST_STATE = 'root_digest'
+
+# Bytes of the BLAKE2 digest of a folder
+DIGEST_SIZE = 16
+
+
+class ManifestEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    inode: int
+    mode: int
+    hash: Optional[str]
+    source_inode: Optional[int] = None
+
+
+# Columns read into a ManifestEntry
+ENTRY_COLUMNS = 'size, mtime_ns, inode, mode, hash, source_inode'
+
+
+def file_line(name:str, size:int, mtime_ns:int) -> str:
+    return f'{name}\0f\0{size}\0{mtime_ns}'
+
+
+def folder_line(name:str, digest:str) -> str:
+    return f'{name}\0d\0{digest}'
+
+
+def combine_digests(lines:Iterable[str]) -> str:
+    """
+    Returns the digest of a folder from the file_line and folder_line of its children, in any order.
+    """
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for line in sorted(lines):
+        digest.update(line.encode('utf-8', 'surrogateescape') + b'\0\0')
+    return digest.hexdigest()
+
+
+def _subtree_bounds(rel_path:str) -> tuple:
+    """
+    Returns the (lower, upper) bounds that select every child of rel_path in an ordered index.
+    """
+    return rel_path + os.sep, rel_path + chr(ord(os.sep) + 1)
+
+
+class ReplicaManifest:
+    def __init__(self, replica_directory_path:str, manifest_path:Optional[str] = None, read_only:bool = False):
+        """
+        Opens (or creates) the persisted index of the replica directory.
+
+        Args:
+        - replica_directory_path: Path to the replica directory described by the manifest.
+        - manifest_path: Location of the SQLite database. Defaults to a hidden file in the replica root.
+        - read_only: Open an existing manifest without writing to it, for inspecting the manifest of a running
+          synchronization. There is no journal and the missing folder digests are only computed in memory.
+
+        The operation journal is kept next to the database, finished operations are marked as done on every commit.
+        Folders keep a digest of their content, the digests of the folders changed since are cleared on every commit
+        and computed again when asked for.
+        """
+        self.replica_directory_path = replica_directory_path
+        self.manifest_path = manifest_path or os.path.join(replica_directory_path, MANIFEST_FILENAME)
+        self.read_only = read_only
+        self.lock = threading.Lock()
+
+        # Folders whose children changed since the last commit
+        self.changed_folders:set = set()
+
+        # Digests computed by a read-only manifest, which cannot store them
+        self.computed_digests:Dict[str, str] = {}
+
+        if read_only:
+            self.connection = sqlite3.connect(f'file:{urllib.parse.quote(os.path.abspath(self.manifest_path))}?mode=ro', uri=True, check_same_thread=False)
+            self.journal:Optional[OperationJournal] = None
+            return
+
+        self.connection = sqlite3.connect(self.manifest_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        # Manifests created before the parent column existed are dropped and rebuilt on the next reconciliation
+        columns:list = [row[1] for row in self.connection.execute('PRAGMA table_info(entries)')]
+        if columns and 'parent' not in columns:
+            self.connection.execute('DROP TABLE entries')
+
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, mode INTEGER, hash TEXT, parent TEXT, source_inode INTEGER, digest TEXT)'
+        )
+
+        # The inode of the source path is recorded so moves can be detected, older manifests get it as entries are updated
+        if columns and 'parent' in columns and 'source_inode' not in columns:
+            self.connection.execute('ALTER TABLE entries ADD COLUMN source_inode INTEGER')
+
+        # Folder digests are computed when first asked for
+        if columns and 'parent' in columns and 'digest' not in columns:
+            self.connection.execute('ALTER TABLE entries ADD COLUMN digest TEXT')
+
+        self.connection.execute('CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS entries_source_inode ON entries (source_inode)')
+
+        # Small named values kept across runs, like the position of the scrubber
+        self.connection.execute('CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+        self.journal = OperationJournal(self.manifest_path + JOURNAL_SUFFIX)
+
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM entries LIMIT 1').fetchone() is None
+
+
+    def entries(self) -> Dict[str, ManifestEntry]:
+        """
+        Returns every recorded replica entry keyed by its path relative to the replica root.
+        """
+        with self.lock:
+            rows = self.connection.execute(f'SELECT path, {ENTRY_COLUMNS} FROM entries').fetchall()
+        return {row[0]: ManifestEntry(*row[1:]) for row in rows}
+
+
+    def children(self, rel_directory:str) -> Dict[str, ManifestEntry]:
+        """
+        Returns the recorded entries directly inside a replica folder, keyed by name.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT path, {ENTRY_COLUMNS} FROM entries WHERE parent = ?', (rel_directory,)
+            ).fetchall()
+        return {os.path.basename(row[0]): ManifestEntry(*row[1:]) for row in rows}
+
+
+    def with_source_inode(self, source_inode:int) -> List[Tuple[str, ManifestEntry]]:
+        """
+        Returns the (relative path, entry) of every replica path copied from the source file or folder with this inode.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT path, {ENTRY_COLUMNS} FROM entries WHERE source_inode = ?', (source_inode,)
+            ).fetchall()
+        return [(row[0], ManifestEntry(*row[1:])) for row in rows]
+
+
+    def entries_after(self, rel_path:str, limit:int) -> List[Tuple[str, ManifestEntry]]:
+        """
+        Returns up to limit (relative path, entry) pairs following rel_path in path order, '' starting from the first.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT path, {ENTRY_COLUMNS} FROM entries WHERE path > ? ORDER BY path LIMIT ?', (rel_path, limit)
+            ).fetchall()
+        return [(row[0], ManifestEntry(*row[1:])) for row in rows]
+
+
+    def read_state(self, name:str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+
+    def write_state(self, name:str, value:Optional[str]) -> None:
+        """
+        Stores a named value with the next commit, None removes it.
+        """
+        with self.lock:
+            if value is None:
+                self.connection.execute('DELETE FROM state WHERE name = ?', (name,))
+            else:
+                self.connection.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', (name, value))
+
+
+    def save_checkpoint(self, synced_ns:int, fingerprint:str = '') -> None:
+        """
+        Records that the replica matched the source at synced_ns (time.time_ns()), with the filter rules of fingerprint.
+        """
+        self.write_state(CHECKPOINT_STATE, f'{synced_ns} {fingerprint}'.rstrip())
+        self.commit()
+
+
+    def take_checkpoint(self, fingerprint:str = '') -> Optional[int]:
+        """
+        Returns the time of the saved checkpoint and removes it, so it is only used after the clean shutdown that wrote it.
+        None if there is none or it was saved with other filter rules.
+        """
+        saved:Optional[str] = self.read_state(CHECKPOINT_STATE)
+        if saved is None:
+            return None
+
+        self.write_state(CHECKPOINT_STATE, None)
+        self.commit()
+
+        synced_ns, _, saved_fingerprint = saved.partition(' ')
+        return int(synced_ns) if saved_fingerprint == fingerprint else None
+
+
+    def get(self, rel_path:str) -> Optional[ManifestEntry]:
+        with self.lock:
+            row = self.connection.execute(
+                f'SELECT {ENTRY_COLUMNS} FROM entries WHERE path = ?', (rel_path,)
+            ).fetchone()
+        return ManifestEntry(*row) if row else None
+
+
+    def record(self, rel_path:str, stat_result:os.stat_result, file_hash:Optional[str] = None, source_inode:Optional[int] = None) -> None:
+        """
+        Inserts or replaces the entry of a replica path.
+
+        Args:
+        - rel_path: Path relative to the replica root.
+        - stat_result: Stat of the replica file or directory after the change was applied.
+        - file_hash: Optional content hash of the file.
+        - source_inode: Optional inode of the source path it was copied from.
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO entries (path, size, mtime_ns, inode, mode, hash, parent, source_inode) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (rel_path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_mode, file_hash, os.path.dirname(rel_path), source_inode)
+            )
+            self.changed_folders.add(os.path.dirname(rel_path))
+
+
+    def record_path(self, rel_path:str, source_directory_path:Optional[str] = None) -> None:
+        """
+        Stats a replica path and records it, including every child when it is a directory.
+        With source_directory_path, the inodes of the matching source paths are recorded too.
+        """
+        replica_path:str = os.path.join(self.replica_directory_path, rel_path)
+        self.record(rel_path, os.stat(replica_path), source_inode=self._source_inode(source_directory_path, rel_path))
+
+        if os.path.isdir(replica_path):
+            for child_rel_path, stat_result in self._scan(replica_path, rel_path):
+                self.record(child_rel_path, stat_result, source_inode=self._source_inode(source_directory_path, child_rel_path))
+
+
+    def remove(self, rel_path:str) -> None:
+        """
+        Removes a path and, for directories, all of its children from the manifest.
+        """
+        lower, upper = _subtree_bounds(rel_path)
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)', (rel_path, lower, upper)
+            )
+            self.changed_folders.add(os.path.dirname(rel_path))
+
+
+    def rename(self, old_rel_path:str, new_rel_path:str) -> None:
+        """
+        Moves the entry of a path, and of all its children, to a new location.
+        """
+        old_lower, old_upper = _subtree_bounds(old_rel_path)
+        new_lower, new_upper = _subtree_bounds(new_rel_path)
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)', (new_rel_path, new_lower, new_upper)
+            )
+            self.connection.execute(
+                'UPDATE entries SET path = ?, parent = ? WHERE path = ?',
+                (new_rel_path, os.path.dirname(new_rel_path), old_rel_path)
+            )
+            self.connection.execute(
+                'UPDATE entries SET path = ? || substr(path, ?), parent = ? || substr(parent, ?) WHERE path >= ? AND path < ?',
+                (new_rel_path, len(old_rel_path) + 1, new_rel_path, len(old_rel_path) + 1, old_lower, old_upper)
+            )
+            self.changed_folders.update((os.path.dirname(old_rel_path), os.path.dirname(new_rel_path)))
+
+
+    def rebuild(self, source_directory_path:Optional[str] = None) -> None:
+        """
+        Discards the manifest content and records the current state of the replica directory.
+        With source_directory_path, the inodes of the matching source paths are recorded too.
+        """
+        with self.lock:
+            self.connection.execute('DELETE FROM entries')
+            self.changed_folders.add('')
+
+        for rel_path, stat_result in self._scan(self.replica_directory_path, ''):
+            self.record(rel_path, stat_result, source_inode=self._source_inode(source_directory_path, rel_path))
+
+        self.commit()
+
+
+    def digest(self, rel_directory:str = '') -> Optional[str]:
+        """
+        Returns the digest of a replica folder, '' for the root, covering the name, size and mtime of every file below it.
+        Only the digests of the folders changed since they were last asked for are computed again. None if the folder
+        is not recorded.
+        """
+        with self.lock:
+            self._clear_changed_digests()
+            return self._digest(rel_directory)
+
+
+    def commit(self) -> None:
+        # Operations finished after this point may not be part of the commit, they stay open in the journal
+        finished:list = self.journal.take_finished()
+        with self.lock:
+            self._clear_changed_digests()
+            self.connection.commit()
+        self.journal.mark_done(finished)
+
+
+    def close(self) -> None:
+        if self.read_only:
+            self.connection.close()
+            return
+        self.commit()
+        self.connection.close()
+        self.journal.close()
+
+
+    def _clear_changed_digests(self) -> None:
+        """
+        Clears the digests of the changed folders and of all their parents. Called with the lock held.
+        """
+        if not self.changed_folders:
+            return
+
+        folders:set = set()
+        for rel_directory in self.changed_folders:
+            while rel_directory and rel_directory not in folders:
+                folders.add(rel_directory)
+                rel_directory = os.path.dirname(rel_directory)
+        self.changed_folders = set()
+
+        self.connection.executemany('UPDATE entries SET digest = NULL WHERE path = ? AND digest IS NOT NULL', ((folder,) for folder in folders))
+        self.connection.execute('DELETE FROM state WHERE name = ?', (ROOT_DIGEST_STATE,))
+
+
+    def _digest(self, rel_directory:str) -> Optional[str]:
+        """
+        Returns the stored digest of a folder, computing the missing ones below it. Called with the lock held.
+        """
+        if rel_directory in self.computed_digests:
+            return self.computed_digests[rel_directory]
+
+        if rel_directory:
+            row = self.connection.execute('SELECT mode, digest FROM entries WHERE path = ?', (rel_directory,)).fetchone()
+            if row is None or not stat.S_ISDIR(row[0]):
+                return None
+            stored:Optional[str] = row[1]
+        else:
+            row = self.connection.execute('SELECT value FROM state WHERE name = ?', (ROOT_DIGEST_STATE,)).fetchone()
+            stored = row[0] if row else None
+
+        if stored:
+            return stored
+
+        lines:list = []
+        rows = self.connection.execute('SELECT path, size, mtime_ns, mode, digest FROM entries WHERE parent = ?', (rel_directory,)).fetchall()
+        for path, size, mtime_ns, mode, digest in rows:
+            name:str = os.path.basename(path)
+            if stat.S_ISDIR(mode):
+                lines.append(folder_line(name, digest or self._digest(path)))
+            else:
+                lines.append(file_line(name, size, mtime_ns))
+
+        digest = combine_digests(lines)
+        if self.read_only:
+            self.computed_digests[rel_directory] = digest
+        elif rel_directory:
+            self.connection.execute('UPDATE entries SET digest = ? WHERE path = ?', (digest, rel_directory))
+        else:
+            self.connection.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', (ROOT_DIGEST_STATE, digest))
+        return digest
+
+
+    def _source_inode(self, source_directory_path:Optional[str], rel_path:str) -> Optional[int]:
+        if not source_directory_path:
+            return None
+        try:
+            return os.lstat(os.path.join(source_directory_path, rel_path)).st_ino
+        except OSError:
+            return None
+
+
+    def _scan(self, directory_path:str, rel_directory:str) -> Iterator[tuple]:
+        """
+        Yields (relative path, stat result) for every entry below directory_path, skipping the manifest itself.
+        """
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                rel_path:str = os.path.join(rel_directory, entry.name) if rel_directory else entry.name
+                if rel_path.startswith(MANIFEST_FILENAME):
+                    continue
+
+                stat_result = entry.stat(follow_symlinks=False)
+                yield rel_path, stat_result
+
+                if stat.S_ISDIR(stat_result.st_mode):
+                    yield from self._scan(entry.path, rel_path)
@@ -0,0 +1,133 @@
+import os
+import stat
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+from src.manifest import MANIFEST_FILENAME, file_line, folder_line, combine_digests
+from src.copy_backend import TEMPORARY_PREFIX
+
+
+class TreeEntry(NamedTuple):
+    is_dir: bool
+    size: int
+    mtime_ns: int
+
+
+class LiveTree:
+    def __init__(self, directory_path:str, path_filter=None):
+        """
+        Digests of a directory tree on disk, computed with a single walk when the tree is created.
+
+        Args:
+        - directory_path: Path to the source or replica directory.
+        - path_filter: Optional PathFilter, the excluded paths are left out of the tree.
+
+        Folders are digested the same way the replica manifest digests its entries: the name, size and mtime of
+        every file and the digest of every sub-folder. Folder mtimes are left out, they differ between the source
+        and the replica.
+        """
+        self.directory_path = directory_path
+        self.path_filter = path_filter
+        self.digests:Dict[str, str] = {}
+        self._digest_folder('')
+
+
+    def digest(self, rel_directory:str = '') -> Optional[str]:
+        return self.digests.get(rel_directory)
+
+
+    def children(self, rel_directory:str) -> Dict[str, TreeEntry]:
+        children:Dict[str, TreeEntry] = {}
+        for name, stat_result in self._list(rel_directory):
+            children[name] = TreeEntry(stat.S_ISDIR(stat_result.st_mode), stat_result.st_size, stat_result.st_mtime_ns)
+        return children
+
+
+    def _list(self, rel_directory:str) -> Iterator[Tuple[str, os.stat_result]]:
+        try:
+            with os.scandir(os.path.join(self.directory_path, rel_directory)) as entries:
+                for entry in entries:
+                    if entry.name.startswith((MANIFEST_FILENAME, TEMPORARY_PREFIX)):
+                        continue
+                    try:
+                        stat_result = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if self.path_filter and self.path_filter.excludes(os.path.join(rel_directory, entry.name), stat.S_ISDIR(stat_result.st_mode), stat_result):
+                        continue
+                    yield entry.name, stat_result
+        except OSError:
+            return
+
+
+    def _digest_folder(self, rel_directory:str) -> str:
+        lines:list = []
+        for name, stat_result in self._list(rel_directory):
+            if stat.S_ISDIR(stat_result.st_mode):
+                lines.append(folder_line(name, self._digest_folder(os.path.join(rel_directory, name))))
+            else:
+                lines.append(file_line(name, stat_result.st_size, stat_result.st_mtime_ns))
+
+        self.digests[rel_directory] = combine_digests(lines)
+        return self.digests[rel_directory]
+
+
+class ManifestTree:
+    def __init__(self, manifest, path_filter=None):
+        """
+        Digest tree of a replica manifest, maintained by the manifest as it is updated.
+
+        Args:
+        - manifest: ReplicaManifest to read.
+        - path_filter: Optional PathFilter, the excluded paths are left out of the children. The digests still cover
+          them, folders holding excluded paths are compared entry by entry.
+        """
+        self.manifest = manifest
+        self.path_filter = path_filter
+
+
+    def digest(self, rel_directory:str = '') -> Optional[str]:
+        return self.manifest.digest(rel_directory)
+
+
+    def children(self, rel_directory:str) -> Dict[str, TreeEntry]:
+        children:Dict[str, TreeEntry] = {}
+        for name, entry in self.manifest.children(rel_directory).items():
+            is_dir:bool = stat.S_ISDIR(entry.mode)
+            if self.path_filter and self.path_filter.excludes(os.path.join(rel_directory, name), is_dir):
+                continue
+            children[name] = TreeEntry(is_dir, entry.size, entry.mtime_ns)
+        return children
+
+
+def diff_trees(left, right, rel_directory:str = '') -> Iterator[Tuple[str, str]]:
+    """
+    Yields (relative path, difference) for every path that differs between two trees, descending only into the
+    folders whose digests differ.
+
+    Args:
+    - left: LiveTree or ManifestTree.
+    - right: LiveTree or ManifestTree.
+    - rel_directory: Folder to compare, '' for the roots.
+
+    The difference is 'only left', 'only right', 'type differs' or 'differs'.
+    """
+    if left.digest(rel_directory) == right.digest(rel_directory):
+        return
+
+    left_children:Dict[str, TreeEntry] = left.children(rel_directory)
+    right_children:Dict[str, TreeEntry] = right.children(rel_directory)
+
+    for name in sorted(left_children.keys() | right_children.keys()):
+        rel_path:str = os.path.join(rel_directory, name)
+        left_entry:Optional[TreeEntry] = left_children.get(name)
+        right_entry:Optional[TreeEntry] = right_children.get(name)
+
+        if right_entry is None:
+            yield rel_path, 'only left'
+        elif left_entry is None:
+            yield rel_path, 'only right'
+        elif left_entry.is_dir != right_entry.is_dir:
+            yield rel_path, 'type differs'
+        elif left_entry.is_dir:
+            yield from diff_trees(left, right, rel_path)
+        elif left_entry != right_entry:
+            yield rel_path, 'differs'
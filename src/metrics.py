@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Tuple
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+def _label_text(labels:Tuple[tuple, ...], extra:str = '') -> str:
+    pairs:List[str] = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name:str, description:str):
+        """
+        Base of every metric: a value per combination of label values.
+
+        Args:
+        - name: Metric name in the exported text format.
+        - description: Help text of the metric.
+        """
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+        self.values:Dict[tuple, object] = {}
+
+
+    def render(self) -> List[str]:
+        lines:List[str] = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_text(labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount:float = 1, **labels) -> None:
+        key:tuple = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value:float, **labels) -> None:
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name:str, description:str, buckets:tuple = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = buckets
+
+
+    def observe(self, value:float, **labels) -> None:
+        key:tuple = tuple(sorted(labels.items()))
+        with self.lock:
+            # [count per bucket..., total count, sum]
+            state:list = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += 1
+            state[-1] += value
+
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observes the duration of the with block.
+        """
+        started:float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+    def render(self) -> List[str]:
+        lines:List[str] = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, state in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, state):
+                    bucket:str = _label_text(labels, 'le="' + str(bound) + '"')
+                    lines.append(f"{self.name}_bucket{bucket} {count}")
+                bucket = _label_text(labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket} {state[-2]}")
+                lines.append(f"{self.name}_count{_label_text(labels)} {state[-2]}")
+                lines.append(f"{self.name}_sum{_label_text(labels)} {state[-1]:.6f}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Collection of metrics exported together in the Prometheus text format.
+        """
+        self.metrics:List[Metric] = []
+
+
+    def register(self, metric:Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+registry = MetricsRegistry()
+
+events_received:Counter = registry.register(Counter('sync_events_received_total', 'Raw file system events received from the monitor.'))
+events_coalesced:Counter = registry.register(Counter('sync_events_coalesced_total', 'Events merged or cancelled out by the coalescer.'))
+changes_applied:Counter = registry.register(Counter('sync_changes_applied_total', 'Changes applied to the replica, by type.'))
+changes_failed:Counter = registry.register(Counter('sync_changes_failed_total', 'Changes that failed and were handed to a repair.'))
+bytes_copied:Counter = registry.register(Counter('sync_bytes_copied_total', 'Bytes written to the replica, by copy backend.'))
+copy_seconds:Histogram = registry.register(Histogram('sync_copy_seconds', 'Duration of single file copies.'))
+monitor_queue_depth:Gauge = registry.register(Gauge('sync_monitor_queue_depth', 'Events waiting in the folder monitor when they were last retrieved.'))
+walk_seconds:Histogram = registry.register(Histogram('sync_walk_seconds', 'Duration of full reconciliations (walk and apply), by kind.'))
+repairs:Counter = registry.register(Counter('sync_repairs_total', 'Repairs of failed changes, by kind (scoped or full).'))
+phase_seconds:Histogram = registry.register(Histogram('sync_phase_seconds', 'Time spent in each phase of the main loop.'))
+throttle_seconds:Counter = registry.register(Counter('sync_throttle_seconds_total', 'Time spent waiting for the rate limits, by budget and limit.'))
+scrub_entries:Counter = registry.register(Counter('sync_scrub_entries_total', 'Replica entries verified by the background scrubber, by result (ok or drifted).'))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body:bytes = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def start_http_endpoint(port:int, host:str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serves the metrics at http://host:port/metrics from a background thread.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_stats_file(path:str) -> None:
+    """
+    Atomically replaces the stats file with the current metrics.
+    """
+    temporary_path:str = path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        file.write(registry.render())
+    os.replace(temporary_path, path)
+
+
+def start_stats_file(path:str, interval:float = 10.0) -> threading.Event:
+    """
+    Rewrites the stats file every interval seconds from a background thread.
+    Returns the event stopping the thread.
+    """
+    stop_event = threading.Event()
+
+    def write_periodically() -> None:
+        while not stop_event.wait(interval):
+            write_stats_file(path)
+
+    threading.Thread(target=write_periodically, daemon=True).start()
+    return stop_event
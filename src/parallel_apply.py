@@ -0,0 +1,128 @@
+import os
+import threading
+import collections
+import contextvars
+import concurrent.futures
+from typing import Callable, Dict, List, Optional
+from src.coalesce import ancestors
+from src import io_pool
+
+
+def touched_paths(change:dict) -> List[str]:
+    """
+    Returns the source paths read or written by a change: its path and, for renames and moves, its destination.
+    """
+    paths:List[str] = [os.path.normpath(change['path'])]
+
+    if change['type'] == 'renamed':
+        paths.append(os.path.normpath(change['new_path']))
+    elif change['type'] == 'moved':
+        paths.append(os.path.join(os.path.normpath(change['new_path']), os.path.basename(change['path'])))
+
+    return paths
+
+
+def build_dependencies(changes:List[dict]) -> List[set]:
+    """
+    Computes, for every change, the earlier changes it has to wait for.
+
+    Two changes depend on each other when one touches a path equal to, or below, a path touched by the other:
+    a folder is created before its children, and a rename waits for pending writes on the same path.
+
+    Returns:
+    - List with the set of prerequisite change indices of each change.
+    """
+    dependencies:List[set] = []
+    latest:Dict[str, int] = {}           # Path -> last change touching exactly that path
+    below:Dict[str, List[int]] = {}      # Path -> changes touching a path below it since the last change at it
+
+    for index, change in enumerate(changes):
+        paths:List[str] = touched_paths(change)
+        prerequisites:set = set()
+
+        for path in paths:
+            if path in latest:
+                prerequisites.add(latest[path])
+
+            for parent in ancestors(path):
+                if parent in latest:
+                    prerequisites.add(latest[parent])
+
+            prerequisites.update(below.get(path, ()))
+
+        for path in paths:
+            latest[path] = index
+            # This change waits for everything below path, later changes only need to wait for it
+            below.pop(path, None)
+
+            for parent in ancestors(path):
+                below.setdefault(parent, []).append(index)
+
+        prerequisites.discard(index)
+        dependencies.append(prerequisites)
+
+    return dependencies
+
+
+def run_with_dependencies(tasks:List[Callable[[], None]], dependencies:List[set], max_workers:Optional[int] = None) -> None:
+    """
+    Runs tasks on a thread pool, starting each one only after all of its prerequisites finished.
+
+    Args:
+    - tasks: Callables to run. They are expected to handle their own errors.
+    - dependencies: Set of prerequisite task indices for each task, as returned by build_dependencies.
+    - max_workers: Maximum number of tasks running at the same time.
+
+    Tasks run on the shared io_pool when it is configured, otherwise on a pool created for the call.
+    """
+    if not tasks:
+        return
+
+    max_workers = min(max_workers or io_pool.size or io_pool.default_size(), io_pool.size or len(tasks))
+
+    remaining:List[int] = [len(prerequisites) for prerequisites in dependencies]
+    dependents:List[List[int]] = [[] for _ in tasks]
+    for index, prerequisites in enumerate(dependencies):
+        for prerequisite in prerequisites:
+            dependents[prerequisite].append(index)
+
+    lock = threading.Lock()
+    finished = threading.Event()
+    unfinished:List[int] = [len(tasks)]
+    running:List[int] = [0]
+    ready:collections.deque = collections.deque(index for index in range(len(tasks)) if remaining[index] == 0)
+
+    executor = io_pool.pool or concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def start_ready() -> None:
+        # Called with the lock held, keeps at most max_workers tasks submitted
+        while ready and running[0] < max_workers:
+            running[0] += 1
+            executor.submit(contextvars.copy_context().run, run, ready.popleft())
+
+    def run(index:int) -> None:
+        try:
+            tasks[index]()
+
+        finally:
+            with lock:
+                running[0] -= 1
+                for dependent in dependents[index]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        ready.append(dependent)
+
+                unfinished[0] -= 1
+                if unfinished[0] == 0:
+                    finished.set()
+
+                start_ready()
+
+    try:
+        with lock:
+            start_ready()
+        finished.wait()
+
+    finally:
+        if executor is not io_pool.pool:
+            executor.shutdown(wait=True)
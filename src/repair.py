@@ -0,0 +1,106 @@
+import time
+import logging
+from typing import Dict, List, Optional
+from src.manifest import ReplicaManifest
+from src.checksum import ChecksumCache
+from src import metrics
+from src.coalesce import is_within
+from src.tree_diff import outermost_paths
+from src.parallel_apply import touched_paths
+from src.synchronization import repair_path, relative_path, update_replica_directory
+
+
+class RepairQueue:
+    def __init__(self, source_directory_path:str, replica_directory_path:str, manifest:Optional[ReplicaManifest] = None,
+                 checksums:Optional[ChecksumCache] = None, base_delay:float = 1.0, max_delay:float = 60.0, max_attempts:int = 5):
+        """
+        Keeps the paths whose synchronization failed and repairs them in the following sync cycles.
+
+        Args:
+        - source_directory_path: Path to the source directory.
+        - replica_directory_path: Path to the replica directory.
+        - manifest: Optional replica manifest, updated with the repaired entries.
+        - checksums: Optional checksum cache, repairs then compare files by content like the reconciliation.
+        - base_delay: Seconds to wait before retrying a failed repair, doubled after every failure.
+        - max_delay: Maximum number of seconds between two attempts.
+        - max_attempts: Failed attempts after which the whole replica directory is updated instead.
+        """
+        self.source_directory_path = source_directory_path
+        self.replica_directory_path = replica_directory_path
+        self.manifest = manifest
+        self.checksums = checksums
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+        self.pending:Dict[str, list] = {}    # Relative path -> [failed attempts, time of the next attempt]
+        self.scoped_repairs:int = 0
+        self.full_repairs:int = 0
+
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+
+    def add(self, path:str, now:Optional[float] = None) -> None:
+        """
+        Queues a source path for repair in the next cycle.
+        """
+        now = time.monotonic() if now is None else now
+        rel_path:str = relative_path(path, self.source_directory_path)
+        self.pending.setdefault(rel_path, [0, now])
+
+
+    def add_change(self, change:dict, now:Optional[float] = None) -> None:
+        """
+        Queues every path touched by a failed change.
+        """
+        for path in touched_paths(change):
+            self.add(path, now)
+
+
+    def run(self, now:Optional[float] = None) -> None:
+        """
+        Repairs every queued path whose next attempt is due. Paths below another due path are covered by its repair.
+        Failed repairs are retried with exponential backoff, and after max_attempts the replica is fully updated.
+        """
+        now = time.monotonic() if now is None else now
+        due:List[str] = [rel_path for rel_path, (_, next_attempt) in self.pending.items() if next_attempt <= now]
+
+        if not due:
+            return
+
+        if '' in due or any(self.pending[rel_path][0] >= self.max_attempts for rel_path in due):
+            self._full_repair()
+            return
+
+        for rel_path in outermost_paths(due):
+            try:
+                kind:str = repair_path(self.source_directory_path, self.replica_directory_path, rel_path, self.manifest, self.checksums)
+
+            except OSError as e:
+                attempts:int = self.pending[rel_path][0] + 1
+                delay:float = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+                self.pending[rel_path] = [attempts, now + delay]
+                logging.error(f"[ERROR] Repairing: {rel_path}. Error: {e}. Retrying in {delay:.0f}s")
+                continue
+
+            self._count(kind)
+            for covered in [path for path in self.pending if is_within(path, rel_path)]:
+                del self.pending[covered]
+            logging.info(f"[FIXED] Error fixed: {rel_path}")
+
+
+    def _full_repair(self) -> None:
+        update_replica_directory(self.source_directory_path, self.replica_directory_path, self.manifest, self.checksums)
+        self._count('full')
+        self.pending.clear()
+        logging.info("[FIXED] Error fixed")
+
+
+    def _count(self, kind:str) -> None:
+        metrics.repairs.inc(kind=kind)
+        if kind == 'full':
+            self.full_repairs += 1
+        else:
+            self.scoped_repairs += 1
@@ -0,0 +1,303 @@
+import os
+import logging
+import contextvars
+import concurrent.futures
+from typing import List, Optional
+from src.manifest import ReplicaManifest, CHECKSUM_SUFFIX
+from src.checksum import ChecksumCache
+from src.repair import RepairQueue
+from src.scrubber import Scrubber, SCRUB_INTERVAL
+from src.run_summary import RunSummary, SUMMARY
+from src.coalesce import is_within
+from src.parallel_apply import touched_paths
+from src.tree_diff import PlannedAction, plan_replicas, replica_lister
+from src import filters
+from src import metrics
+from src import throttle
+from src.synchronization import (ReplicaWriter, apply_fanout, duplicate_source, update_replica_directory, catch_up_replica_directory,
+                                 replica_directory_is_empty, relative_path, replay_journal, synchronize)
+
+
+# Seconds a checkpoint is moved back, the source folders modified during that time are compared again
+CHECKPOINT_MARGIN = 10.0
+
+
+class Replica:
+    def __init__(self, source_directory_path:str, replica_directory_path:str, checksum:bool = False, scrub_interval:Optional[float] = SCRUB_INTERVAL):
+        """
+        One replica directory with its manifest, optional checksum cache, repair queue and scrubber.
+
+        Args:
+        - source_directory_path: Path to the source directory.
+        - replica_directory_path: Path to the replica directory.
+        - checksum: Compare files by content during reconciliation and scrubbing.
+        - scrub_interval: Seconds between two background verification passes, None disables them.
+        """
+        self.path = replica_directory_path
+        self.manifest = ReplicaManifest(replica_directory_path)
+        self.checksums:Optional[ChecksumCache] = ChecksumCache(self.manifest.manifest_path + CHECKSUM_SUFFIX) if checksum else None
+        self.repairs = RepairQueue(source_directory_path, replica_directory_path, self.manifest, self.checksums)
+        self.scrubber:Optional[Scrubber] = (
+            Scrubber(source_directory_path, replica_directory_path, self.manifest, self.repairs, self.checksums, scrub_interval)
+            if scrub_interval else None
+        )
+
+
+    def close(self) -> None:
+        self.manifest.close()
+        if self.checksums:
+            self.checksums.close()
+
+
+class ReplicaSet:
+    def __init__(self, source_directory_path:str, replica_directory_paths:List[str], checksum:bool = False, scrub_interval:Optional[float] = SCRUB_INTERVAL):
+        """
+        Replicas of the same source fed by a single folder monitor.
+
+        Args:
+        - source_directory_path: Path to the source directory.
+        - replica_directory_paths: Paths to the replica directories.
+        - checksum: Compare files by content during reconciliation and scrubbing.
+        - scrub_interval: Seconds between two background verification passes of each replica, None disables them.
+
+        With several replicas the source is walked once per reconciliation and every changed file is read once,
+        its content being written to all the replicas at the same time. Each replica keeps its own manifest,
+        journal and repair queue, so a failing replica does not hold back the others.
+        """
+        self.source_directory_path = source_directory_path
+        self.replicas:List[Replica] = [Replica(source_directory_path, path, checksum, scrub_interval) for path in replica_directory_paths]
+
+
+    def replay_journals(self) -> None:
+        """
+        Repairs the operations every replica left unfinished in a previous run.
+        """
+        for replica in self.replicas:
+            replay_journal(self.source_directory_path, replica.path, replica.manifest)
+
+
+    def catch_up(self) -> None:
+        """
+        Brings the replicas up to date at startup. Replicas with the checkpoint of a clean shutdown only compare the
+        source folders modified since, and start a verification pass for the files modified in place. The other
+        replicas are reconciled in full.
+
+        The replicas with a checkpoint are caught up together with a single walk of the source, from the oldest of
+        their checkpoints.
+        """
+        fingerprint:str = filters.path_filter.fingerprint() if filters.path_filter else ''
+        checkpointed:List[Replica] = []
+        since:List[int] = []
+        remaining:List[Replica] = []
+
+        for replica in self.replicas:
+            since_ns:Optional[int] = replica.manifest.take_checkpoint(fingerprint)
+
+            if since_ns is None or replica.manifest.is_empty():
+                remaining.append(replica)
+            else:
+                checkpointed.append(replica)
+                since.append(since_ns)
+
+        if len(checkpointed) == 1:
+            replica = checkpointed[0]
+            catch_up_replica_directory(self.source_directory_path, replica.path, replica.manifest, since[0], replica.checksums)
+        elif checkpointed:
+            self._catch_up_together(checkpointed, min(since))
+
+        for replica in checkpointed:
+            if replica.scrubber:
+                replica.scrubber.request_pass()
+
+        if remaining:
+            self.reconcile(remaining)
+
+
+    def _catch_up_together(self, replicas:List[Replica], since_ns:int) -> None:
+        """
+        Catches up several replicas that matched the source at since_ns, reading each changed file once.
+        """
+        writers:List[ReplicaWriter] = [
+            ReplicaWriter(self.source_directory_path, replica.path, replica.manifest, replica.checksums, RunSummary(f'Catch-up {replica.path}'))
+            for replica in replicas
+        ]
+
+        with metrics.walk_seconds.time(kind='checkpoint'), throttle.using('seed'):
+            compare_content:bool = any(replica.checksums for replica in replicas)
+            listers:list = [replica.manifest.children for replica in replicas]
+            finders:list = [replica.manifest.with_source_inode for replica in replicas]
+            failed:List[List[str]] = apply_fanout(writers, plan_replicas(self.source_directory_path, listers, compare_content, finders, since_ns))
+
+        for replica, writer, failed_paths in zip(replicas, writers, failed):
+            for rel_path in failed_paths:
+                replica.repairs.add(os.path.join(self.source_directory_path, rel_path))
+            writer.summary.log()
+
+
+    def save_checkpoint(self, synced_ns:int) -> None:
+        """
+        Records that every replica matched the source at synced_ns, for the catch-up of the next start.
+        Replicas with pending repairs are skipped, they are reconciled in full. The checkpoint is moved CHECKPOINT_MARGIN seconds back, for the events dropped when the monitor stopped and
+        for filesystems with coarse modification times.
+        """
+        fingerprint:str = filters.path_filter.fingerprint() if filters.path_filter else ''
+        for replica in self.replicas:
+            if not len(replica.repairs):
+                replica.manifest.save_checkpoint(synced_ns - int(CHECKPOINT_MARGIN * 1e9), fingerprint)
+
+
+    def reconcile(self, replicas:Optional[List[Replica]] = None) -> None:
+        """
+        Makes every replica, or the given ones, match the source, copying the whole source to empty replicas.
+        """
+        replicas = self.replicas if replicas is None else replicas
+
+        if len(replicas) == 1:
+            replica:Replica = replicas[0]
+            if replica_directory_is_empty(replica.path):
+                duplicate_source(self.source_directory_path, replica.path, replica.manifest)
+            else:
+                update_replica_directory(self.source_directory_path, replica.path, replica.manifest, replica.checksums)
+            return
+
+        populated:List[bool] = [not replica.manifest.is_empty() for replica in replicas]
+        listers:list = [replica.manifest.children if manifest_populated else replica_lister(replica.path)
+                        for replica, manifest_populated in zip(replicas, populated)]
+        writers:List[ReplicaWriter] = [
+            ReplicaWriter(self.source_directory_path, replica.path, replica.manifest, replica.checksums, RunSummary(f'Update {replica.path}'))
+            for replica in replicas
+        ]
+
+        with metrics.walk_seconds.time(kind='fanout'), throttle.using('seed'):
+            compare_content:bool = any(replica.checksums for replica in replicas)
+            finders:list = [replica.manifest.with_source_inode if manifest_populated else None for replica, manifest_populated in zip(replicas, populated)]
+            failed:List[List[str]] = apply_fanout(writers, plan_replicas(self.source_directory_path, listers, compare_content, finders))
+
+        for replica, writer, manifest_populated, failed_paths in zip(replicas, writers, populated, failed):
+            if not manifest_populated:
+                replica.manifest.rebuild(self.source_directory_path)
+            for rel_path in failed_paths:
+                replica.repairs.add(os.path.join(self.source_directory_path, rel_path))
+            writer.summary.log()
+
+
+    def synchronize(self, changes:list) -> None:
+        """
+        Applies a batch of detected changes to every replica.
+
+        Created and modified files unrelated to the other changes of the batch are read once and copied to all
+        the replicas together. The other changes are applied to each replica in parallel, in their own order.
+        Failures are queued in the repair queue of the replica they happened in.
+        """
+        if len(self.replicas) == 1:
+            replica:Replica = self.replicas[0]
+            synchronize(self.source_directory_path, replica.path, changes, replica.manifest, repairs=replica.repairs)
+            return
+
+        content_changes:List[bool] = [self._is_content_change(change) for change in changes]
+        structural_paths:List[str] = [path for change, is_content in zip(changes, content_changes) if not is_content for path in touched_paths(change)]
+        structural:list = []
+        content:list = []
+
+        for change, is_content in zip(changes, content_changes):
+            path:str = os.path.normpath(change['path'])
+            if is_content and not any(is_within(path, other) or is_within(other, path) for other in structural_paths):
+                content.append(change)
+            else:
+                structural.append(change)
+
+        summaries:List[RunSummary] = [RunSummary(f'Sync {replica.path}') for replica in self.replicas]
+
+        if structural:
+            with concurrent.futures.ThreadPoolExecutor(len(self.replicas)) as executor:
+                futures:dict = {
+                    executor.submit(contextvars.copy_context().run, synchronize, self.source_directory_path, replica.path, structural, replica.manifest,
+                                    repairs=replica.repairs, summary=summary): replica
+                    for replica, summary in zip(self.replicas, summaries)
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    if future.exception():
+                        replica = futures[future]
+                        logging.error(f"[ERROR] Replica {replica.path}: {future.exception()}")
+                        replica.repairs.add(self.source_directory_path)
+
+        if content:
+            with throttle.using('live'):
+                self._copy_content(content, summaries)
+
+        for summary in summaries:
+            summary.log()
+
+
+    def _is_content_change(self, change:dict) -> bool:
+        return change['type'] in ('created', 'modified') and change['is_file'] and os.path.isfile(change['path'])
+
+
+    def _copy_content(self, changes:list, summaries:List[RunSummary]) -> None:
+        """
+        Copies created and modified files to every replica, reading each file once.
+        """
+        writers:List[ReplicaWriter] = [
+            ReplicaWriter(self.source_directory_path, replica.path, replica.manifest, summary=summary)
+            for replica, summary in zip(self.replicas, summaries)
+        ]
+        actions:list = [
+            (index, PlannedAction('update' if change['type'] == 'modified' else 'create', relative_path(change['path'], self.source_directory_path)))
+            for change in changes for index in range(len(self.replicas))
+        ]
+
+        failed:List[List[str]] = apply_fanout(writers, actions)
+
+        for replica, failed_paths in zip(self.replicas, failed):
+            failed_set:set = set(failed_paths)
+
+            for change in changes:
+                if relative_path(change['path'], self.source_directory_path) in failed_set:
+                    metrics.changes_failed.inc()
+                    replica.repairs.add_change(change)
+                else:
+                    metrics.changes_applied.inc(type=change['type'])
+
+
+    def requeue(self, changes:Optional[list] = None) -> None:
+        """
+        Queues the changes of a cancelled batch for repair in every replica, or the whole source without changes.
+        """
+        for replica in self.replicas:
+            if changes is None:
+                replica.repairs.add(self.source_directory_path)
+            for change in changes or ():
+                replica.repairs.add_change(change)
+
+
+    def run_repairs(self) -> None:
+        for replica in self.replicas:
+            replica.repairs.run()
+
+
+    def scrubbing(self) -> bool:
+        """
+        Returns True if a background verification pass is due for any replica.
+        """
+        return any(replica.scrubber and replica.scrubber.due() for replica in self.replicas)
+
+
+    def scrub(self) -> None:
+        """
+        Verifies the next slice of every replica with a pass due, the drifted paths are repaired by run_repairs.
+        """
+        for replica in self.replicas:
+            if replica.scrubber:
+                replica.scrubber.step()
+
+
+    def log_repairs(self) -> None:
+        for replica in self.replicas:
+            repairs:RepairQueue = replica.repairs
+            label:str = f" ({replica.path})" if len(self.replicas) > 1 else ''
+            logging.log(SUMMARY, f"[REPAIRS]{label} Scoped: {repairs.scoped_repairs}, Full: {repairs.full_repairs}, Pending: {len(repairs)}")
+
+
+    def close(self) -> None:
+        for replica in self.replicas:
+            replica.close()
@@ -0,0 +1,57 @@
+import sys
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+# Level between INFO and WARNING used for aggregate lines, so per-file lines can be turned off
+SUMMARY = 25
+logging.addLevelName(SUMMARY, 'SUMMARY')
+
+try:
+    import resource
+except ImportError:     # Not available on Windows
+    resource = None
+
+
+def peak_memory_mb() -> Optional[float]:
+    """
+    Returns the peak resident memory of the process in MB, or None when the platform does not report it.
+    """
+    if resource is None:
+        return None
+
+    peak:int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class RunSummary:
+    def __init__(self, label:str):
+        """
+        Counts the actions applied during a synchronization run and logs them once it is done.
+
+        Args:
+        - label: Name of the run in the summary line.
+        """
+        self.label = label
+        self.started:float = time.monotonic()
+        self.counts:Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+
+    def count(self, action:str, amount:int = 1) -> None:
+        with self.lock:
+            self.counts[action] = self.counts.get(action, 0) + amount
+
+
+    def log(self) -> None:
+        """
+        Logs the counted actions, the elapsed time and the peak memory of the process.
+        """
+        elapsed:float = time.monotonic() - self.started
+        counts:str = ', '.join(f"{amount} {action}" for action, amount in sorted(self.counts.items())) or 'no changes'
+        peak = peak_memory_mb()
+        memory:str = f", peak memory {peak:.1f} MB" if peak is not None else ''
+
+        logging.log(SUMMARY, f"[SUMMARY] {self.label}: {counts} in {elapsed:.2f}s{memory}")
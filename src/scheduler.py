@@ -0,0 +1,73 @@
+import time
+import asyncio
+from typing import Optional
+
+
+class SyncScheduler:
+    def __init__(self, min_latency:float = 0.2, max_latency:float = 5.0, busy_rate:float = 500.0, smoothing:float = 0.3):
+        """
+        Decides when the next synchronization runs, waking up as soon as the monitor has pending events.
+
+        Args:
+        - min_latency: Seconds events are collected after the first one arrives when the source is quiet.
+        - max_latency: Upper bound of the collection window, and the longest sleep while nothing happens.
+        - busy_rate: Event rate (events/second) at which the collection window reaches half of its range.
+        - smoothing: Weight of the latest cycle in the moving average of the event rate.
+
+        Under light load changes are synchronized after min_latency. As the event rate grows the window
+        grows towards max_latency, so bursts are synchronized in fewer, larger batches.
+        """
+        self.min_latency = min_latency
+        self.max_latency = max(max_latency, min_latency)
+        self.busy_rate = busy_rate
+        self.smoothing = smoothing
+
+        self.event_rate:float = 0.0
+        self.last_record:float = time.monotonic()
+
+
+    def window(self) -> float:
+        """
+        Current collection window in seconds, growing with the event rate.
+        """
+        load:float = self.event_rate / (self.event_rate + self.busy_rate)
+        return self.min_latency + (self.max_latency - self.min_latency) * load
+
+
+    def wait(self, monitor, timeout:Optional[float] = None) -> None:
+        """
+        Blocks until the next synchronization should run.
+
+        Args:
+        - monitor: FolderMonitor providing wait_for_changes.
+        - timeout: Optional deadline (seconds) for the wait, e.g. the next release of held changes.
+        """
+        idle_timeout:float = self.max_latency if timeout is None else min(timeout, self.max_latency)
+
+        if monitor.wait_for_changes(idle_timeout):
+            time.sleep(self.window())
+
+
+    async def wait_async(self, available:asyncio.Event, timeout:Optional[float] = None) -> None:
+        """
+        Same as wait, for an event loop that sets available when the monitor has pending events.
+        """
+        idle_timeout:float = self.max_latency if timeout is None else min(timeout, self.max_latency)
+
+        try:
+            await asyncio.wait_for(available.wait(), idle_timeout)
+        except asyncio.TimeoutError:
+            return
+
+        await asyncio.sleep(self.window())
+
+
+    def record(self, event_count:int) -> None:
+        """
+        Updates the event rate with the number of events received since the previous call.
+        """
+        now:float = time.monotonic()
+        elapsed:float = max(now - self.last_record, 1e-3)
+        self.last_record = now
+
+        self.event_rate = (1 - self.smoothing) * self.event_rate + self.smoothing * (event_count / elapsed)
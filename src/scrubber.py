@@ -0,0 +1,210 @@
+import os
+import stat
+import time
+import logging
+from typing import List, Optional, Tuple
+from src.manifest import ReplicaManifest, ManifestEntry, MANIFEST_FILENAME
+from src.checksum import ChecksumCache, hash_file
+from src.tree_diff import is_directory, needs_update
+from src.copy_backend import TEMPORARY_PREFIX
+from src.run_summary import SUMMARY
+from src import filters
+from src import metrics
+from src import throttle
+
+
+# Manifest entries verified by a single step
+SCRUB_SLICE = 64
+
+# Seconds between the end of a pass and the start of the next one
+SCRUB_INTERVAL = 3600.0
+
+# Source paths modified this recently are left to the folder monitor, their events may still be held
+SETTLE_SECONDS = 60.0
+
+# Names of the scrubber state kept in the manifest
+CURSOR_STATE = 'scrub_cursor'
+FINISHED_STATE = 'scrub_finished'
+COUNTS_STATE = 'scrub_counts'
+
+
+class Scrubber:
+    def __init__(self, source_directory_path:str, replica_directory_path:str, manifest:ReplicaManifest, repairs,
+                 checksums:Optional[ChecksumCache] = None, interval:float = SCRUB_INTERVAL, slice_size:int = SCRUB_SLICE):
+        """
+        Verifies a replica in the background, a few manifest entries at a time, to catch the drift left by missed events.
+
+        Args:
+        - source_directory_path: Path to the source directory.
+        - replica_directory_path: Path to the replica directory.
+        - manifest: Replica manifest, walked in path order. It also keeps the position of the scrubber across restarts.
+        - repairs: RepairQueue of the replica, receiving the paths that drifted.
+        - checksums: Optional checksum cache. When given, replica files are read and compared with their recorded hash.
+        - interval: Seconds between the end of a pass and the start of the next one.
+        - slice_size: Number of manifest entries verified by each step.
+
+        Each entry is compared with the source (existence, type, size and mtime) and with the replica itself, and the
+        source folders are listed to find the paths missing from the manifest. Operations and bytes read are charged
+        to the 'scrub' throttle budget.
+        """
+        self.source_directory_path = source_directory_path
+        self.replica_directory_path = replica_directory_path
+        self.manifest = manifest
+        self.repairs = repairs
+        self.checksums = checksums
+        self.interval = interval
+        self.slice_size = slice_size
+
+        # None between passes, '' at the start of a pass, then the last verified path
+        self.cursor:Optional[str] = manifest.read_state(CURSOR_STATE)
+        finished:Optional[str] = manifest.read_state(FINISHED_STATE)
+
+        # A replica never scrubbed was just reconciled, its first pass waits for a whole interval
+        self.finished:float = float(finished) if finished else time.time()
+        if finished is None:
+            manifest.write_state(FINISHED_STATE, str(self.finished))
+
+        # Entries checked and drifted in the current pass, 'checked,drifted' in the manifest
+        counts:List[str] = (manifest.read_state(COUNTS_STATE) or '0,0').split(',')
+        self.checked:int = int(counts[0])
+        self.drifted:int = int(counts[1])
+
+
+    def request_pass(self) -> None:
+        """
+        Makes the next pass start right away instead of waiting for the interval.
+        """
+        if self.cursor is None:
+            self.finished = float('-inf')
+
+
+    def due(self, now:Optional[float] = None) -> bool:
+        """
+        Returns True if a pass is running or the next one should start.
+        """
+        now = time.time() if now is None else now
+        return self.cursor is not None or now >= self.finished + self.interval
+
+
+    def step(self, now:Optional[float] = None) -> int:
+        """
+        Verifies the next slice of the replica if a pass is due, queuing the drifted paths for repair.
+        Returns the number of entries verified.
+        """
+        now = time.time() if now is None else now
+        if not self.due(now):
+            return 0
+
+        if self.cursor is None:
+            self.cursor = ''
+            self.checked = self.drifted = 0
+            logging.info("[SCRUB] Pass started: %s", self.replica_directory_path)
+
+        with throttle.using('scrub'):
+            if self.cursor == '':
+                self._check_folder('', now)
+
+            entries:List[Tuple[str, ManifestEntry]] = self.manifest.entries_after(self.cursor, self.slice_size)
+            for rel_path, entry in entries:
+                throttle.consume_op()
+                self._check(rel_path, entry, now)
+
+        self.checked += len(entries)
+
+        if len(entries) < self.slice_size:
+            self.cursor = None
+            self.finished = now
+            logging.log(SUMMARY, "[SCRUB] Pass completed: %s, %d checked, %d drifted", self.replica_directory_path, self.checked, self.drifted)
+        else:
+            self.cursor = entries[-1][0]
+
+        self.manifest.write_state(CURSOR_STATE, self.cursor)
+        self.manifest.write_state(FINISHED_STATE, str(self.finished))
+        self.manifest.write_state(COUNTS_STATE, f'{self.checked},{self.drifted}')
+        self.manifest.commit()
+
+        return len(entries)
+
+
+    def _drifted(self, rel_path:str, reason:str) -> None:
+        logging.info("[SCRUB] Drift: %s (%s)", os.path.join(self.replica_directory_path, rel_path), reason)
+        metrics.scrub_entries.inc(result='drifted')
+        self.drifted += 1
+        self.repairs.add(os.path.join(self.source_directory_path, rel_path))
+
+
+    def _check(self, rel_path:str, entry:ManifestEntry, now:float) -> None:
+        """
+        Compares one manifest entry with the source and the replica.
+        """
+        is_dir:bool = stat.S_ISDIR(entry.mode)
+        if filters.path_filter and filters.path_filter.excludes(rel_path, is_dir):
+            return
+
+        try:
+            source_stat = os.lstat(os.path.join(self.source_directory_path, rel_path))
+        except FileNotFoundError:
+            return self._drifted(rel_path, 'missing from the source')
+        except OSError:
+            return
+
+        # Changed moments ago, the monitor is probably about to synchronize it
+        if now - source_stat.st_mtime < SETTLE_SECONDS:
+            return
+
+        if is_directory(source_stat) != is_dir:
+            return self._drifted(rel_path, 'type changed')
+
+        if not is_dir and needs_update(source_stat, entry.size, entry.mtime_ns):
+            return self._drifted(rel_path, 'outdated')
+
+        replica_path:str = os.path.join(self.replica_directory_path, rel_path)
+        try:
+            replica_stat = os.lstat(replica_path)
+        except FileNotFoundError:
+            return self._drifted(rel_path, 'missing from the replica')
+        except OSError:
+            return
+
+        if is_dir:
+            if not stat.S_ISDIR(replica_stat.st_mode):
+                return self._drifted(rel_path, 'type changed in the replica')
+            self._check_folder(rel_path, now)
+
+        elif replica_stat.st_size != entry.size or replica_stat.st_mtime_ns != entry.mtime_ns:
+            return self._drifted(rel_path, 'modified in the replica')
+
+        elif self.checksums and entry.hash:
+            throttle.consume_bytes(replica_stat.st_size)
+            try:
+                if hash_file(replica_path) != entry.hash:
+                    return self._drifted(rel_path, 'content differs')
+            except OSError:
+                return self._drifted(rel_path, 'unreadable in the replica')
+
+        metrics.scrub_entries.inc(result='ok')
+
+
+    def _check_folder(self, rel_directory:str, now:float) -> None:
+        """
+        Looks for source paths of a folder that have no manifest entry.
+        """
+        recorded:set = set(self.manifest.children(rel_directory))
+
+        try:
+            with os.scandir(os.path.join(self.source_directory_path, rel_directory)) as entries:
+                for entry in entries:
+                    if entry.name in recorded or entry.name.startswith((MANIFEST_FILENAME, TEMPORARY_PREFIX)):
+                        continue
+
+                    rel_path:str = os.path.join(rel_directory, entry.name)
+                    source_stat = entry.stat(follow_symlinks=False)
+                    if now - source_stat.st_mtime < SETTLE_SECONDS:
+                        continue
+                    if filters.path_filter and filters.path_filter.excludes(rel_path, is_directory(source_stat), source_stat):
+                        continue
+
+                    self._drifted(rel_path, 'missing from the replica')
+
+        except OSError:
+            pass
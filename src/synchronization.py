@@ -1,15 +1,39 @@
 import os
 import sys
 import shutil
+import sqlite3
 import logging
-from typing import List
-import concurrent.futures
+import functools
+import itertools
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from src.manifest import ReplicaManifest, MANIFEST_FILENAME
+from src.tree_diff import TreeDiff, PlannedAction, plan_trees, plan_subtree, plan_against_manifest, outermost_paths
+from src.bounded_executor import BoundedExecutor
+from src.run_summary import RunSummary, SUMMARY
+from src.checksum import ChecksumCache
+from src.delta_copy import delta_copy
+from src import copy_backend
+from src.copy_backend import copy_with_metadata, copy_small_file, copy_to_many, remove_temporary_files
+from src import metrics
+from src import filters
+from src import throttle
+from src import io_pool
+from src.parallel_apply import build_dependencies, run_with_dependencies, touched_paths
 
 logger = logging.getLogger(__name__)
 
+# Number of planned actions journaled at once, the manifest is committed after each group
+JOURNAL_CHUNK = 256
+
+# Number of small files copied by a single task
+SMALL_FILE_BATCH = 128
+
+# Minimum size (bytes) of a modified file for it to be updated block by block, None disables delta copies
+delta_threshold:Optional[int] = None
+
 
 def replica_directory_is_empty(replica_path:str) -> bool:
-    return len(os.listdir(replica_path)) == 0
+    return len([name for name in os.listdir(replica_path) if not name.startswith(MANIFEST_FILENAME)]) == 0
 
 
 def source_directory_not_empty(source_path:str) -> bool:
@@ -27,12 +51,41 @@ def copy_file(source_path: str, replica_path: str) -> None:
     Logs the copy action.
     """
     if os.path.isfile(source_path):
-        shutil.copy2(src=source_path, dst=replica_path) 
-        logging.info(f"[COPIED] File: {source_path} -> {replica_path}")
+        copy_with_metadata(source_path, replica_path) 
+        logging.info("[COPIED] File: %s -> %s", source_path, replica_path)
 
     else:
-        shutil.copy2(src=source_path, dst=replica_path) 
-        logging.info(f"[COPIED] Folder: {source_path} -> {replica_path}")
+        copy_with_metadata(source_path, replica_path) 
+        logging.info("[COPIED] Folder: %s -> %s", source_path, replica_path)
+
+
+def configure_delta_copy(threshold:Optional[int]) -> None:
+    """
+    Sets the minimum file size (in bytes) from which modified files are updated with delta copies.
+    None disables delta copies.
+    """
+    global delta_threshold
+    delta_threshold = threshold
+
+
+def delta_update(source_path:str, replica_path:str) -> bool:
+    """
+    Updates an existing replica file with a block delta copy when it is large enough.
+    
+    Args:
+    - source_path: Path to the modified source file.
+    - replica_path: Path to the outdated replica file.
+    
+    Returns True if the delta copy was applied, False if the file should be copied in full.
+    """
+    if delta_threshold is None or not os.path.isfile(replica_path) or os.path.getsize(source_path) < delta_threshold:
+        return False
+
+    stats = delta_copy(source_path, replica_path)
+    metrics.bytes_copied.inc(stats.bytes_written, backend='delta')
+    throttle.consume_bytes(stats.bytes_written)
+    logging.info("[DELTA] File: %s -> %s (read %d bytes, wrote %d bytes)", source_path, replica_path, stats.bytes_read, stats.bytes_written)
+    return True
 
 
 def delete_extra_files(replica_path: str) -> None:
@@ -46,221 +99,781 @@ def delete_extra_files(replica_path: str) -> None:
     """
     if os.path.isfile(replica_path):
         os.remove(path=replica_path)
-        logging.info(f"[DELETED] File: {replica_path}")
+        logging.info("[DELETED] File: %s", replica_path)
 
     elif os.path.isdir(replica_path):
         shutil.rmtree(path=replica_path)
-        logging.info(f"[DELETED] Folder: {replica_path}")
+        logging.info("[DELETED] Folder: %s", replica_path)
+
+
+class ReplicaWriter:
+    def __init__(self, source_directory_path:str, replica_directory_path:str, manifest:Optional[ReplicaManifest] = None,
+                 checksums:Optional[ChecksumCache] = None, summary:Optional[RunSummary] = None):
+        """
+        Applies planned actions to one replica directory, keeping its manifest and run summary up to date.
+
+        Args:
+        - source_directory_path: Path to the source directory.
+        - replica_directory_path: Path to the replica directory.
+        - manifest: Optional replica manifest, updated as each change is applied.
+        - checksums: Optional checksum cache, used for 'verify' actions and recorded in the manifest.
+        - summary: Optional RunSummary counting the applied changes.
+        """
+        self.source_directory_path = source_directory_path
+        self.replica_directory_path = replica_directory_path
+        self.manifest = manifest
+        self.checksums = checksums
+        self.summary = summary
+        self.journal = manifest.journal if manifest else None
+
+
+    def count(self, action:str) -> None:
+        if self.summary:
+            self.summary.count(action)
+
+
+    def run(self, operation_id:Optional[int], function, *args) -> None:
+        """
+        Calls function(*args) once the operation rate allows it and marks its journaled operation as finished.
+        """
+        throttle.consume_op()
+        function(*args)
+        if self.journal:
+            self.journal.finish(operation_id)
+
+
+    def delete(self, rel_path:str) -> None:
+        delete_extra_files(os.path.join(self.replica_directory_path, rel_path))
+        if self.manifest:
+            self.manifest.remove(rel_path)
+        self.count('deleted')
+
+
+    def copy(self, rel_path:str, update:bool) -> None:
+        source_path:str = os.path.join(self.source_directory_path, rel_path)
+        replica_path:str = os.path.join(self.replica_directory_path, rel_path)
+        if not (update and delta_update(source_path, replica_path)):
+            copy_file(source_path, replica_path)
+        self.record_copy(rel_path, update)
+
+
+    def record_copy(self, rel_path:str, update:bool) -> None:
+        """
+        Records a file copied to the replica in the manifest and the summary.
+        """
+        if self.manifest:
+            source_path:str = os.path.join(self.source_directory_path, rel_path)
+            source_stat = os.stat(source_path)
+            file_hash:Optional[str] = self.checksums.get(source_path, source_stat) if self.checksums else None
+            self.manifest.record(rel_path, os.stat(os.path.join(self.replica_directory_path, rel_path)), file_hash, source_stat.st_ino)
+        self.count('updated' if update else 'created')
+
+
+    def copy_small_files(self, batch:List[tuple], failed:List[str]) -> None:
+        """
+        Copies a batch of small files in one task, each with copy_small_file.
+
+        Args:
+        - batch: (operation id, relative path, update) of every file.
+        - failed: List the relative paths of the files that could not be copied are appended to.
+
+        The stats returned by the copies are recorded in the manifest as they are, and a single log line is
+        written for the whole batch, the files being logged at debug level.
+        """
+        copied:int = 0
+        copied_bytes:int = 0
+
+        for operation_id, rel_path, update in batch:
+            source_path:str = os.path.join(self.source_directory_path, rel_path)
+            replica_path:str = os.path.join(self.replica_directory_path, rel_path)
+
+            try:
+                throttle.consume_op()
+                source_stat, replica_stat = copy_small_file(source_path, replica_path)
+                logging.debug("[COPIED] File: %s -> %s", source_path, replica_path)
+
+                if self.manifest:
+                    file_hash:Optional[str] = self.checksums.get(source_path, source_stat) if self.checksums else None
+                    self.manifest.record(rel_path, replica_stat, file_hash, source_stat.st_ino)
+
+            except OSError as e:
+                logging.error(f"[ERROR] Updating: {rel_path}. Error: {e}")
+                failed.append(rel_path)
+                continue
+
+            self.count('updated' if update else 'created')
+            copied += 1
+            copied_bytes += replica_stat.st_size
+            if self.journal:
+                self.journal.finish(operation_id)
+
+        if copied:
+            metrics.bytes_copied.inc(copied_bytes, backend='small')
+            logging.info("[COPIED] %d small files -> %s", copied, self.replica_directory_path)
+
+
+    def make_folder(self, rel_path:str) -> None:
+        replica_path:str = os.path.join(self.replica_directory_path, rel_path)
+        os.makedirs(replica_path, exist_ok=True)
+        logging.info("[CREATED] Folder: %s", replica_path)
+        if self.manifest:
+            self.manifest.record(rel_path, os.stat(replica_path), source_inode=os.lstat(os.path.join(self.source_directory_path, rel_path)).st_ino)
+        self.count('folders created')
+
+
+    def move(self, rel_path:str, origin:str) -> None:
+        """
+        Renames a replica path to follow a move in the source. When the origin is missing from the replica,
+        the source path is copied instead.
+        """
+        origin_path:str = os.path.join(self.replica_directory_path, origin)
+        replica_path:str = os.path.join(self.replica_directory_path, rel_path)
+
+        try:
+            os.rename(origin_path, replica_path)
+
+        except FileNotFoundError:
+            source_path:str = os.path.join(self.source_directory_path, rel_path)
+            if not os.path.isdir(source_path):
+                self.copy(rel_path, False)
+                return
 
+            ignore = filters.path_filter.copytree_ignore(self.source_directory_path) if filters.path_filter else None
+            shutil.copytree(source_path, replica_path, copy_function=copy_with_metadata, ignore=ignore, dirs_exist_ok=True)
+            logging.info("[CREATED] Folder: %s", replica_path)
+            if self.manifest:
+                self.manifest.record_path(rel_path, self.source_directory_path)
+            self.count('folders created')
+            return
 
-def duplicate_source(source_directory_path:str, replica_directory_path:str) -> None:
+        logging.info("[MOVED] %s -> %s", origin_path, replica_path)
+        if self.manifest:
+            self.manifest.rename(origin, rel_path)
+        self.count('moved')
+
+
+    def verify(self, rel_path:str, replica_hash:Optional[str]) -> None:
+        source_hash:str = self.checksums.checksum(os.path.join(self.source_directory_path, rel_path))
+        self.count('verified')
+        if source_hash != (replica_hash or self.checksums.checksum(os.path.join(self.replica_directory_path, rel_path))):
+            self.copy(rel_path, True)
+
+
+    def run_in_order(self, operation_id:Optional[int], planned:PlannedAction) -> bool:
+        """
+        Runs a 'replace', 'make_dir' or 'move' action right away, as the actions after it depend on it.
+        Returns False if it failed, the error is logged.
+        """
+        try:
+            if planned.action == 'move':
+                self.run(operation_id, self.move, planned.rel_path, planned.origin)
+            else:
+                self.run(operation_id, self.delete if planned.action == 'replace' else self.make_folder, planned.rel_path)
+            return True
+
+        except (OSError, sqlite3.Error) as e:
+            description:str = {'replace': 'Replacing', 'make_dir': 'Creating folder', 'move': 'Moving'}[planned.action]
+            logging.error(f"[ERROR] {description}: {os.path.join(self.replica_directory_path, planned.rel_path)}. Error: {e}")
+            return False
+
+
+    def commit(self) -> None:
+        if self.manifest:
+            self.manifest.commit()
+
+
+def is_small_file(size:Optional[int]) -> bool:
+    """
+    Returns True if a file of this planned size is copied in a batch. Updates large enough for a delta copy never are.
+    """
+    return (size is not None and copy_backend.small_file_size is not None and size <= copy_backend.small_file_size
+            and (delta_threshold is None or size < delta_threshold))
+
+
+def journal_entry(planned:PlannedAction) -> tuple:
+    """
+    Returns the (action, paths) journaled for a planned action, moves touching their origin too.
+    """
+    return planned.action, [planned.rel_path, planned.origin] if planned.origin else [planned.rel_path]
+
+
+def apply_plan(source_directory_path:str, replica_directory_path:str, actions:Iterable[PlannedAction], manifest:Optional[ReplicaManifest] = None,
+               checksums:Optional[ChecksumCache] = None, summary:Optional[RunSummary] = None, max_workers:Optional[int] = None) -> List[str]:
+    """
+    Executes a streamed synchronization plan against the replica directory.
+    
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - actions: Planned actions, consumed as they are produced by the tree diff engine.
+    - manifest: Optional replica manifest, updated as each change is applied.
+    - checksums: Optional checksum cache, used for 'verify' actions and recorded in the manifest.
+    - summary: Optional RunSummary counting the applied changes.
+    - max_workers: Number of threads copying, deleting and verifying files, by default those of the current throttle budget.
+    
+    Folders are created and replaced paths deleted in order, everything else runs on a bounded thread pool,
+    so the planner never gets more than a few tasks per thread ahead of the copies. Files planned with a size up to
+    copy_backend.small_file_size are grouped into tasks of SMALL_FILE_BATCH files. With a manifest, actions are
+    written to its journal in groups before they run and the manifest is committed after each group.
+    Returns the relative paths that could not be updated, each failure is logged.
+    """
+    writer = ReplicaWriter(source_directory_path, replica_directory_path, manifest, checksums, summary)
+    failed:List[str] = []
+    small_files:List[tuple] = []
+    actions = iter(actions)
+
+    def submit_small_files() -> None:
+        nonlocal small_files
+        if small_files:
+            executor.submit(small_files[0][1], writer.copy_small_files, small_files, failed)
+            small_files = []
+
+    with BoundedExecutor(max_workers or throttle.current_budget().max_workers) as executor:
+        while chunk := list(itertools.islice(actions, JOURNAL_CHUNK)):
+            operation_ids:list = writer.journal.begin([journal_entry(planned) for planned in chunk]) if writer.journal else [None] * len(chunk)
+
+            for operation_id, planned in zip(operation_ids, chunk):
+                action, rel_path, replica_hash, _, size = planned
+
+                if action in ('create', 'update') and is_small_file(size):
+                    small_files.append((operation_id, rel_path, action == 'update'))
+                    if len(small_files) >= SMALL_FILE_BATCH:
+                        submit_small_files()
+
+                elif action == 'delete':
+                    executor.submit(rel_path, writer.run, operation_id, writer.delete, rel_path)
+
+                elif action in ('replace', 'make_dir', 'move'):
+                    if not writer.run_in_order(operation_id, planned):
+                        failed.append(rel_path)
+
+                elif action == 'verify' and checksums:
+                    executor.submit(rel_path, writer.run, operation_id, writer.verify, rel_path, replica_hash)
+
+                else:
+                    executor.submit(rel_path, writer.run, operation_id, writer.copy, rel_path, action != 'create')
+
+            submit_small_files()
+            writer.commit()
+
+    failed.extend(executor.failed)
+
+    writer.commit()
+    if checksums:
+        checksums.commit()
+
+    return failed
+
+
+def copy_to_replicas(rel_path:str, targets:List[tuple]) -> List[tuple]:
+    """
+    Copies a source file to several replicas with a single read of the source.
+
+    Args:
+    - rel_path: Path of the file relative to the source/replica roots.
+    - targets: (ReplicaWriter, journal operation id, update) of every replica receiving the file.
+
+    Updates done with a delta copy are applied to each replica separately.
+    Returns the (ReplicaWriter, error) of the replicas the copy failed for, each failure is logged.
+    """
+    shared:dict = {}
+    failures:List[tuple] = []
+
+    for writer, operation_id, update in targets:
+        source_path:str = os.path.join(writer.source_directory_path, rel_path)
+        replica_path:str = os.path.join(writer.replica_directory_path, rel_path)
+
+        try:
+            if update and delta_update(source_path, replica_path):
+                writer.run(operation_id, writer.record_copy, rel_path, update)
+            else:
+                shared[replica_path] = (writer, operation_id, update)
+
+        except OSError as e:
+            failures.append((writer, e))
+
+    if shared:
+        try:
+            errors:dict = copy_to_many(os.path.join(targets[0][0].source_directory_path, rel_path), list(shared))
+        except OSError as e:
+            # The source could not be read, the copy failed for every replica
+            errors = {replica_path: e for replica_path in shared}
+
+        for replica_path, (writer, operation_id, update) in shared.items():
+            try:
+                if errors[replica_path]:
+                    raise errors[replica_path]
+
+                logging.info("[COPIED] File: %s -> %s", os.path.join(writer.source_directory_path, rel_path), replica_path)
+                writer.run(operation_id, writer.record_copy, rel_path, update)
+
+            except OSError as e:
+                failures.append((writer, e))
+
+    for writer, error in failures:
+        logging.error(f"[ERROR] Updating: {os.path.join(writer.replica_directory_path, rel_path)}. Error: {error}")
+
+    return failures
+
+
+def apply_fanout(writers:List[ReplicaWriter], actions:Iterable[Tuple[int, PlannedAction]], max_workers:Optional[int] = None) -> List[List[str]]:
+    """
+    Executes the streamed plans of several replicas of the same source, as produced by plan_replicas.
+
+    Args:
+    - writers: ReplicaWriter of each replica, in the order of the replica indexes of the actions.
+    - actions: (replica index, action) pairs, consumed as they are produced.
+    - max_workers: Number of threads copying, deleting and verifying files for all the replicas.
+
+    Like apply_plan, but a file created or updated in several replicas is read once and written to all of them.
+    A failing replica does not stop the others, its failed paths are returned separately.
+    Returns the relative paths that could not be updated, per replica.
+    """
+    failed:List[List[str]] = [[] for _ in writers]
+    actions = iter(actions)
+
+    def copy_task(rel_path:str, targets:List[tuple]) -> None:
+        for writer, _ in copy_to_replicas(rel_path, targets):
+            failed[writers.index(writer)].append(rel_path)
+
+    with BoundedExecutor(max_workers or throttle.current_budget().max_workers) as executor:
+        while chunk := list(itertools.islice(actions, JOURNAL_CHUNK * len(writers))):
+            operation_ids:list = [None] * len(chunk)
+
+            for index, writer in enumerate(writers):
+                if writer.journal:
+                    positions:List[int] = [position for position, (replica, _) in enumerate(chunk) if replica == index]
+                    ids:list = writer.journal.begin([journal_entry(chunk[position][1]) for position in positions])
+                    for position, operation_id in zip(positions, ids):
+                        operation_ids[position] = operation_id
+
+            # Copies of the same file to several replicas are grouped at the end of the chunk,
+            # after the folders they are written to were created
+            copies:Dict[str, list] = {}
+
+            for operation_id, (index, planned) in zip(operation_ids, chunk):
+                action, rel_path, replica_hash, _, _ = planned
+                writer:ReplicaWriter = writers[index]
+                label:str = os.path.join(writer.replica_directory_path, rel_path)
+
+                if action == 'delete':
+                    executor.submit(label, writer.run, operation_id, writer.delete, rel_path)
+
+                elif action in ('replace', 'make_dir', 'move'):
+                    if not writer.run_in_order(operation_id, planned):
+                        failed[index].append(rel_path)
+
+                elif action == 'verify' and writer.checksums:
+                    executor.submit(label, writer.run, operation_id, writer.verify, rel_path, replica_hash)
+
+                else:
+                    copies.setdefault(rel_path, []).append((writer, operation_id, action != 'create'))
+
+            for rel_path, targets in copies.items():
+                executor.submit(rel_path, copy_task, rel_path, targets)
+
+            for writer in writers:
+                writer.commit()
+
+    for label in executor.failed:
+        for index, writer in enumerate(writers):
+            if label.startswith(writer.replica_directory_path + os.sep):
+                failed[index].append(os.path.relpath(label, writer.replica_directory_path))
+
+    for writer in writers:
+        writer.commit()
+        if writer.checksums:
+            writer.checksums.commit()
+
+    return failed
+
+
+def diff_actions(diff:TreeDiff) -> Iterator[PlannedAction]:
+    """
+    Converts a TreeDiff into planned actions. Deleted paths that are created again are replaced in order.
+    """
+    recreated:set = set(diff.dirs_to_make) | set(diff.to_create) | set(diff.to_update)
+
+    for rel_path in diff.to_delete:
+        yield PlannedAction('replace' if rel_path in recreated else 'delete', rel_path)
+
+    # Folders and moves ordered by depth, so the parents of a destination always exist
+    folders:list = [PlannedAction('make_dir', rel_path) for rel_path in diff.dirs_to_make]
+    folders += [PlannedAction('move', rel_path, origin=origin) for origin, rel_path in diff.to_move]
+    yield from sorted(folders, key=lambda planned: planned.rel_path.count(os.sep))
+
+    for rel_path in diff.to_create:
+        yield PlannedAction('create', rel_path)
+    for rel_path in diff.to_update:
+        yield PlannedAction('update', rel_path)
+
+
+def apply_diff(source_directory_path:str, replica_directory_path:str, diff:TreeDiff, manifest:Optional[ReplicaManifest] = None, checksums:Optional[ChecksumCache] = None) -> List[str]:
+    """
+    Executes a planned TreeDiff against the replica directory.
+    
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - diff: Changes planned by the tree diff engine.
+    - manifest: Optional replica manifest, updated as each change is applied.
+    - checksums: Optional checksum cache, known source checksums are recorded in the manifest.
+    
+    Returns the relative paths that could not be updated, each failure is logged.
+    """
+    return apply_plan(source_directory_path, replica_directory_path, diff_actions(diff), manifest, checksums)
+
+
+def duplicate_source(source_directory_path:str, replica_directory_path:str, manifest:Optional[ReplicaManifest] = None) -> None:
     """
     Creates an identical copy of the source directory in the replica location.
     
     Args:
     - source_directory_path: Path to the source directory.
     - replica_directory_path: Path to the replica directory to copy files and folders to.
+    - manifest: Optional replica manifest recording every created item.
     
-    Uses multithreading to speed up the copy process.
+    The source is walked and copied at the same time on a bounded thread pool.
     """
     if not os.path.exists(replica_directory_path):
         os.makedirs(replica_directory_path)
-        logging.info(f"[CREATED] Folder: {replica_directory_path}")
+        logging.info("[CREATED] Folder: %s", replica_directory_path)
 
+    summary = RunSummary('Initial copy')
+    with metrics.walk_seconds.time(kind='initial'), throttle.using('seed'):
+        apply_plan(source_directory_path, replica_directory_path, plan_trees(source_directory_path, replica_directory_path), manifest, summary=summary)
+    summary.log()
 
-    def copy_item(item_path: str, base_source: str, base_replica: str) -> None:
-        """
-        Helper function to copy individual items (files or directories) to the replica location.
-        
-        Args:
-        - item_path: Path to the item (file or folder) to copy.
-        - base_source: Base source directory for relative path calculation.
-        - base_replica: Base replica directory for destination.
-        """
-        relative_path:str = os.path.relpath(path=item_path, start=base_source)
-        target_path:str = os.path.join(base_replica, relative_path)
-
-        if os.path.isdir(item_path):
-            if not os.path.exists(target_path):
-                os.makedirs(target_path)
-                logging.info(f"[CREATED] Folder: {target_path}")
-
-        else:
-            shutil.copy2(item_path, target_path)
-            logging.info(f"[CREATED] File: {item_path} -> {target_path}")
 
+def plan_replica_update(source_directory_path:str, replica_directory_path:str, manifest:Optional[ReplicaManifest] = None, checksums:Optional[ChecksumCache] = None) -> Iterator[PlannedAction]:
+    """
+    Yields the changes needed to make the replica match the source, without modifying anything.
+    
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - manifest: Optional replica manifest. When it is populated only the source is walked.
+    - checksums: Optional checksum cache. When given, same-size files are compared by content.
+    """
+    if manifest and not manifest.is_empty():
+        return plan_against_manifest(source_directory_path, manifest, bool(checksums))
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures:List[concurrent.futures.Future] = []
-        for root, dirs, files in os.walk(source_directory_path):
-            for name in dirs + files:
-                item_path:str = os.path.join(root, name)
-                futures.append(executor.submit(copy_item, item_path, source_directory_path, replica_directory_path))
-        
-        concurrent.futures.wait(futures)        
+    return plan_trees(source_directory_path, replica_directory_path, bool(checksums))
 
 
-def update_replica_directory(source_directory_path: str, replica_directory_path: str) -> None:
+def update_replica_directory(source_directory_path: str, replica_directory_path: str, manifest:Optional[ReplicaManifest] = None, checksums:Optional[ChecksumCache] = None) -> None:
     """
     Updates the replica directory to match the source directory.
     
     Args:
     - source_directory_path: Path to the source directory.
     - replica_directory_path: Path to the replica directory.
+    - manifest: Optional replica manifest. When it is populated only the source is walked.
+    - checksums: Optional checksum cache. When given, files are compared by content.
     
-    Uses multithreading to process file/folder updates.
+    The plan is streamed into a bounded thread pool, so memory does not grow with the size of the tree.
     """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures:List[concurrent.futures.Future] = []
+    manifest_populated:bool = bool(manifest) and not manifest.is_empty()
+
+    summary = RunSummary('Update')
+    with metrics.walk_seconds.time(kind='manifest' if manifest_populated else 'full'), throttle.using('seed'):
+        actions = plan_replica_update(source_directory_path, replica_directory_path, manifest, checksums)
+        apply_plan(source_directory_path, replica_directory_path, actions, manifest, checksums, summary)
+
+    if manifest and not manifest_populated:
+        manifest.rebuild(source_directory_path)
+
+    summary.log()
 
-        # Loop through the source directory and update the replica
-        for root, dirs, files in os.walk(source_directory_path, topdown=True):
-            for file in files:
-                source_file:str = os.path.normpath(os.path.join(root, file))
-                relative_file_path:str = os.path.normpath(os.path.relpath(path=source_file, start=source_directory_path))
-                replica_file:str = os.path.normpath(os.path.join(replica_directory_path, relative_file_path))
 
-                if not os.path.exists(replica_file):
-                    futures.append(executor.submit(copy_file, source_file, os.path.join(replica_directory_path, relative_file_path)))
+def catch_up_replica_directory(source_directory_path:str, replica_directory_path:str, manifest:ReplicaManifest, since_ns:int,
+                               checksums:Optional[ChecksumCache] = None) -> None:
+    """
+    Updates a replica that matched the source at since_ns, comparing only the source folders modified since.
 
-                elif (os.stat(source_file).st_mtime) > (os.stat(os.path.join(replica_directory_path, relative_file_path)).st_mtime):
-                    futures.append(executor.submit(copy_file, source_file, replica_file))
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - manifest: Populated replica manifest, its recorded folders are visited without listing the unchanged source folders.
+    - since_ns: Time (time.time_ns()) of the checkpoint saved when the replica was last known to be in sync.
+    - checksums: Optional checksum cache. When given, files of the modified folders are compared by content.
+    """
+    summary = RunSummary('Catch-up')
+    with metrics.walk_seconds.time(kind='checkpoint'), throttle.using('seed'):
+        actions = plan_against_manifest(source_directory_path, manifest, bool(checksums), since_ns)
+        apply_plan(source_directory_path, replica_directory_path, actions, manifest, checksums, summary)
+    summary.log()
 
 
-            for dir in dirs:
-                source_dir:str = os.path.normpath(os.path.join(root, dir))
-                relative_path:str = os.path.normpath(os.path.relpath(path=source_dir, start=source_directory_path))
-                replica_dir:str = os.path.normpath(os.path.join(replica_directory_path, relative_path))
-                
-                if not os.path.exists(replica_dir):
-                    os.makedirs(replica_dir)
-                    logging.info(f"[CREATED] folder: {replica_dir}")
+def relative_path(path:str, root:str) -> str:
+    """
+    Returns path relative to root, the root itself being an empty string.
+    """
+    rel_path:str = os.path.relpath(path, root)
+    return '' if rel_path == '.' else rel_path
 
-                if os.stat(source_dir).st_mtime > os.stat(replica_dir).st_mtime:
-                    futures.append(executor.submit(copy_file, source_dir, replica_dir))
 
+def repair_path(source_directory_path:str, replica_directory_path:str, rel_path:str, manifest:Optional[ReplicaManifest] = None,
+                checksums:Optional[ChecksumCache] = None) -> str:
+    """
+    Reconciles a single path of the replica with the source instead of the whole tree.
+    
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - rel_path: Path to repair, relative to the source/replica roots.
+    - manifest: Optional replica manifest, updated with the repaired entries.
+    - checksums: Optional checksum cache, folders and full updates then compare files by content.
+    
+    Paths missing from the source are deleted from the replica, files are copied again and folders are
+    compared with their replica subtree. Only the root itself triggers a full update.
+    Returns 'scoped' or 'full' and raises OSError if the repair did not complete.
+    """
+    if not rel_path:
+        update_replica_directory(source_directory_path, replica_directory_path, manifest, checksums)
+        return 'full'
 
-                    
-        # Search for files that do not match the source
-        for root, dirs, files in os.walk(replica_directory_path, topdown=False):
-            for name in files:
-                replica_file:str = os.path.normpath(os.path.join(root, name))
-                source_file:str = os.path.normpath(os.path.join(source_directory_path, os.path.relpath(path=replica_file, start=replica_directory_path)))
+    source_path:str = os.path.join(source_directory_path, rel_path)
+    replica_path:str = os.path.join(replica_directory_path, rel_path)
 
-                if not os.path.exists(source_file):
-                    futures.append(executor.submit(delete_extra_files, replica_file))
+    if not os.path.lexists(source_path):
+        delete_extra_files(replica_path)
+        if manifest:
+            manifest.remove(rel_path)
+            manifest.commit()
+        return 'scoped'
 
-            for name in dirs:
-                replica_dir:str = os.path.normpath(os.path.join(root, name))
-                source_dir:str = os.path.normpath(os.path.join(source_directory_path, os.path.relpath(path=replica_dir, start=replica_directory_path)))
+    os.makedirs(os.path.dirname(replica_path), exist_ok=True)
 
-                if not os.path.exists(source_dir):
-                    futures.append(executor.submit(delete_extra_files, replica_dir))
+    if os.path.isdir(source_path):
+        failed:List[str] = apply_plan(source_directory_path, replica_directory_path, plan_subtree(source_directory_path, replica_directory_path, rel_path, bool(checksums)),
+                                      manifest, checksums)
+    else:
+        diff = TreeDiff(to_update=[rel_path], to_delete=[rel_path] if os.path.isdir(replica_path) else [])
+        failed = apply_diff(source_directory_path, replica_directory_path, diff, manifest)
+    if failed:
+        raise OSError(f"{len(failed)} item(s) could not be repaired")
 
-        concurrent.futures.wait(futures)
+    return 'scoped'
 
 
-def synchronize(source_directory_path:str, replica_directory_path:str, changes:list) -> None:
+def apply_change(source_directory_path:str, replica_directory_path:str, change:dict, manifest:Optional[ReplicaManifest] = None) -> bool:
     """
-    Synchronizes the replica directory based on the detected changes (created, deleted, renamed, moved, modified).
+    Applies a single detected change (created, deleted, renamed, moved, modified) to the replica directory.
     
     Args:
     - source_directory_path: Path to the source directory.
     - replica_directory_path: Path to the replica directory.
-    - changes: A list of dictionaries representing the changes in the source directory (created, deleted, renamed, moved, modified).
+    - change: Dictionary describing the change in the source directory.
+    - manifest: Optional replica manifest, updated in place when the change is applied.
     
-    For each change type, the appropriate action (copy, delete, rename, etc.) is performed.
+    Returns False if applying the change failed (the error is logged), otherwise True.
     """
-    for change in changes:
-        rel_path:str = os.path.relpath(change['path'], source_directory_path)
-        dst_path:str = os.path.join(replica_directory_path, rel_path)
+    rel_path:str = os.path.relpath(change['path'], source_directory_path)
+    dst_path:str = os.path.join(replica_directory_path, rel_path)
 
-        if change['type'] == 'created':
-            try:
-                if os.path.isfile(change['path']):
-                    shutil.copy2(src=change['path'], dst=dst_path) 
-                    logging.info(f"[CREATED] File: {dst_path}")
-                else:
-                    shutil.copytree(change['path'], dst_path)
-                    logging.info(f"[CREATED] Folder: {dst_path}")
+    if change['type'] == 'created':
+        try:
+            if os.path.isfile(change['path']):
+                copy_with_metadata(change['path'], dst_path) 
+                logging.info("[CREATED] File: %s", dst_path)
+            else:
+                ignore = filters.path_filter.copytree_ignore(source_directory_path) if filters.path_filter else None
+                shutil.copytree(change['path'], dst_path, copy_function=copy_with_metadata, ignore=ignore, dirs_exist_ok=True)
+                logging.info("[CREATED] Folder: %s", dst_path)
 
-            except Exception as e:
-                logging.error(f"[ERROR] Creating {'file' if os.path.isfile(change['path']) else 'folder'}. Error: {e}")
-                update_replica_directory(source_directory_path, replica_directory_path)
-                logging.info("[FIXED] Error fixed")
+            if manifest:
+                manifest.record_path(rel_path, source_directory_path)
 
+        except Exception as e:
+            logging.error(f"[ERROR] Creating {'file' if os.path.isfile(change['path']) else 'folder'}. Error: {e}")
+            return False
 
-        elif change['type'] == 'deleted':
-            try:
-                if change['is_file']:
-                    os.remove(dst_path)
-                    logging.info(f"[DELETED] File: {os.path.normpath(dst_path)}")
-                else:
-                    shutil.rmtree(dst_path)
-                    logging.info(f"[DELETED] Folder: {os.path.normpath(dst_path)}")
-            except Exception as e:
-                logging.error(f"[ERROR] Deleting {'file' if change['is_file'] else 'folder'}. Error: {e}")
-                update_replica_directory(source_directory_path, replica_directory_path)
-                logging.info("[FIXED] Error fixed")
 
+    elif change['type'] == 'deleted':
+        # Already deleted, e.g. by the catch-up running while the event was buffered
+        if not os.path.lexists(dst_path):
+            if manifest:
+                manifest.remove(rel_path)
+            return True
 
-        elif change['type'] == 'renamed':
-            try:
-                if change['is_file']:
-                    relative_src_path = os.path.relpath(change['path'], source_directory_path)
-                    relative_dest_path = os.path.relpath(change['new_path'], source_directory_path)
+        try:
+            if change['is_file']:
+                os.remove(dst_path)
+                logging.info("[DELETED] File: %s", os.path.normpath(dst_path))
+            else:
+                shutil.rmtree(dst_path)
+                logging.info("[DELETED] Folder: %s", os.path.normpath(dst_path))
 
-                    old_name_path = os.path.join(replica_directory_path, relative_src_path)
-                    new_name_path = os.path.join(replica_directory_path, relative_dest_path)
+            if manifest:
+                manifest.remove(rel_path)
+        except Exception as e:
+            logging.error(f"[ERROR] Deleting {'file' if change['is_file'] else 'folder'}. Error: {e}")
+            return False
 
-                    if os.path.exists(old_name_path):
-                        os.rename(old_name_path, new_name_path)
-                        logging.info(f"[RENAMED] File: {old_name_path} -> {new_name_path}")
 
-                    else:
-                        continue
+    elif change['type'] == 'renamed':
+        try:
+            relative_dest_path = os.path.relpath(change['new_path'], source_directory_path)
+            new_name_path = os.path.join(replica_directory_path, relative_dest_path)
 
-                else:
-                    os.rename(dst_path, change['path'])
-                    logging.info(f"[RENAMED] Folder: {os.path.normpath(dst_path)} -> {os.path.normpath(change['path'])}")
+            if os.path.exists(dst_path):
+                os.rename(dst_path, new_name_path)
+                logging.info("[RENAMED] %s: %s -> %s", 'File' if change['is_file'] else 'Folder', os.path.normpath(dst_path), os.path.normpath(new_name_path))
 
-            except Exception as e:
-                logging.error(f"[ERROR] Renaming {'file' if change['is_file'] else 'folder'}. Error: {e}")
-                update_replica_directory(source_directory_path, replica_directory_path)
-                logging.info("[FIXED] Error fixed")
+                if manifest:
+                    manifest.rename(rel_path, relative_dest_path)
+
+            else:
+                return True
 
+        except Exception as e:
+            logging.error(f"[ERROR] Renaming {'file' if change['is_file'] else 'folder'}. Error: {e}")
+            return False
 
 
-        elif change['type'] == 'moved':
-            source_path:str = os.path.join(replica_directory_path, os.path.relpath(change['path'], source_directory_path))
-            destination_path:str = os.path.join(replica_directory_path, os.path.join(os.path.relpath(change['new_path'], source_directory_path), os.path.basename(change['path'])))
 
+    elif change['type'] == 'moved':
+        source_path:str = os.path.join(replica_directory_path, os.path.relpath(change['path'], source_directory_path))
+        destination_path:str = os.path.join(replica_directory_path, os.path.join(os.path.relpath(change['new_path'], source_directory_path), os.path.basename(change['path'])))
+
+        try:
+            if change['is_file']:
+                shutil.move(source_path, destination_path)
+                logging.info("[MOVED] File: %s -> %s", source_path, destination_path)
+
+            else:
+                shutil.move(source_path, destination_path)
+                logging.info("[MOVED] Folder: %s -> %s", source_path, destination_path)
+
+            if manifest:
+                manifest.rename(rel_path, os.path.relpath(destination_path, replica_directory_path))
+
+        except Exception as e:
+            logging.error(f"[ERROR] Moving {'file' if change['is_file'] else 'folder'}. Error: {e}")
+            return False
+
+
+    elif change['type'] == 'modified':
+        if os.path.isfile(change['path']):
             try:
-                if change['is_file']:
-                    shutil.move(source_path, destination_path)
-                    logging.info(f"[MOVED] File: {source_path} -> {destination_path}")
+                if not delta_update(change['path'], dst_path):
+                    copy_with_metadata(change['path'], dst_path) 
+                logging.info("[MODIFIED] File: %s", dst_path)
 
-                else:
-                    shutil.move(source_path, destination_path)
-                    logging.info(f"[MOVED] Folder: {source_path} -> {destination_path}")
+                if manifest:
+                    manifest.record(rel_path, os.stat(dst_path), source_inode=os.stat(change['path']).st_ino)
 
             except Exception as e:
-                logging.error(f"[ERROR] Moving {'file' if change['is_file'] else 'folder'}. Error: {e}")
-                update_replica_directory(source_directory_path, replica_directory_path)
-                logging.info("[FIXED] Error fixed")
+                logging.error(f"[ERROR] Editing file: {dst_path}. Error: {e}")
+                return False
 
+    return True
 
-        elif change['type'] == 'modified':
-            if os.path.isfile(change['path']):
-                try:
-                    shutil.copy2(src=change['path'], dst=dst_path) 
-                    logging.info(f"[MODIFIED] File: {dst_path}")
+
+def synchronize(source_directory_path:str, replica_directory_path:str, changes:list, manifest:Optional[ReplicaManifest] = None, max_workers:Optional[int] = None, repairs = None,
+                summary:Optional[RunSummary] = None) -> None:
+    """
+    Synchronizes the replica directory based on the detected changes (created, deleted, renamed, moved, modified).
+    
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - changes: A list of dictionaries representing the changes in the source directory (created, deleted, renamed, moved, modified).
+    - manifest: Optional replica manifest, updated in place as each change is applied.
+    - max_workers: Maximum number of changes applied at the same time.
+    - repairs: Optional RepairQueue receiving the changes that failed, to be retried in the next cycles.
+    - summary: Optional RunSummary counting the applied changes, logged by the caller. By default the counts are logged here.
+    
+    Independent changes are applied in parallel, changes touching the same path (or a parent and its children)
+    keep their order. Without a repair queue, the paths of failed changes are repaired once the batch is done.
+    With a manifest, the batch is written to its journal before any change is applied.
+    The number of applied changes per type is logged at the end of the batch.
+    """
+    failed:List[dict] = []
+    journal = manifest.journal if manifest else None
+    log_summary:bool = summary is None
+    summary = summary or RunSummary('Sync')
+
+    def apply(change:dict, operation_id:Optional[int]) -> None:
+        throttle.consume_op()
+        # Changes not started when the batch is cancelled are handled as failures and repaired later
+        if io_pool.cancelled.is_set() or not apply_change(source_directory_path, replica_directory_path, change, manifest):
+            failed.append(change)
+            metrics.changes_failed.inc()
+            summary.count('failed')
+            return
+
+        metrics.changes_applied.inc(type=change['type'])
+        summary.count(change['type'])
+        if journal:
+            journal.finish(operation_id)
+
+    if journal:
+        operation_ids:list = journal.begin([
+            (change['type'], [relative_path(path, source_directory_path) for path in touched_paths(change)]) for change in changes
+        ])
+    else:
+        operation_ids = [None] * len(changes)
+
+    tasks:list = [functools.partial(apply, change, operation_id) for change, operation_id in zip(changes, operation_ids)]
+    with throttle.using('live'):
+        run_with_dependencies(tasks, build_dependencies(changes), max_workers or throttle.budgets['live'].max_workers)
+
+    for change in failed:
+        if repairs is not None:
+            repairs.add_change(change)
+            continue
+
+        for path in touched_paths(change):
+            try:
+                kind:str = repair_path(source_directory_path, replica_directory_path, relative_path(path, source_directory_path), manifest)
+            except OSError:
+                update_replica_directory(source_directory_path, replica_directory_path, manifest)
+                kind = 'full'
+            metrics.repairs.inc(kind=kind)
+            logging.info("[FIXED] Error fixed")
+
+    if manifest:
+        manifest.commit()
+
+    if log_summary:
+        summary.log()
+
+
+def replay_journal(source_directory_path:str, replica_directory_path:str, manifest:ReplicaManifest) -> int:
+    """
+    Repairs the paths of the operations a previous run started but never completed, e.g. after a crash.
     
-                except Exception as e:
-                    logging.error(f"[ERROR] Editing file: {dst_path}. Error: {e}")
-                    update_replica_directory(source_directory_path, replica_directory_path)
-                    logging.info("[FIXED] Error fixed")
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - manifest: Replica manifest holding the operation journal.
+    
+    Temporary copies left next to those paths are removed. Once every path is repaired the journal is cleared
+    and the manifest describes the replica again, so reconciliation can rely on it instead of walking the replica.
+    Returns the number of repaired paths.
+    """
+    rel_paths:List[str] = outermost_paths(manifest.journal.unfinished_paths())
+    if not rel_paths:
+        return 0
+
+    logging.log(SUMMARY, f"[JOURNAL] Replaying {len(rel_paths)} unfinished path(s)")
+    failures:int = 0
+
+    for rel_path in rel_paths:
+        parent:str = os.path.dirname(rel_path)
+        remove_temporary_files(os.path.join(replica_directory_path, parent), os.path.join(source_directory_path, parent))
 
+        try:
+            repair_path(source_directory_path, replica_directory_path, rel_path, manifest)
 
+        except OSError as e:
+            logging.error(f"[ERROR] Replaying: {rel_path}. Error: {e}")
+            failures += 1
 
+    manifest.commit()
+    if not failures:
+        manifest.journal.reset()
 
+    return len(rel_paths)
@@ -0,0 +1,200 @@
+import os
+import time
+import threading
+import contextlib
+import contextvars
+from typing import Dict, Iterator, Optional
+from src import metrics
+
+
+# Keys of a limits specification, e.g. 'mbps=50,iops=200,workers=4'
+LIMIT_KEYS = ('mbps', 'iops', 'workers')
+
+
+class TokenBucket:
+    def __init__(self, rate:Optional[float] = None, burst:Optional[float] = None):
+        """
+        Token bucket refilled at a constant rate, shared by every thread.
+
+        Args:
+        - rate: Tokens added per second, None for no limit.
+        - burst: Maximum number of tokens saved up while idle, one second of tokens by default.
+
+        Callers consume what they used and sleep while the bucket is in debt, so large amounts (a whole file
+        chunk) never need to be split and the average rate is kept whatever their size.
+        """
+        self.lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+
+    def set_rate(self, rate:Optional[float], burst:Optional[float] = None) -> None:
+        with self.lock:
+            self.rate = rate
+            self.burst = burst or rate or 0
+            self.tokens:float = self.burst
+            self.updated:float = time.monotonic()
+
+
+    def consume(self, amount:float) -> float:
+        """
+        Takes amount tokens, waiting until the bucket is out of debt.
+        Returns the number of seconds waited.
+        """
+        with self.lock:
+            if not self.rate:
+                return 0.0
+
+            now:float = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - amount
+            self.updated = now
+            delay:float = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class Budget:
+    def __init__(self, name:str, bytes_per_second:Optional[float] = None, ops_per_second:Optional[float] = None, max_workers:Optional[int] = None):
+        """
+        Bandwidth, operation rate and concurrency allowed to one kind of synchronization work.
+
+        Args:
+        - name: 'seed' for initial copies, reconciliations and full repairs, 'live' for the changes detected by the monitor,
+                'scrub' for the background verification.
+        - bytes_per_second: Bytes written to the replicas per second, None for no limit.
+        - ops_per_second: File operations (copies, deletions, folder creations, renames) per second, None for no limit.
+        - max_workers: Threads applying the changes, None for the default of the thread pools.
+        """
+        self.name = name
+        self.bytes = TokenBucket()
+        self.ops = TokenBucket()
+        self.configure(bytes_per_second, ops_per_second, max_workers)
+
+
+    def configure(self, bytes_per_second:Optional[float] = None, ops_per_second:Optional[float] = None, max_workers:Optional[int] = None) -> None:
+        """
+        Changes the limits, the running copies follow the new rates right away and the worker count applies to the next run.
+        """
+        self.bytes.set_rate(bytes_per_second)
+        self.ops.set_rate(ops_per_second)
+        self.max_workers = max_workers
+
+
+    def consume_bytes(self, amount:int) -> None:
+        waited:float = self.bytes.consume(amount)
+        if waited:
+            metrics.throttle_seconds.inc(waited, budget=self.name, limit='bytes')
+
+
+    def consume_op(self) -> None:
+        waited:float = self.ops.consume(1)
+        if waited:
+            metrics.throttle_seconds.inc(waited, budget=self.name, limit='ops')
+
+
+# The background verification is limited by default, so it never competes with the synchronization
+SCRUB_DEFAULTS = {'bytes_per_second': 16 * 1024 * 1024, 'ops_per_second': 500}
+
+budgets:Dict[str, Budget] = {'seed': Budget('seed'), 'live': Budget('live'), 'scrub': Budget('scrub', **SCRUB_DEFAULTS)}
+
+# Budget charged by the copies running now, selected by the synchronization entry points. Pool tasks are
+# submitted with a copy of the submitting context, so each phase charges its own budget whatever thread it runs on
+current:contextvars.ContextVar = contextvars.ContextVar('current', default=budgets['live'])
+
+
+@contextlib.contextmanager
+def using(name:str) -> Iterator[Budget]:
+    """
+    Charges the work done inside the with block, and in the tasks it submits, to the named budget.
+    """
+    token:contextvars.Token = current.set(budgets[name])
+    try:
+        yield current.get()
+    finally:
+        current.reset(token)
+
+
+def current_budget() -> Budget:
+    return current.get()
+
+
+def consume_bytes(amount:int) -> None:
+    current.get().consume_bytes(amount)
+
+
+def consume_op() -> None:
+    current.get().consume_op()
+
+
+def parse_limits(spec:str) -> dict:
+    """
+    Parses a limits specification such as 'mbps=50,iops=200,workers=4' into the arguments of Budget.configure.
+    Missing keys are unlimited. Raises ValueError if the specification is invalid.
+    """
+    limits:dict = {}
+
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        key, _, value = item.partition('=')
+        try:
+            limits[key] = float(value)
+        except ValueError:
+            limits[key] = 0
+
+        if key not in LIMIT_KEYS or limits[key] <= 0:
+            raise ValueError(f"Invalid limit '{item}', expected {', '.join(key + '=<positive number>' for key in LIMIT_KEYS)}")
+
+    return {
+        'bytes_per_second': limits['mbps'] * 1024 * 1024 if 'mbps' in limits else None,
+        'ops_per_second': limits.get('iops'),
+        'max_workers': int(limits['workers']) if 'workers' in limits else None,
+    }
+
+
+def read_limits_file(limits_path:str) -> Dict[str, dict]:
+    """
+    Reads a limits file made of 'seed: <limits>', 'live: <limits>' and 'scrub: <limits>' lines. Lines starting with '#' are ignored.
+    Returns the parsed limits per budget name.
+    """
+    limits:Dict[str, dict] = {}
+
+    with open(limits_path, encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            name, _, spec = line.partition(':')
+            if name.strip() not in budgets:
+                raise ValueError(f"Unknown budget '{name.strip()}', expected {' or '.join(budgets)}")
+            limits[name.strip()] = parse_limits(spec)
+
+    return limits
+
+
+class LimitsFile:
+    def __init__(self, limits_path:str):
+        """
+        Limits file applied to the budgets again every time it is modified, so they can be adjusted at runtime.
+        """
+        self.limits_path = limits_path
+        self.modified:Optional[int] = None
+
+
+    def reload(self) -> bool:
+        """
+        Applies the file if it changed since it was last read. Returns True if the limits were updated.
+        An invalid file is reported with an exception and the previous limits are kept.
+        """
+        try:
+            modified:int = os.stat(self.limits_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+        if modified == self.modified:
+            return False
+
+        self.modified = modified
+        for name, limits in read_limits_file(self.limits_path).items():
+            budgets[name].configure(**limits)
+        return True
@@ -0,0 +1,445 @@
+import os
+import stat
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from src.manifest import ManifestEntry, ReplicaManifest, MANIFEST_FILENAME
+from src.coalesce import ancestors, is_within
+from src import filters
+
+
+@dataclass
+class TreeDiff:
+    """
+    Planned changes that turn the replica into a copy of the source.
+    All paths are relative to the source/replica roots.
+
+    - dirs_to_make: Folders missing from the replica, parents always before children.
+    - to_create: Files missing from the replica.
+    - to_update: Files whose replica copy is outdated.
+    - to_delete: Replica files and folders that no longer exist in the source (outermost paths only).
+    - to_move: (origin, destination) of replica files and folders moved in the source since they were copied.
+    """
+    dirs_to_make: List[str] = field(default_factory=list)
+    to_create: List[str] = field(default_factory=list)
+    to_update: List[str] = field(default_factory=list)
+    to_delete: List[str] = field(default_factory=list)
+    to_move: List[Tuple[str, str]] = field(default_factory=list)
+
+
+    def is_empty(self) -> bool:
+        return not (self.dirs_to_make or self.to_create or self.to_update or self.to_delete or self.to_move)
+
+
+class PlannedAction(NamedTuple):
+    """
+    A single step of a streamed synchronization plan.
+
+    - action: 'delete' (path missing from the source), 'replace' (path changed between file and folder, deleted
+              before it is recreated), 'make_dir', 'create', 'update', 'verify' (same-size file to compare by content)
+              or 'move' (replica path renamed to follow a move in the source).
+    - rel_path: Path relative to the source/replica roots.
+    - replica_hash: Recorded checksum of the replica file, for 'verify' actions.
+    - origin: Replica path moved to rel_path, for 'move' actions.
+    - size: Size of the source file when it was planned, for 'create' and 'update' actions of the tree walks.
+    """
+    action: str
+    rel_path: str
+    replica_hash: Optional[str] = None
+    origin: Optional[str] = None
+    size: Optional[int] = None
+
+
+def is_directory(stat_result:os.stat_result) -> bool:
+    return stat.S_ISDIR(stat_result.st_mode)
+
+
+def needs_update(source_stat:os.stat_result, replica_size:int, replica_mtime_ns:int) -> bool:
+    """
+    Returns True when the replica copy of a file is older than, or differs in size from, the source file.
+    """
+    return source_stat.st_mtime_ns > replica_mtime_ns or source_stat.st_size != replica_size
+
+
+def scan_directory(directory_path:str) -> Dict[str, os.stat_result]:
+    """
+    Lists a single directory, returning the stat cached by os.scandir for each entry name.
+    """
+    with os.scandir(directory_path) as entries:
+        return {entry.name: entry.stat(follow_symlinks=False) for entry in entries}
+
+
+def scan_tree(directory_path:str, rel_directory:str = '', path_filter:Optional[filters.PathFilter] = None) -> Iterator[tuple]:
+    """
+    Walks a directory tree top-down with os.scandir.
+
+    Args:
+    - directory_path: Path to the directory to walk.
+    - rel_directory: Relative path of directory_path inside the walked tree.
+    - path_filter: Excluded files are skipped and excluded folders are not descended into.
+
+    Yields (relative path, stat result) for every file and folder, reusing the stat cached by scandir.
+    """
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            rel_path:str = os.path.join(rel_directory, entry.name) if rel_directory else entry.name
+            stat_result = entry.stat(follow_symlinks=False)
+
+            if path_filter is not None and path_filter.excludes(rel_path, is_directory(stat_result), stat_result):
+                continue
+
+            yield rel_path, stat_result
+
+            if is_directory(stat_result):
+                yield from scan_tree(entry.path, rel_path, path_filter)
+
+
+def outermost_paths(rel_paths:Iterable[str]) -> List[str]:
+    """
+    Returns the given relative paths without those whose parent folder is also in the collection.
+    """
+    paths:set = set(rel_paths)
+    outermost:List[str] = []
+
+    for rel_path in sorted(paths):
+        parent:str = os.path.dirname(rel_path)
+        while parent and parent not in paths:
+            parent = os.path.dirname(parent)
+
+        if not parent:
+            outermost.append(rel_path)
+
+    return outermost
+
+
+def _plan_source_subtree(source_path:str, rel_directory:str) -> Iterator[PlannedAction]:
+    """
+    Plans the creation of everything below a source folder that is missing from the replica.
+    """
+    for rel_path, source_stat in scan_tree(source_path, rel_directory, filters.path_filter):
+        if is_directory(source_stat):
+            yield PlannedAction('make_dir', rel_path)
+        else:
+            yield PlannedAction('create', rel_path, size=source_stat.st_size)
+
+
+def replica_lister(replica_directory_path:str) -> Callable[[str], Dict[str, ManifestEntry]]:
+    """
+    Returns a function listing one replica folder from disk, as ManifestEntry values keyed by name.
+    """
+    def list_replica(rel_directory:str) -> Dict[str, ManifestEntry]:
+        entries:dict = scan_directory(os.path.join(replica_directory_path, rel_directory))
+        return {
+            name: ManifestEntry(entry.st_size, entry.st_mtime_ns, entry.st_ino, entry.st_mode, None)
+            for name, entry in entries.items() if rel_directory or not name.startswith(MANIFEST_FILENAME)
+        }
+
+    return list_replica
+
+
+class _MoveDetector:
+    def __init__(self, source_directory_path:str, list_replica:Callable[[str], Dict[str, ManifestEntry]],
+                 find:Callable[[int], List[Tuple[str, ManifestEntry]]]):
+        """
+        Matches the paths new to a replica with the replica paths that vanished from the source, for one walk.
+
+        Args:
+        - source_directory_path: Path to the source directory.
+        - list_replica: Lister of the replica root, used to read moved folders even below folders the replica is missing.
+        - find: Returns the (relative path, entry) of the replica paths copied from a source inode, usually
+                ReplicaManifest.with_source_inode.
+
+        Deletions are held until the walk is complete, as the destination of a move can be visited after its origin.
+        """
+        self.source_directory_path = source_directory_path
+        self.list_replica = list_replica
+        self.find = find
+        self.claimed:set = set()
+        self.deferred:List[str] = []
+
+
+    def origin(self, rel_path:str, source_stat:os.stat_result) -> Optional[str]:
+        """
+        Returns the replica path the new source path was moved from, or None.
+
+        The origin must have been copied from the same source inode (with the same size and modification time for
+        files) and that inode must no longer be at the origin in the source, which rules out hard links.
+        """
+        for origin, entry in self.find(source_stat.st_ino):
+            if is_within(rel_path, origin) or stat.S_ISDIR(entry.mode) != is_directory(source_stat):
+                continue
+
+            if not is_directory(source_stat) and (entry.size != source_stat.st_size or entry.mtime_ns != source_stat.st_mtime_ns):
+                continue
+
+            # Already moved elsewhere, by itself or with one of its folders
+            if origin in self.claimed or any(parent in self.claimed for parent in ancestors(origin)):
+                continue
+
+            try:
+                if os.lstat(os.path.join(self.source_directory_path, origin)).st_ino == source_stat.st_ino:
+                    continue
+            except OSError:
+                pass
+
+            self.claimed.add(origin)
+            return origin
+
+        return None
+
+
+    def defer(self, rel_path:str) -> None:
+        self.deferred.append(rel_path)
+
+
+    def deletions(self) -> Iterator[str]:
+        """
+        Yields the held deletions of the paths that were not moved.
+        """
+        for rel_path in self.deferred:
+            if rel_path not in self.claimed:
+                yield rel_path
+
+
+def _moved_lister(list_replica:Callable[[str], Dict[str, ManifestEntry]], origin:str, rel_path:str) -> Callable[[str], Dict[str, ManifestEntry]]:
+    """
+    Lists the folders of a replica folder being moved from origin to rel_path.
+    They are read from the origin until the move is applied and from the destination afterwards.
+    """
+    def list_moved(rel_directory:str) -> Dict[str, ManifestEntry]:
+        for candidate in (origin + rel_directory[len(rel_path):], rel_directory):
+            try:
+                entries:dict = list_replica(candidate)
+            except FileNotFoundError:
+                continue
+            if entries:
+                return entries
+        return {}
+
+    return list_moved
+
+
+def _plan_recorded_folders(source_directory_path:str, rel_directory:str, listers:List[Callable[[str], Dict[str, ManifestEntry]]],
+                           compare_content:bool, detectors:List[Optional[_MoveDetector]], since_ns:int) -> Iterator[Tuple[int, PlannedAction]]:
+    """
+    Descends into the subfolders the replicas recorded for a source folder that was not modified since since_ns,
+    without listing the source folder or comparing its files.
+    """
+    replicas:List[dict] = [list_replica(rel_directory) for list_replica in listers]
+    names:set = {name for replica_entries in replicas for name, entry in replica_entries.items() if stat.S_ISDIR(entry.mode)}
+
+    for name in sorted(names):
+        rel_path:str = os.path.join(rel_directory, name)
+        if filters.path_filter is not None and filters.path_filter.excludes(rel_path, True):
+            continue
+
+        sublisters:list = [
+            list_replica if name in replica_entries and stat.S_ISDIR(replica_entries[name].mode) else None
+            for list_replica, replica_entries in zip(listers, replicas)
+        ]
+        yield from _plan_directories(source_directory_path, rel_path, sublisters, compare_content, detectors, since_ns)
+
+
+def _plan_directories(source_directory_path:str, rel_directory:str, listers:List[Optional[Callable[[str], Dict[str, ManifestEntry]]]],
+                      compare_content:bool, detectors:List[Optional[_MoveDetector]], since_ns:Optional[int] = None) -> Iterator[Tuple[int, PlannedAction]]:
+    """
+    Compares one folder of the source with the same folder of every replica and descends into the subfolders.
+    The source folder is listed once whatever the number of replicas, and only the entries of the folders on the
+    current branch are held in memory. A None lister stands for a replica missing the folder.
+    Excluded paths are left alone on both sides, and excluded folders are not descended into.
+    Replicas with a move detector get 'move' actions for moved paths and their deletions are held by the detector.
+    With since_ns, folders whose modification time is older are trusted to have the entries the replicas recorded,
+    only their subfolders are visited.
+
+    Yields (index of the replica in listers, action).
+    """
+    if since_ns is not None and all(listers):
+        try:
+            unchanged:bool = os.stat(os.path.join(source_directory_path, rel_directory)).st_mtime_ns < since_ns
+        except FileNotFoundError:
+            return
+
+        if unchanged:
+            yield from _plan_recorded_folders(source_directory_path, rel_directory, listers, compare_content, detectors, since_ns)
+            return
+
+    source_entries:dict = scan_directory(os.path.join(source_directory_path, rel_directory))
+    path_filter = filters.path_filter
+    excluded:set = set()
+
+    if path_filter is not None:
+        excluded = {
+            name for name, source_stat in source_entries.items()
+            if path_filter.excludes(os.path.join(rel_directory, name), is_directory(source_stat), source_stat)
+        }
+        source_entries = {name: source_stat for name, source_stat in source_entries.items() if name not in excluded}
+
+    replicas:List[dict] = []
+
+    for index, list_replica in enumerate(listers):
+        replica_entries:dict = list_replica(rel_directory) if list_replica is not None else {}
+
+        if path_filter is not None:
+            replica_entries = {
+                name: entry for name, entry in replica_entries.items()
+                if name not in excluded and (name in source_entries or not path_filter.excludes(os.path.join(rel_directory, name), stat.S_ISDIR(entry.mode)))
+            }
+
+        for name, entry in replica_entries.items():
+            source_stat = source_entries.get(name)
+
+            if source_stat is None:
+                if detectors[index] is not None:
+                    detectors[index].defer(os.path.join(rel_directory, name))
+                else:
+                    yield index, PlannedAction('delete', os.path.join(rel_directory, name))
+
+            # The path changed between file and folder, it is deleted here and recreated below
+            elif is_directory(source_stat) != stat.S_ISDIR(entry.mode):
+                yield index, PlannedAction('replace', os.path.join(rel_directory, name))
+
+        replicas.append(replica_entries)
+
+    for name, source_stat in source_entries.items():
+        rel_path:str = os.path.join(rel_directory, name)
+
+        if is_directory(source_stat):
+            sublisters:list = []
+            subtree_since_ns:Optional[int] = since_ns
+
+            for index, (list_replica, replica_entries) in enumerate(zip(listers, replicas)):
+                entry = replica_entries.get(name)
+
+                if entry is not None and stat.S_ISDIR(entry.mode):
+                    sublisters.append(list_replica)
+                    continue
+
+                # Folders new to the replica, or moved there, are compared in full
+                subtree_since_ns = None
+
+                origin:Optional[str] = detectors[index].origin(rel_path, source_stat) if detectors[index] is not None else None
+
+                if origin is not None:
+                    yield index, PlannedAction('move', rel_path, origin=origin)
+                    sublisters.append(_moved_lister(detectors[index].list_replica, origin, rel_path))
+                else:
+                    yield index, PlannedAction('make_dir', rel_path)
+                    sublisters.append(None)
+
+            yield from _plan_directories(source_directory_path, rel_path, sublisters, compare_content, detectors, subtree_since_ns)
+            continue
+
+        for index, replica_entries in enumerate(replicas):
+            entry = replica_entries.get(name)
+
+            if entry is None or stat.S_ISDIR(entry.mode):
+                origin = detectors[index].origin(rel_path, source_stat) if detectors[index] is not None else None
+                yield index, PlannedAction('move', rel_path, origin=origin) if origin is not None else PlannedAction('create', rel_path, size=source_stat.st_size)
+
+            elif compare_content and source_stat.st_size == entry.size:
+                yield index, PlannedAction('verify', rel_path, entry.hash)
+
+            elif needs_update(source_stat, entry.size, entry.mtime_ns):
+                yield index, PlannedAction('update', rel_path, size=source_stat.st_size)
+
+
+def _plan_walk(source_directory_path:str, rel_directory:str, listers:List[Callable[[str], Dict[str, ManifestEntry]]], compare_content:bool,
+               finders:Optional[List[Optional[Callable[[int], List[Tuple[str, ManifestEntry]]]]]] = None,
+               since_ns:Optional[int] = None) -> Iterator[Tuple[int, PlannedAction]]:
+    """
+    Plans a folder of every replica, detecting moves for the replicas with a finder of recorded source inodes.
+    The deletions held for move detection are yielded once the walk is complete.
+    """
+    detectors:List[Optional[_MoveDetector]] = [
+        _MoveDetector(source_directory_path, list_replica, find) if find is not None else None
+        for list_replica, find in zip(listers, finders or [None] * len(listers))
+    ]
+
+    yield from _plan_directories(source_directory_path, rel_directory, listers, compare_content, detectors, since_ns)
+
+    for index, detector in enumerate(detectors):
+        if detector is not None:
+            for rel_path in detector.deletions():
+                yield index, PlannedAction('delete', rel_path)
+
+
+def _plan_directory(source_directory_path:str, rel_directory:str, list_replica:Callable[[str], Dict[str, ManifestEntry]],
+                    compare_content:bool, find:Optional[Callable[[int], List[Tuple[str, ManifestEntry]]]] = None,
+                    since_ns:Optional[int] = None) -> Iterator[PlannedAction]:
+    """
+    Compares one folder of the source with the same folder of a single replica and descends into the subfolders.
+    """
+    for _, action in _plan_walk(source_directory_path, rel_directory, [list_replica], compare_content, [find], since_ns):
+        yield action
+
+
+
+def plan_trees(source_directory_path:str, replica_directory_path:str, compare_content:bool = False) -> Iterator[PlannedAction]:
+    """
+    Walks the source and replica directories in lockstep, yielding the actions needed to synchronize them.
+
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - compare_content: Yield 'verify' actions for same-size files instead of comparing modification times.
+
+    Deletions and replacements of a folder's entries are yielded before anything below that folder is created.
+    Nothing is modified on disk.
+    """
+    yield from _plan_directory(source_directory_path, '', replica_lister(replica_directory_path), compare_content)
+
+
+def plan_subtree(source_directory_path:str, replica_directory_path:str, rel_directory:str, compare_content:bool = False) -> Iterator[PlannedAction]:
+    """
+    Yields the actions needed to synchronize a single folder of the replica with the same folder of the source.
+
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_path: Path to the replica directory.
+    - rel_directory: Relative path of the folder to compare, it must exist in the source.
+    - compare_content: Yield 'verify' actions for same-size files instead of comparing modification times.
+    """
+    replica_path:str = os.path.join(replica_directory_path, rel_directory)
+
+    if os.path.isdir(replica_path) and not os.path.islink(replica_path):
+        yield from _plan_directory(source_directory_path, rel_directory, replica_lister(replica_directory_path), compare_content)
+    else:
+        if os.path.lexists(replica_path):
+            yield PlannedAction('replace', rel_directory)
+        yield PlannedAction('make_dir', rel_directory)
+        yield from _plan_source_subtree(os.path.join(source_directory_path, rel_directory), rel_directory)
+
+
+def plan_against_manifest(source_directory_path:str, manifest:ReplicaManifest, compare_content:bool = False, since_ns:Optional[int] = None) -> Iterator[PlannedAction]:
+    """
+    Yields the actions needed to synchronize the replica using its manifest instead of walking it.
+    The manifest is read one folder at a time, so the recorded entries are never loaded all at once.
+
+    Args:
+    - source_directory_path: Path to the source directory.
+    - manifest: Populated replica manifest.
+    - compare_content: Yield 'verify' actions, with the recorded replica hash, for same-size files.
+    - since_ns: Optional time (ns) the replica was known to match the source. Source folders not modified since
+                are not listed, so files modified in place without any change to their folder are not seen.
+
+    Files and folders moved in the source are found by their recorded source inode and moved in the replica
+    instead of being deleted and copied again.
+    """
+    yield from _plan_directory(source_directory_path, '', manifest.children, compare_content, manifest.with_source_inode, since_ns)
+
+
+def plan_replicas(source_directory_path:str, listers:List[Callable[[str], Dict[str, ManifestEntry]]], compare_content:bool = False,
+                  finders:Optional[List[Optional[Callable[[int], List[Tuple[str, ManifestEntry]]]]]] = None,
+                  since_ns:Optional[int] = None) -> Iterator[Tuple[int, PlannedAction]]:
+    """
+    Walks the source once and yields the actions needed to synchronize several replicas with it.
+
+    Args:
+    - source_directory_path: Path to the source directory.
+    - listers: Function listing a folder of each replica, replica_lister for a walk or ReplicaManifest.children.
+    - compare_content: Yield 'verify' actions for same-size files instead of comparing modification times.
+    - finders: Optional ReplicaManifest.with_source_inode of each replica (None for walked replicas), to detect moves.
+    - since_ns: Optional time (ns) every replica was known to match the source, as in plan_against_manifest.
+
+    Yields (index of the replica in listers, action), every replica getting the same order as plan_trees or plan_against_manifest.
+    """
+    yield from _plan_walk(source_directory_path, '', listers, compare_content, finders, since_ns)
@@ -1,22 +1,43 @@
 from watchdog.events import FileSystemEvent, FileSystemEventHandler
-from multiprocessing import Process, Queue, Event
+from multiprocessing import Process, Pipe, Event
+from multiprocessing.connection import Connection
 from watchdog.observers import Observer
-from typing import List 
+from typing import Callable, List, Optional
+import threading
+import asyncio
 import time
 import sys
 import os
+from src import metrics
+from src.filters import PathFilter
+
+
+BATCH_INTERVAL = 0.1
+BATCH_SIZE = 1000
 
 
 class MyEventHandler(FileSystemEventHandler):
     """
     Initializes the event handler for file system events.
+    Events are buffered as (type, path, new_path, is_file) tuples until they are taken in a batch.
 
     Args:
-    - event_queue: Queue to collect file system event changes.
+    - batch_size: Number of buffered events after which batch_ready is set.
+    - root: Path to the monitored directory, the filter rules are relative to it.
+    - path_filter: Events on excluded paths are dropped before they are buffered.
     """
-    def __init__(self, event_queue:Queue):
+    def __init__(self, batch_size:int = BATCH_SIZE, root:str = '', path_filter:Optional[PathFilter] = None):
         super().__init__()
-        self.event_queue = event_queue
+        self.batch_size = batch_size
+        self.root = os.path.abspath(root or os.curdir)
+        self.path_filter = path_filter if path_filter and not path_filter.is_empty() else None
+        self.buffer:List[tuple] = []
+        self.lock = threading.Lock()
+        self.batch_ready = threading.Event()
+        self.events_available = threading.Event()
+
+        # Called from the observer thread whenever events are buffered, used to wake up an event loop
+        self.on_available:Optional[Callable[[], None]] = None
 
 
     def on_created(self, event:FileSystemEvent) -> None:
@@ -63,27 +84,33 @@ class MyEventHandler(FileSystemEventHandler):
         Args:
         - event: The file system event triggered by a move or rename.
         """
+        if self.path_filter is not None:
+            src_excluded:bool = self._excludes(event.src_path, event.is_directory, use_stat=False)
+            dest_excluded:bool = self._excludes(event.dest_path, event.is_directory)
+
+            if src_excluded and dest_excluded:
+                return
+
+            # Moved out of the synchronized paths, the replica copy is deleted
+            if dest_excluded:
+                self._buffer(("deleted", os.path.normpath(event.src_path), None, not event.is_directory))
+                return
+
+            # Moved in from an excluded path, the replica has no copy to move
+            if src_excluded:
+                self._buffer(("created", os.path.normpath(event.dest_path), None, not event.is_directory))
+                return
+
         src_parent:str|bytes = os.path.dirname(event.src_path)
         dest_parent:str|bytes = os.path.dirname(event.dest_path)
 
-        # Rename #
-        if src_parent == dest_parent:
-            if event.is_directory:
-                self._add_event("renamed", event, is_file=False)
+        # Move, keeping its name #
+        if src_parent != dest_parent and os.path.basename(event.src_path) == os.path.basename(event.dest_path):
+            self._add_event("moved", event, new_path=dest_parent, is_file=not event.is_directory)
 
-            else:
-                self._add_event("renamed", event, new_path=event.dest_path,is_file=True)
-
-        # Move #
+        # Rename, possibly into another folder #
         else:
-            src_base:str|bytes = os.path.basename(src_parent)
-            dest_base:str|bytes = os.path.basename(dest_parent)
-
-            if src_base != dest_base:
-                if event.is_directory:
-                    self._add_event("moved", event, new_path=dest_parent,is_file=False)
-                else:
-                    self._add_event("moved", event, new_path=dest_parent,is_file=True)
+            self._add_event("renamed", event, new_path=event.dest_path, is_file=not event.is_directory)
 
 
     def _add_event(self, event_type: str, event: FileSystemEvent, new_path = None, is_file: bool = False) -> None:
@@ -96,25 +123,81 @@ class MyEventHandler(FileSystemEventHandler):
         - new_path: The new path for moved or renamed files.
         - is_file: Boolean flag indicating whether the event is related to a file (True) or directory (False).
         """
-        self.event_queue.put({
-            "type": event_type,
-            "path": os.path.normpath(event.src_path),
-            "new_path": new_path,
-            "is_file": is_file,
-        })
+        if new_path is None and self.path_filter is not None:
+            if self._excludes(event.src_path, event.is_directory, use_stat=event_type != "deleted"):
+                return
+
+        self._buffer((event_type, os.path.normpath(event.src_path), new_path, is_file))
+
+
+    def _excludes(self, path:str, is_dir:bool, use_stat:bool = True) -> bool:
+        """
+        Returns True if the filter excludes a path of the monitored directory.
+        The file is only stat'ed for the size and age rules, when it still exists.
+        """
+        path = os.path.abspath(path)
+        rel_path:str = os.path.relpath(path, self.root)
+        if rel_path == os.curdir or rel_path.startswith(os.pardir):
+            return False
 
+        stat_result = None
+        if use_stat and not is_dir and (self.path_filter.max_size is not None or self.path_filter.max_age is not None):
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                pass
 
+        return self.path_filter.excludes(rel_path, is_dir, stat_result)
 
-def directory_monitoring(path:str, event_queue:Queue, stop_event) -> None:
+
+    def _buffer(self, record:tuple) -> None:
+        with self.lock:
+            self.buffer.append(record)
+            self.events_available.set()
+            if self.on_available:
+                self.on_available()
+            if len(self.buffer) >= self.batch_size:
+                self.batch_ready.set()
+
+
+    def take_events(self) -> List[tuple]:
+        """
+        Returns every buffered event and empties the buffer.
+        """
+        with self.lock:
+            events, self.buffer = self.buffer, []
+            self.batch_ready.clear()
+            self.events_available.clear()
+        return events
+
+
+def to_change(record:tuple) -> dict:
+    """
+    Converts a buffered event record into the change dictionary used by the synchronization.
+    """
+    event_type, path, new_path, is_file = record
+    return {
+        "type": event_type,
+        "path": path,
+        "new_path": new_path,
+        "is_file": is_file,
+    }
+
+
+
+def directory_monitoring(path:str, connection:Connection, stop_event, batch_interval:float = BATCH_INTERVAL,
+                         path_filter:Optional[PathFilter] = None) -> None:
     """
     Monitors the specified directory for file system events.
 
     Args:
     - path: The directory to monitor.
-    - event_queue: Queue to collect file system event changes.
+    - connection: Pipe end receiving the batches of events.
     - stop_event: Event to signal when to stop monitoring.
+    - batch_interval: Maximum number of seconds an event waits before its batch is sent.
+    - path_filter: Events on excluded paths are dropped before they are sent.
     """
-    event_handler:MyEventHandler = MyEventHandler(event_queue) 
+    event_handler:MyEventHandler = MyEventHandler(root=path, path_filter=path_filter)
 
     observer = Observer()
     observer.schedule(event_handler, path, recursive=True)
@@ -122,7 +205,10 @@ def directory_monitoring(path:str, event_queue:Queue, stop_event) -> None:
 
     try:
         while not stop_event.is_set():
-            time.sleep(1)
+            event_handler.batch_ready.wait(batch_interval)
+            events:List[tuple] = event_handler.take_events()
+            if events:
+                connection.send(events)
 
     except KeyboardInterrupt:
         sys.exit(0)
@@ -131,30 +217,54 @@ def directory_monitoring(path:str, event_queue:Queue, stop_event) -> None:
         observer.stop()
         observer.join()
 
+        events = event_handler.take_events()
+        if events:
+            connection.send(events)
+        connection.close()
+
 
 
 class FolderMonitor:
-    def __init__(self, path: str):
+    def __init__(self, path: str, mode:str = 'process', batch_interval:float = BATCH_INTERVAL, path_filter:Optional[PathFilter] = None):
         """
-        Initializes the folder monitoring process.
+        Initializes the folder monitoring.
 
         Args:
         - path: The path to the directory to monitor.
+        - mode: 'process' watches from a separate process sending batches of events through a pipe,
+                'thread' watches from a thread of the current process without any IPC.
+        - batch_interval: Maximum number of seconds an event waits before its batch is sent (process mode).
+        - path_filter: Events on excluded paths are dropped before they are queued.
         """
         self.path = path
-        self.event_queue = Queue()
+        self.mode = mode
+        self.batch_interval = batch_interval
+        self.path_filter = path_filter
+        self.undelivered:List[tuple] = []
+
+        self.receiver, self.sender = Pipe(duplex=False)
         self.stop_event = Event()
         self.process = None
 
+        self.event_handler = None
+        self.observer = None
+
 
     def start(self) -> None:
         """
-        Starts the folder monitoring process if not already running.
+        Starts the folder monitoring if not already running.
         """
-        if not self.process or not self.process.is_alive():
+        if self.mode == 'thread':
+            if not self.observer or not self.observer.is_alive():
+                self.event_handler = MyEventHandler(root=self.path, path_filter=self.path_filter)
+                self.observer = Observer()
+                self.observer.schedule(self.event_handler, self.path, recursive=True)
+                self.observer.start()
+
+        elif not self.process or not self.process.is_alive():
             self.process = Process(
                 target=directory_monitoring,
-                args=(self.path, self.event_queue, self.stop_event),
+                args=(self.path, self.sender, self.stop_event, self.batch_interval, self.path_filter),
                 daemon=True
             )
             self.process.start()
@@ -162,13 +272,95 @@ class FolderMonitor:
 
     def stop(self) -> None:
         """
-        Stops the folder monitoring process.
+        Stops the folder monitoring. Events not retrieved yet remain available through get_changes.
         """
+        if self.observer and self.observer.is_alive():
+            self.observer.stop()
+            self.observer.join()
+
         if self.process and self.process.is_alive():
             self.stop_event.set()
+
+            # Keep draining the pipe so the monitoring process is never blocked sending its last batch
+            while self.process.is_alive():
+                self.undelivered.extend(self._receive(timeout=0.1))
             self.process.join()
 
 
+    def _receive(self, timeout:float = 0.0) -> List[tuple]:
+        """
+        Returns the records of every batch waiting in the pipe.
+        """
+        records:List[tuple] = []
+
+        try:
+            while self.receiver.poll(timeout):
+                records.extend(self.receiver.recv())
+                timeout = 0.0
+
+        except (EOFError, OSError):
+            pass
+
+        return records
+
+
+    def wait_for_changes(self, timeout:float) -> bool:
+        """
+        Blocks until changes are available or the timeout (in seconds) expires.
+        Returns True if changes are available.
+        """
+        if self.undelivered:
+            return True
+
+        if self.event_handler:
+            return self.event_handler.events_available.wait(timeout)
+
+        try:
+            return self.receiver.poll(timeout)
+
+        except (EOFError, OSError):
+            time.sleep(timeout)
+            return False
+
+
+    async def wait_for_changes_async(self, timeout:float) -> bool:
+        """
+        Waits without blocking the event loop until changes are available or the timeout (in seconds) expires.
+        Returns True if changes are available.
+
+        The pipe of the monitoring process is watched by the event loop, in thread mode the event handler wakes it up.
+        """
+        if self.undelivered:
+            return True
+
+        loop = asyncio.get_running_loop()
+        available = asyncio.Event()
+
+        if self.event_handler:
+            self.event_handler.on_available = lambda: loop.call_soon_threadsafe(available.set)
+            if self.event_handler.events_available.is_set():
+                available.set()
+        else:
+            try:
+                loop.add_reader(self.receiver.fileno(), available.set)
+            except (NotImplementedError, OSError):
+                # Event loops that cannot watch pipes wait on a thread instead
+                return await loop.run_in_executor(None, self.wait_for_changes, timeout)
+
+        try:
+            await asyncio.wait_for(available.wait(), timeout)
+            return True
+
+        except asyncio.TimeoutError:
+            return False
+
+        finally:
+            if self.event_handler:
+                self.event_handler.on_available = None
+            else:
+                loop.remove_reader(self.receiver.fileno())
+
+
     def get_changes(self) -> List[dict]:
         """
         Retrieves any detected changes in the monitored directory.
@@ -176,8 +368,13 @@ class FolderMonitor:
         Returns:
         - List of changes, each represented as a dictionary containing event type, path, etc.
         """
-        changes = []
-        while not self.event_queue.empty():
-            changes.append(self.event_queue.get())
-        return changes
+        records, self.undelivered = self.undelivered, []
+
+        if self.event_handler:
+            records.extend(self.event_handler.take_events())
+        else:
+            records.extend(self._receive())
+
+        metrics.monitor_queue_depth.set(len(records))
+        return [to_change(record) for record in records]
 
@@ -0,0 +1,87 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from src import tree_diff
+from src.replicas import ReplicaSet
+
+
+class CatchUpTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source')
+        self.replicas = [os.path.join(self.directory, f'replica{index}') for index in range(2)]
+        os.makedirs(os.path.join(self.source, 'a', 'b'))
+        for path in self.replicas:
+            os.makedirs(path)
+
+        for rel_path in ('top', os.path.join('a', 'one'), os.path.join('a', 'b', 'two')):
+            self.write(rel_path, rel_path)
+
+        replicas = ReplicaSet(self.source, self.replicas, scrub_interval=None)
+        replicas.reconcile()
+        replicas.save_checkpoint(time.time_ns())
+        replicas.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def write(self, rel_path:str, content:str) -> None:
+        with open(os.path.join(self.source, rel_path), 'w') as file:
+            file.write(content)
+
+
+    def assert_replicas_match(self) -> None:
+        for replica in self.replicas:
+            for directory_path, _, names in os.walk(self.source):
+                rel_directory:str = os.path.relpath(directory_path, self.source)
+                for name in names:
+                    with open(os.path.join(directory_path, name)) as source, open(os.path.join(replica, rel_directory, name)) as copy:
+                        self.assertEqual(source.read(), copy.read())
+
+
+    def test_replicas_with_a_checkpoint_share_one_source_walk(self):
+        self.write(os.path.join('a', 'b', 'new'), 'new')
+        os.remove(os.path.join(self.source, 'top'))
+
+        scanned:list = []
+        scan_directory = tree_diff.scan_directory
+
+        def counting_scan(directory_path:str) -> dict:
+            scanned.append(directory_path)
+            return scan_directory(directory_path)
+
+        replicas = ReplicaSet(self.source, self.replicas, scrub_interval=None)
+        try:
+            with mock.patch.object(tree_diff, 'scan_directory', counting_scan):
+                replicas.catch_up()
+            self.assertEqual([len(replica.repairs) for replica in replicas.replicas], [0, 0])
+        finally:
+            replicas.close()
+
+        self.assertEqual(len(scanned), len(set(scanned)))
+        self.assert_replicas_match()
+        for replica in self.replicas:
+            self.assertFalse(os.path.exists(os.path.join(replica, 'top')))
+
+
+    def test_replicas_without_a_checkpoint_are_reconciled(self):
+        self.write(os.path.join('a', 'changed'), 'changed')
+        os.remove(os.path.join(self.replicas[1], '.sync_manifest.db'))
+        os.remove(os.path.join(self.replicas[1], 'top'))
+
+        replicas = ReplicaSet(self.source, self.replicas, scrub_interval=None)
+        try:
+            replicas.catch_up()
+        finally:
+            replicas.close()
+
+        self.assert_replicas_match()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import types
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from src.replicas import ReplicaSet
+from src.checksum import ChecksumCache
+from src.synchronization import duplicate_source, plan_replica_update
+from src.manifest import ReplicaManifest
+from src import throttle
+
+
+class ChecksumReconcileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source')
+        self.replica = os.path.join(self.directory, 'replica')
+        os.makedirs(self.source)
+        os.makedirs(self.replica)
+
+        for index in range(20):
+            with open(os.path.join(self.source, f'kept{index}'), 'w') as file:
+                file.write(f'kept {index}')
+
+        manifest = ReplicaManifest(self.replica)
+        duplicate_source(self.source, self.replica, manifest)
+
+        # Files restored into the replica behind the manifest's back are verified by content
+        for index in range(20):
+            manifest.remove(f'kept{index}')
+        manifest.commit()
+        manifest.close()
+
+        for index in range(20):
+            with open(os.path.join(self.source, f'new{index}'), 'w') as file:
+                file.write(f'new {index}')
+
+
+    def tearDown(self):
+        throttle.budgets['seed'].configure()
+        shutil.rmtree(self.directory)
+
+
+    def test_plan_is_streamed(self):
+        manifest = ReplicaManifest(self.replica)
+        checksums = ChecksumCache(os.path.join(self.directory, 'checksums.db'))
+        try:
+            actions = plan_replica_update(self.source, self.replica, manifest, checksums)
+            self.assertIsInstance(actions, types.GeneratorType)
+            self.assertEqual(next(actions).action, 'create')
+        finally:
+            checksums.close()
+            manifest.close()
+
+
+    def test_reconcile_with_checksums_against_populated_manifest(self):
+        throttle.budgets['seed'].configure(max_workers=2)
+        lock = threading.Lock()
+        running:list = [0, 0]   # Hashes running now, most running at once
+        checksum = ChecksumCache.checksum
+
+        def counting_checksum(cache:ChecksumCache, path:str) -> str:
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            try:
+                return checksum(cache, path)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        replicas = ReplicaSet(self.source, [self.replica], checksum=True, scrub_interval=None)
+        try:
+            with mock.patch.object(ChecksumCache, 'checksum', counting_checksum):
+                replicas.reconcile()
+            replica = replicas.replicas[0]
+            self.assertEqual(len(replica.repairs), 0)
+            self.assertEqual(set(replica.manifest.entries()), set(os.listdir(self.source)))
+        finally:
+            replicas.close()
+
+        self.assertGreater(running[1], 0)
+        self.assertLessEqual(running[1], 2)
+        for name in os.listdir(self.source):
+            with open(os.path.join(self.source, name)) as source, open(os.path.join(self.replica, name)) as replica:
+                self.assertEqual(source.read(), replica.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import unittest
+from src.coalesce import EventCoalescer, coalesce_changes, make_change
+
+
+def change(event_type:str, path:str, is_file:bool = True, new_path = None) -> dict:
+    return make_change(event_type, path, is_file, new_path)
+
+
+class CoalesceChangesTest(unittest.TestCase):
+    def test_repeated_modifications_collapse(self):
+        changes = coalesce_changes([change('modified', 'a'), change('modified', 'a'), change('modified', 'a')])
+        self.assertEqual(changes, [change('modified', 'a')])
+
+
+    def test_created_then_deleted_cancels_out(self):
+        self.assertEqual(coalesce_changes([change('created', 'a'), change('modified', 'a'), change('deleted', 'a')]), [])
+
+
+    def test_deleted_then_created_file_is_a_modification(self):
+        self.assertEqual(coalesce_changes([change('deleted', 'a'), change('created', 'a')]), [change('modified', 'a')])
+
+
+    def test_rename_chain_is_folded(self):
+        changes = coalesce_changes([change('renamed', 'a', new_path='b'), change('renamed', 'b', new_path='c')])
+        self.assertEqual(changes, [change('renamed', 'a', new_path='c')])
+
+
+    def test_rename_back_to_the_origin_cancels_out(self):
+        self.assertEqual(coalesce_changes([change('renamed', 'a', new_path='b'), change('renamed', 'b', new_path='a')]), [])
+
+
+    def test_changes_inside_a_created_folder_are_dropped(self):
+        changes = coalesce_changes([
+            change('created', 'd', is_file=False),
+            change('created', os.path.join('d', 'f')),
+            change('modified', os.path.join('d', 'f')),
+        ])
+        self.assertEqual(changes, [change('created', 'd', is_file=False)])
+
+
+    def test_changes_inside_a_deleted_folder_are_dropped(self):
+        changes = coalesce_changes([change('modified', os.path.join('d', 'f')), change('deleted', 'd', is_file=False)])
+        self.assertEqual(changes, [change('deleted', 'd', is_file=False)])
+
+
+    def test_changes_inside_a_renamed_folder_are_rebased(self):
+        changes = coalesce_changes([change('modified', os.path.join('d', 'f')), change('renamed', 'd', is_file=False, new_path='e')])
+        self.assertEqual(changes, [change('renamed', 'd', is_file=False, new_path='e'), change('modified', os.path.join('e', 'f'))])
+
+
+    def test_children_moved_with_their_folder_are_ignored(self):
+        changes = coalesce_changes([
+            change('renamed', 'd', is_file=False, new_path='e'),
+            change('renamed', os.path.join('d', 'f'), new_path=os.path.join('e', 'f')),
+        ])
+        self.assertEqual(changes, [change('renamed', 'd', is_file=False, new_path='e')])
+
+
+    def test_hidden_files_are_ignored_and_their_rename_modifies_the_destination(self):
+        changes = coalesce_changes([
+            change('created', '.a.swp'),
+            change('modified', '.a.swp'),
+            change('renamed', '.a.swp', new_path='a'),
+        ])
+        self.assertEqual(changes, [change('modified', 'a')])
+
+
+    def test_move_keeps_the_name(self):
+        changes = coalesce_changes([change('moved', 'f', new_path='d')])
+        self.assertEqual(changes, [change('renamed', 'f', new_path=os.path.join('d', 'f'))])
+
+
+class EventCoalescerTest(unittest.TestCase):
+    def test_busy_paths_wait_for_the_quiet_period(self):
+        coalescer = EventCoalescer(quiet_period=1.0, max_delay=10.0)
+        coalescer.add([change('created', 'a')], now=0.0)
+        coalescer.add([change('modified', 'a')], now=0.5)
+
+        self.assertEqual(coalescer.flush(now=1.0), [])
+        self.assertEqual(len(coalescer), 1)
+        self.assertEqual(coalescer.next_release(now=1.0), 0.5)
+        self.assertEqual(coalescer.flush(now=1.5), [change('created', 'a')])
+        self.assertIsNone(coalescer.next_release())
+
+
+    def test_max_delay_releases_a_path_that_stays_busy(self):
+        coalescer = EventCoalescer(quiet_period=1.0, max_delay=2.0)
+        for moment in (0.0, 0.5, 1.0, 1.5, 2.0):
+            coalescer.add([change('modified', 'a')], now=moment)
+
+        self.assertEqual(coalescer.flush(now=2.0), [change('modified', 'a')])
+
+
+    def test_deletions_and_renames_are_not_held(self):
+        coalescer = EventCoalescer(quiet_period=1.0)
+        coalescer.add([change('deleted', 'a'), change('renamed', 'b', new_path='c'), change('created', 'd')], now=0.0)
+
+        self.assertEqual(coalescer.flush(now=0.0), [change('deleted', 'a'), change('renamed', 'b', new_path='c')])
+        self.assertEqual(coalescer.flush(now=0.0, force=True), [change('created', 'd')])
+
+
+if __name__ == '__main__':
+    unittest.main()
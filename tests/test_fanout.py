@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.manifest import ReplicaManifest
+from src.synchronization import ReplicaWriter, apply_fanout
+from src.tree_diff import PlannedAction
+
+
+class FanoutTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source')
+        self.replicas = [os.path.join(self.directory, f'replica{index}') for index in range(2)]
+        for path in [self.source] + self.replicas:
+            os.makedirs(path)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_copies_each_file_to_every_replica(self):
+        with open(os.path.join(self.source, 'file'), 'w') as file:
+            file.write('content')
+
+        writers = [ReplicaWriter(self.source, replica) for replica in self.replicas]
+        failed = apply_fanout(writers, [(index, PlannedAction('create', 'file')) for index in range(2)])
+
+        self.assertEqual(failed, [[], []])
+        for replica in self.replicas:
+            with open(os.path.join(replica, 'file')) as file:
+                self.assertEqual(file.read(), 'content')
+
+
+    def test_source_removed_before_the_copy_fails_every_replica(self):
+        manifests = [ReplicaManifest(replica) for replica in self.replicas]
+        writers = [ReplicaWriter(self.source, replica, manifest) for replica, manifest in zip(self.replicas, manifests)]
+        try:
+            failed = apply_fanout(writers, [(index, PlannedAction('create', 'gone')) for index in range(2)])
+        finally:
+            for manifest in manifests:
+                manifest.close()
+
+        self.assertEqual(failed, [['gone'], ['gone']])
+        for replica in self.replicas:
+            self.assertFalse(os.path.exists(os.path.join(replica, 'gone')))
+
+
+if __name__ == '__main__':
+    unittest.main()
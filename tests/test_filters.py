@@ -0,0 +1,68 @@
+import os
+import unittest
+from src.filters import PathFilter
+
+
+class PathFilterTest(unittest.TestCase):
+    def test_globs_match_at_any_depth_unless_anchored(self):
+        path_filter = PathFilter(['*.tmp', '/build', 'docs/*.pdf'])
+
+        self.assertTrue(path_filter.excludes('a.tmp', False))
+        self.assertTrue(path_filter.excludes(os.path.join('a', 'b', 'c.tmp'), False))
+        self.assertTrue(path_filter.excludes('build', True))
+        self.assertFalse(path_filter.excludes(os.path.join('src', 'build'), True))
+        self.assertTrue(path_filter.excludes(os.path.join('docs', 'manual.pdf'), False))
+        self.assertFalse(path_filter.excludes(os.path.join('other', 'docs', 'manual.pdf'), False))
+        self.assertFalse(path_filter.excludes('a.txt', False))
+
+
+    def test_directory_rules_only_match_folders(self):
+        path_filter = PathFilter(['cache/'])
+
+        self.assertTrue(path_filter.excludes('cache', True))
+        self.assertFalse(path_filter.excludes('cache', False))
+        self.assertTrue(path_filter.excludes(os.path.join('cache', 'entry'), False))
+
+
+    def test_double_star_matches_across_folders(self):
+        path_filter = PathFilter(['logs/**/*.log'])
+
+        self.assertTrue(path_filter.excludes(os.path.join('logs', 'a.log'), False))
+        self.assertTrue(path_filter.excludes(os.path.join('logs', 'a', 'b', 'c.log'), False))
+        self.assertFalse(path_filter.excludes(os.path.join('logs', 'a', 'b', 'c.txt'), False))
+
+
+    def test_last_matching_rule_decides(self):
+        path_filter = PathFilter(['*.log', '!keep.log'])
+
+        self.assertTrue(path_filter.excludes('drop.log', False))
+        self.assertFalse(path_filter.excludes('keep.log', False))
+        self.assertFalse(path_filter.excludes(os.path.join('a', 'keep.log'), False))
+
+
+    def test_files_in_excluded_folders_cannot_be_included_again(self):
+        path_filter = PathFilter(['node_modules/', '!keep.log'])
+
+        self.assertTrue(path_filter.excludes('node_modules', True))
+        self.assertTrue(path_filter.excludes(os.path.join('node_modules', 'keep.log'), False))
+        self.assertTrue(path_filter.excludes(os.path.join('node_modules', 'a', 'keep.log'), False))
+        self.assertFalse(path_filter.excludes('keep.log', False))
+
+
+    def test_size_and_age_rules_use_the_stat(self):
+        path_filter = PathFilter(['size>1K', 'age>1d'])
+        stat_result = os.stat_result((0o100644, 0, 0, 1, 0, 0, 2048, 0, 0, 0))
+
+        self.assertTrue(path_filter.excludes('big', False, stat_result))
+        self.assertFalse(path_filter.excludes('big', False))
+        self.assertFalse(path_filter.excludes('folder', True, stat_result))
+
+
+    def test_fingerprint_changes_with_the_rules(self):
+        self.assertEqual(PathFilter(['*.tmp']).fingerprint(), PathFilter(['*.tmp']).fingerprint())
+        self.assertNotEqual(PathFilter(['*.tmp']).fingerprint(), PathFilter(['*.log']).fingerprint())
+        self.assertTrue(PathFilter(['# comment', '']).is_empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src import journal
+from src.journal import OperationJournal
+from src.manifest import ReplicaManifest
+from src.copy_backend import TEMPORARY_PREFIX
+from src.synchronization import duplicate_source, replay_journal
+
+
+class OperationJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.directory, 'oplog')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_unfinished_operations_survive_a_restart(self):
+        operations = OperationJournal(self.journal_path)
+        done, pending = operations.begin([('create', ['a']), ('move', ['b', os.path.join('c', 'b')])])
+        operations.finish(done)
+        operations.mark_done(operations.take_finished())
+        operations.close()
+
+        reopened = OperationJournal(self.journal_path)
+        self.assertEqual(reopened.unfinished_paths(), ['b', os.path.join('c', 'b')])
+        self.assertGreater(reopened.begin([('delete', ['d'])])[0], pending)
+        reopened.close()
+
+
+    def test_finished_operations_stay_open_until_marked_done(self):
+        operations = OperationJournal(self.journal_path)
+        operation_id, = operations.begin([('create', ['a'])])
+        operations.finish(operation_id)
+        self.assertEqual(operations.unfinished_paths(), ['a'])
+
+        operations.mark_done(operations.take_finished())
+        self.assertEqual(operations.unfinished_paths(), [])
+        operations.close()
+
+
+    def test_torn_line_is_ignored(self):
+        operations = OperationJournal(self.journal_path)
+        operations.begin([('create', ['a'])])
+        operations.close()
+        with open(self.journal_path, 'a', encoding='utf-8') as file:
+            file.write('["begin", 2, "crea')
+
+        reopened = OperationJournal(self.journal_path)
+        self.assertEqual(reopened.unfinished_paths(), ['a'])
+        reopened.close()
+
+
+    def test_compaction_keeps_the_unfinished_operations(self):
+        compact_size:int = journal.COMPACT_SIZE
+        journal.COMPACT_SIZE = 0
+        try:
+            operations = OperationJournal(self.journal_path)
+            operations.begin([('create', ['kept'])])
+            finished = operations.begin([('create', [f'done{index}']) for index in range(10)])
+            for operation_id in finished:
+                operations.finish(operation_id)
+            operations.mark_done(operations.take_finished())
+            operations.close()
+        finally:
+            journal.COMPACT_SIZE = compact_size
+
+        with open(self.journal_path, encoding='utf-8') as file:
+            self.assertEqual(len(file.readlines()), 1)
+        reopened = OperationJournal(self.journal_path)
+        self.assertEqual(reopened.unfinished_paths(), ['kept'])
+        reopened.close()
+
+
+class ReplayJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source')
+        self.replica = os.path.join(self.directory, 'replica')
+        os.makedirs(os.path.join(self.source, 'd'))
+        os.makedirs(self.replica)
+        with open(os.path.join(self.source, 'kept'), 'w') as file:
+            file.write('kept')
+
+        manifest = ReplicaManifest(self.replica)
+        duplicate_source(self.source, self.replica, manifest)
+        manifest.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_unfinished_copy_is_repaired_after_a_crash(self):
+        rel_path:str = os.path.join('d', 'new')
+        with open(os.path.join(self.source, rel_path), 'w') as file:
+            file.write('new')
+
+        # A run started copying the file and stopped before renaming its temporary copy into place
+        manifest = ReplicaManifest(self.replica)
+        manifest.journal.begin([('create', [rel_path])])
+        temporary_path:str = os.path.join(self.replica, 'd', TEMPORARY_PREFIX + 'partial')
+        with open(temporary_path, 'w') as file:
+            file.write('ne')
+        manifest.close()
+
+        manifest = ReplicaManifest(self.replica)
+        try:
+            self.assertEqual(replay_journal(self.source, self.replica, manifest), 1)
+            self.assertEqual(manifest.journal.unfinished_paths(), [])
+            self.assertIsNotNone(manifest.get(rel_path))
+            self.assertEqual(replay_journal(self.source, self.replica, manifest), 0)
+        finally:
+            manifest.close()
+
+        self.assertFalse(os.path.exists(temporary_path))
+        with open(os.path.join(self.replica, rel_path)) as file:
+            self.assertEqual(file.read(), 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.manifest import ReplicaManifest
+
+
+class ReplicaManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.replica = os.path.join(self.directory, 'replica')
+        os.makedirs(self.replica)
+        self.manifest = ReplicaManifest(self.replica)
+
+        # Siblings sharing a prefix with the folder 'a' must never be caught by its subtree bounds
+        for rel_path in ('a', os.path.join('a', 'b'), 'a-b', 'ab'):
+            os.makedirs(os.path.join(self.replica, rel_path), exist_ok=True)
+        for rel_path in (os.path.join('a', 'f'), os.path.join('a', 'b', 'g'), 'a.txt', os.path.join('a-b', 'h'), os.path.join('ab', 'i')):
+            with open(os.path.join(self.replica, rel_path), 'w') as file:
+                file.write(rel_path)
+        self.manifest.rebuild()
+
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.directory)
+
+
+    def test_rebuild_records_the_replica(self):
+        self.assertEqual(set(self.manifest.entries()), {
+            'a', os.path.join('a', 'b'), os.path.join('a', 'f'), os.path.join('a', 'b', 'g'),
+            'a.txt', 'a-b', os.path.join('a-b', 'h'), 'ab', os.path.join('ab', 'i'),
+        })
+        self.assertEqual(set(self.manifest.children('')), {'a', 'a.txt', 'a-b', 'ab'})
+        self.assertEqual(set(self.manifest.children('a')), {'b', 'f'})
+        self.assertEqual(self.manifest.get('a.txt').size, len('a.txt'))
+
+
+    def test_remove_drops_the_subtree_only(self):
+        self.manifest.remove('a')
+
+        self.assertEqual(set(self.manifest.entries()), {'a.txt', 'a-b', os.path.join('a-b', 'h'), 'ab', os.path.join('ab', 'i')})
+
+
+    def test_rename_moves_the_subtree_and_its_parents(self):
+        self.manifest.rename('a', os.path.join('ab', 'moved'))
+
+        entries = self.manifest.entries()
+        self.assertNotIn('a', entries)
+        self.assertNotIn(os.path.join('a', 'f'), entries)
+        self.assertIn('a.txt', entries)
+        self.assertIn(os.path.join('a-b', 'h'), entries)
+        self.assertEqual(set(self.manifest.children(os.path.join('ab', 'moved'))), {'b', 'f'})
+        self.assertEqual(set(self.manifest.children(os.path.join('ab', 'moved', 'b'))), {'g'})
+
+
+    def test_rename_replaces_the_destination_subtree(self):
+        self.manifest.rename(os.path.join('a', 'b'), 'ab')
+
+        self.assertEqual(set(self.manifest.children('ab')), {'g'})
+        self.assertIsNone(self.manifest.get(os.path.join('ab', 'i')))
+        self.assertEqual(set(self.manifest.children('a')), {'f'})
+
+
+    def test_entries_after_pages_in_path_order(self):
+        paths:list = []
+        rel_path:str = ''
+        while page := self.manifest.entries_after(rel_path, 2):
+            paths += [path for path, _ in page]
+            rel_path = page[-1][0]
+
+        self.assertEqual(paths, sorted(self.manifest.entries()))
+
+
+    def test_checkpoint_is_taken_once_with_the_same_rules(self):
+        self.manifest.save_checkpoint(123, 'rules')
+        self.assertEqual(self.manifest.take_checkpoint('rules'), 123)
+        self.assertIsNone(self.manifest.take_checkpoint('rules'))
+
+        self.manifest.save_checkpoint(123, 'rules')
+        self.assertIsNone(self.manifest.take_checkpoint('other rules'))
+
+
+    def test_entries_survive_a_restart(self):
+        self.manifest.close()
+        self.manifest = ReplicaManifest(self.replica)
+
+        self.assertEqual(len(self.manifest.entries()), 9)
+        self.assertFalse(self.manifest.is_empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.manifest import ReplicaManifest
+from src.synchronization import duplicate_source, plan_replica_update, update_replica_directory
+
+
+class MoveDetectionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source')
+        self.replica = os.path.join(self.directory, 'replica')
+        os.makedirs(os.path.join(self.source, 'a', 'b'))
+        os.makedirs(os.path.join(self.source, 'c'))
+        os.makedirs(self.replica)
+        for rel_path in (os.path.join('a', 'b', 'f'), 'x'):
+            with open(os.path.join(self.source, rel_path), 'w') as file:
+                file.write(rel_path)
+
+        self.manifest = ReplicaManifest(self.replica)
+        duplicate_source(self.source, self.replica, self.manifest)
+
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.directory)
+
+
+    def test_source_inodes_are_recorded(self):
+        source_inode:int = os.stat(os.path.join(self.source, 'x')).st_ino
+
+        self.assertEqual(self.manifest.get('x').source_inode, source_inode)
+        self.assertEqual([rel_path for rel_path, _ in self.manifest.with_source_inode(source_inode)], ['x'])
+
+
+    def test_moved_paths_are_moved_in_the_replica(self):
+        replica_inode:int = os.stat(os.path.join(self.replica, 'a', 'b', 'f')).st_ino
+        os.rename(os.path.join(self.source, 'a'), os.path.join(self.source, 'c', 'a2'))
+        os.rename(os.path.join(self.source, 'x'), os.path.join(self.source, 'y'))
+
+        moves:set = {(planned.origin, planned.rel_path) for planned in plan_replica_update(self.source, self.replica, self.manifest)
+                     if planned.action == 'move'}
+        self.assertEqual(moves, {('a', os.path.join('c', 'a2')), ('x', 'y')})
+
+        update_replica_directory(self.source, self.replica, self.manifest)
+
+        moved_path:str = os.path.join(self.replica, 'c', 'a2', 'b', 'f')
+        self.assertEqual(os.stat(moved_path).st_ino, replica_inode)
+        self.assertFalse(os.path.exists(os.path.join(self.replica, 'a')))
+        self.assertFalse(os.path.exists(os.path.join(self.replica, 'x')))
+        with open(os.path.join(self.replica, 'y')) as file:
+            self.assertEqual(file.read(), 'x')
+        self.assertIsNotNone(self.manifest.get(os.path.join('c', 'a2', 'b', 'f')))
+        self.assertIsNone(self.manifest.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+import unittest
+from src.coalesce import make_change
+from src.parallel_apply import build_dependencies, run_with_dependencies, touched_paths
+
+
+ROOT = os.path.join(os.sep, 'source')
+
+
+def path(*names:str) -> str:
+    return os.path.join(ROOT, *names)
+
+
+class BuildDependenciesTest(unittest.TestCase):
+    def test_touched_paths_include_the_destination(self):
+        self.assertEqual(touched_paths(make_change('renamed', path('a'), True, path('b'))), [path('a'), path('b')])
+        self.assertEqual(touched_paths(make_change('moved', path('a'), True, path('d'))), [path('a'), path('d', 'a')])
+        self.assertEqual(touched_paths(make_change('modified', path('a'), True)), [path('a')])
+
+
+    def test_unrelated_changes_are_independent(self):
+        changes = [make_change('modified', path('a'), True), make_change('created', path('b'), True), make_change('deleted', path('c'), True)]
+        self.assertEqual(build_dependencies(changes), [set(), set(), set()])
+
+
+    def test_children_wait_for_their_folder(self):
+        changes = [
+            make_change('created', path('d'), False),
+            make_change('created', path('d', 'f'), True),
+            make_change('created', path('d', 'e', 'g'), True),
+        ]
+        self.assertEqual(build_dependencies(changes), [set(), {0}, {0}])
+
+
+    def test_folder_change_waits_for_the_changes_below_it(self):
+        changes = [
+            make_change('modified', path('d', 'f'), True),
+            make_change('modified', path('d', 'g'), True),
+            make_change('renamed', path('d'), False, path('e')),
+            make_change('modified', path('e', 'f'), True),
+        ]
+        self.assertEqual(build_dependencies(changes), [set(), set(), {0, 1}, {2}])
+
+
+    def test_rename_waits_for_both_of_its_paths(self):
+        changes = [
+            make_change('modified', path('a'), True),
+            make_change('modified', path('b'), True),
+            make_change('renamed', path('a'), True, path('b')),
+        ]
+        self.assertEqual(build_dependencies(changes), [set(), set(), {0, 1}])
+
+
+class RunWithDependenciesTest(unittest.TestCase):
+    def test_tasks_start_after_their_prerequisites(self):
+        finished:list = []
+        lock = threading.Lock()
+
+        def task(index:int, delay:float):
+            def run() -> None:
+                time.sleep(delay)
+                with lock:
+                    finished.append(index)
+            return run
+
+        tasks = [task(0, 0.05), task(1, 0.0), task(2, 0.0), task(3, 0.0)]
+        run_with_dependencies(tasks, [set(), {0}, set(), {1, 2}], max_workers=4)
+
+        self.assertEqual(sorted(finished), [0, 1, 2, 3])
+        self.assertLess(finished.index(0), finished.index(1))
+        self.assertLess(finished.index(1), finished.index(3))
+        self.assertLess(finished.index(2), finished.index(3))
+
+
+    def test_at_most_max_workers_tasks_run_at_once(self):
+        lock = threading.Lock()
+        running:list = [0, 0]   # Tasks running now, most running at once
+
+        def run() -> None:
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        run_with_dependencies([run] * 12, [set()] * 12, max_workers=3)
+
+        self.assertGreater(running[1], 0)
+        self.assertLessEqual(running[1], 3)
+
+
+    def test_a_failing_task_still_releases_its_dependents(self):
+        finished:list = []
+
+        def fail() -> None:
+            raise OSError('failed')
+
+        run_with_dependencies([fail, lambda: finished.append(1)], [set(), {0}], max_workers=2)
+        self.assertEqual(finished, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from src.input_validation import split_arguments, replica_paths, filter_rules
+from src.manifest import ReplicaManifest, MANIFEST_FILENAME
+from src.merkle import LiveTree, ManifestTree, diff_trees
+from typing import Dict, List
+import sys
+import sqlite3
+import os
+
+
+VERIFY_OPTIONS = {
+    '--replicas=<path,...>': 'Additional replica folders, their manifests are also compared with each other.',
+    '--filter-file=<path>': 'Filter rules used by the synchronization, the excluded source paths are not compared.',
+    '--exclude=<pattern,...>': 'Comma-separated rules added after those of the filter file.',
+    '--manifest-only': 'Compare the source with the manifests without walking the replicas.',
+}
+
+# Wording of the differences reported by diff_trees for each comparison
+SOURCE_DIFFERENCES = {'only left': 'not in the replica', 'only right': 'deleted from the source', 'type differs': 'type changed in the source', 'differs': 'modified in the source'}
+REPLICA_DIFFERENCES = {'only left': 'not in the manifest', 'only right': 'missing from the replica', 'type differs': 'type changed in the replica', 'differs': 'modified in the replica'}
+MANIFEST_DIFFERENCES = {'only left': 'only in the first replica', 'only right': 'only in the second replica', 'type differs': 'type differs', 'differs': 'differs'}
+
+
+def show_usage() -> None:
+    print("Usage: python verify.py <Source Folder Path> <Replica Folder Path> [options]")
+    print("\nCompares the source and the replicas with the folder digests kept in the replica manifests.")
+    print("Exits with 0 when everything matches and 1 when differences were found.\n")
+    print("Options:")
+    for option, description in VERIFY_OPTIONS.items():
+        print(f"  {option} - {description}")
+    print()
+
+
+def report(left, right, differences:Dict[str, str], label:str) -> int:
+    """
+    Prints the paths that differ between two trees and returns their number.
+    """
+    count:int = 0
+    for rel_path, difference in diff_trees(left, right):
+        print(f"[VERIFY] {label}: {rel_path} ({differences[difference]})")
+        count += 1
+    return count
+
+
+def verify(source_directory_path:str, replica_directory_paths:List[str], path_filter=None, manifest_only:bool = False) -> int:
+    """
+    Compares the source and every replica with the replica manifests, returning the number of differences.
+
+    Args:
+    - source_directory_path: Path to the source directory.
+    - replica_directory_paths: Paths to the replica directories, each with the manifest of a previous synchronization.
+    - path_filter: Optional PathFilter of the synchronization.
+    - manifest_only: Skip the walk of the replicas.
+
+    The manifests are opened read-only, so a synchronization can keep running on the same replicas.
+
+    The source and each replica are walked once to compute their folder digests. The comparisons only descend into
+    the folders whose digests differ, and the manifests of several replicas are compared without reading their
+    unchanged folders at all.
+    """
+    source_tree:LiveTree = LiveTree(source_directory_path, path_filter)
+    print(f"[VERIFY] Source digest: {source_tree.digest()}")
+
+    manifests:List[ReplicaManifest] = [ReplicaManifest(path, read_only=True) for path in replica_directory_paths]
+    differences:int = 0
+
+    try:
+        for replica_directory_path, manifest in zip(replica_directory_paths, manifests):
+            manifest_tree:ManifestTree = ManifestTree(manifest, path_filter)
+            print(f"[VERIFY] Manifest digest: {manifest.digest()} ({replica_directory_path})")
+
+            differences += report(source_tree, manifest_tree, SOURCE_DIFFERENCES, f"Not synchronized to {replica_directory_path}")
+
+            if not manifest_only:
+                differences += report(LiveTree(replica_directory_path), ManifestTree(manifest), REPLICA_DIFFERENCES, "Drift")
+
+        for index, manifest in enumerate(manifests[1:], start=1):
+            if manifest.digest() != manifests[0].digest():
+                differences += report(ManifestTree(manifests[0]), ManifestTree(manifest), MANIFEST_DIFFERENCES,
+                                      f"{replica_directory_paths[0]} and {replica_directory_paths[index]}")
+
+    finally:
+        for manifest in manifests:
+            manifest.close()
+
+    return differences
+
+
+def main() -> None:
+    arguments, options = split_arguments(sys.argv[1:])
+    known:List[str] = [name.split('=')[0] for name in VERIFY_OPTIONS]
+
+    if len(arguments) != 2 or any(option not in known for option in options):
+        show_usage()
+        sys.exit(1)
+
+    source_directory_path:str = arguments[0]
+    replica_directory_paths:List[str] = [arguments[1]] + replica_paths(options)
+
+    if not os.path.isdir(source_directory_path):
+        print(f"Error: The Original Folder Path '{source_directory_path}' is invalid.")
+        sys.exit(1)
+
+    for path in replica_directory_paths:
+        if not os.path.isfile(os.path.join(path, MANIFEST_FILENAME)):
+            print(f"Error: The Replica Folder Path '{path}' has no manifest, it was never synchronized.")
+            sys.exit(1)
+
+    path_filter = filter_rules(options)
+    try:
+        differences:int = verify(source_directory_path, replica_directory_paths, None if path_filter.is_empty() else path_filter,
+                                 bool(options.get('--manifest-only')))
+    except sqlite3.Error as e:
+        print(f"Error: Reading the replica manifests: {e}")
+        sys.exit(1)
+
+    print(f"[VERIFY] {differences} differences" if differences else "[VERIFY] Source and replicas match")
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == "__main__":
+    main()